@@ -0,0 +1,96 @@
+import threading
+from bisect import bisect_left
+from functools import lru_cache
+
+from django.db.models import Q
+
+from .models import DataVersion, Product
+
+# 每次最多返回的结果数
+AUTOCOMPLETE_LIMIT = 20
+# 缓存结果的热门前缀数量（扫码枪输入时同一前缀会被连续查询）
+HOT_PREFIX_CACHE_SIZE = 2048
+# 参与匹配的字段，排在前面的字段匹配时排名更靠前
+INDEXED_FIELDS = ('sku', 'fnsku', 'name', 'series')
+
+
+class ProductPrefixIndex:
+    """产品自动补全的进程内前缀索引
+
+    每个字段保存一个按小写值排序的列表，用二分查找定位前缀区间，与产品数量无关。
+    排名：完全匹配优先于前缀匹配，其次按字段顺序（店铺SKU、FNSKU、产品SKU、系列），再按值排序。
+    """
+
+    def __init__(self, rows, version=None):
+        self.version = version
+        self.labels = {}
+        entries = [[] for _ in INDEXED_FIELDS]
+        for product_id, *values in rows:
+            sku, name = values[0], values[2]
+            self.labels[product_id] = f'{sku} ({name})'
+            for field_entries, value in zip(entries, values):
+                if value:
+                    field_entries.append((value.casefold(), product_id))
+        self.fields = []
+        for field_entries in entries:
+            field_entries.sort()
+            self.fields.append(([key for key, _ in field_entries], [product_id for _, product_id in field_entries]))
+        # 索引重建时整个对象被替换，缓存随之失效
+        self.search = lru_cache(maxsize=HOT_PREFIX_CACHE_SIZE)(self._search)
+
+    def _search(self, term, limit=AUTOCOMPLETE_LIMIT):
+        """term 必须已经是小写（casefold），返回 [(product_id, 显示文本), ...]"""
+        candidates = []
+        for priority, (keys, ids) in enumerate(self.fields):
+            i = bisect_left(keys, term)
+            end = min(i + limit, len(keys))
+            while i < end and keys[i].startswith(term):
+                candidates.append((keys[i] != term, priority, keys[i], ids[i]))
+                i += 1
+        candidates.sort()
+
+        results = []
+        seen = set()
+        for _, _, _, product_id in candidates:
+            if product_id not in seen:
+                seen.add(product_id)
+                results.append((product_id, self.labels[product_id]))
+                if len(results) >= limit:
+                    break
+        return tuple(results)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_product_index():
+    """返回当前的产品前缀索引，产品数据版本变化后重建"""
+    global _index
+    version = DataVersion.objects.current(Product)
+    index = _index
+    if index is None or index.version != version:
+        with _index_lock:
+            index = _index
+            if index is None or index.version != version:
+                index = ProductPrefixIndex(Product.objects.values_list('id', *INDEXED_FIELDS).iterator(), version)
+                _index = index
+    return index
+
+
+def autocomplete_products(term, limit=AUTOCOMPLETE_LIMIT):
+    """按店铺SKU、FNSKU、产品SKU和系列的前缀搜索产品，返回 [(product_id, 显示文本), ...]
+
+    没有前缀匹配时退回到数据库的包含匹配（关键字在中间的情况）。
+    """
+    term = term.strip().casefold()
+    if not term:
+        return []
+    results = list(get_product_index().search(term, limit))
+    if results:
+        return results
+
+    products = Product.objects.filter(
+        Q(sku__icontains=term) | Q(fnsku__icontains=term) | Q(name__icontains=term)
+    ).order_by('sku').values_list('id', 'sku', 'name')[:limit]
+    return [(product_id, f'{sku} ({name})') for product_id, sku, name in products]
@@ -0,0 +1,538 @@
+import csv
+import io
+import math
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import ExitStack
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.paginator import Paginator
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connections, models, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .jobs import run_import_job
+from .middleware import QueryCounter
+from .models import (Product, Warehouse, StockMovement, IncomingStock, ProductionOrder, ImportJob, DataVersion,
+                     rebuild_ledger_read_models)
+from .services import allocate_incoming_stock
+from .views import PRODUCTS_PER_PAGE
+
+# 生成数据时每批插入的行数
+GENERATE_CHUNK_SIZE = 5000
+
+# GA/CA 是页面和导入模板中固定使用的仓库代码，必须存在
+FIXED_WAREHOUSES = [('亚特兰大仓', 'GA'), ('加州仓', 'CA')]
+SERIES = ['经典', '运动', '户外', '商务', '儿童', '限定']
+SEASONS = ['春', '夏', '秋', '冬', '全年']
+
+# 基准测试使用的页面缓存别名，不清空也不写入站点共享的页面缓存
+BENCHMARK_CACHE_ALIAS = 'inventory-benchmark'
+
+# 锁竞争测试：导入期间各读取线程轮流请求的页面，以及默认导入的库存变动行数
+CONTENTION_READ_URLS = ('inventory:product_list', 'inventory:stock_movement_list', 'inventory:stock_positions')
+CONTENTION_IMPORT_ROWS = 50000
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def generate_dataset(products=1000, warehouses=4, movements=100000, incoming=2000, orders=2000,
+                     days=365, seed=1, chunk_size=GENERATE_CHUNK_SIZE, log=None):
+    """生成基准测试数据集
+
+    库存变动按日期顺序分批插入，不逐批维护余额表，插入完成后一次重建库存余额和快照并递增数据版本；
+    入库途中记录按先进先出扣减生产订单并记录分配明细。返回各表新增的行数。
+    """
+    log = log or (lambda message: None)
+    rng = random.Random(seed)
+    today = timezone.now().date()
+    prefix = f'BM{seed}'
+
+    warehouse_objs = [Warehouse.objects.get_or_create(code=code, defaults={'name': name})[0]
+                      for name, code in FIXED_WAREHOUSES]
+    for i in range(len(warehouse_objs), warehouses):
+        code = f'{prefix}-WH{i + 1}'
+        warehouse_objs.append(Warehouse.objects.get_or_create(code=code, defaults={'name': f'仓库{i + 1}'})[0])
+    warehouse_ids = [warehouse.pk for warehouse in warehouse_objs[:max(warehouses, len(FIXED_WAREHOUSES))]]
+
+    new_products = []
+    for i in range(products):
+        series = rng.choice(SERIES)
+        new_products.append(Product(
+            sku=f'{prefix}-{i:07d}', fnsku=f'X{seed:03d}{i:07d}', name=f'{series}-{i // 4:06d}',
+            series=series, season=rng.choice(SEASONS),
+            weight=rng.randint(1, 200) / 10, length=rng.randint(5, 40), width=rng.randint(5, 30),
+            height=rng.randint(1, 20), low_stock_threshold=rng.choice([5, 10, 20, 50]),
+        ))
+    for batch in _chunks(new_products, chunk_size):
+        Product.objects.bulk_create(batch)
+    product_ids = list(Product.objects.filter(sku__startswith=f'{prefix}-').values_list('pk', flat=True))
+    log(f'产品 {len(product_ids)} 个')
+
+    # 按日期升序生成，主键顺序与日期一致；入库多于出库，库存大体为正
+    # 直接用基础QuerySet插入，跳过逐批的余额维护和版本号递增，最后一次重建并递增版本号
+    insert_movements = models.QuerySet(StockMovement).bulk_create
+    start_date = today - timedelta(days=days)
+    created = 0
+    while created < movements:
+        size = min(chunk_size, movements - created)
+        batch = []
+        for offset in range(size):
+            day = start_date + timedelta(days=(created + offset) * days // max(movements, 1))
+            movement_type = 'IN' if rng.random() < 0.6 else 'OUT'
+            batch.append(StockMovement(
+                product_id=rng.choice(product_ids), warehouse_id=rng.choice(warehouse_ids),
+                movement_type=movement_type, quantity=rng.randint(1, 100), date=day,
+                notes=rng.choice(['', '', '补货', '订单出库', '盘点调整', '退货入库']),
+            ))
+        with transaction.atomic():
+            insert_movements(batch)
+        created += size
+        if created % (chunk_size * 20) == 0 or created == movements:
+            log(f'库存变动 {created}/{movements}')
+    if movements:
+        with transaction.atomic():
+            rebuild_ledger_read_models()
+            DataVersion.objects.bump(StockMovement)
+        log('已重建库存余额和快照')
+
+    new_orders = [
+        ProductionOrder(product_id=rng.choice(product_ids), order_number=f'{prefix}-PO{i:07d}',
+                        quantity=(quantity := rng.randint(50, 500)), remaining_quantity=quantity)
+        for i in range(orders)
+    ]
+    for batch in _chunks(new_orders, chunk_size):
+        ProductionOrder.objects.bulk_create(batch)
+    log(f'生产订单 {len(new_orders)} 条')
+
+    new_incoming = [
+        IncomingStock(
+            product_id=rng.choice(product_ids), warehouse_id=rng.choice(warehouse_ids[:len(FIXED_WAREHOUSES)]),
+            quantity=rng.randint(10, 200), expected_arrival_date=today + timedelta(days=rng.randint(-10, 60)),
+            status='待入库' if rng.random() < 0.7 else '已入库', notes=rng.choice(['', '海运', '空运']),
+        )
+        for _ in range(incoming)
+    ]
+    for batch in _chunks(new_incoming, chunk_size):
+        with transaction.atomic():
+            IncomingStock.objects.bulk_create(batch)
+            allocate_incoming_stock([incoming_stock for incoming_stock in batch if incoming_stock.status == '待入库'])
+    log(f'入库途中记录 {len(new_incoming)} 条')
+
+    return {
+        'products': len(new_products), 'warehouses': len(warehouse_ids), 'stock_movements': movements,
+        'production_orders': len(new_orders), 'incoming_stock': len(new_incoming),
+    }
+
+
+def benchmark_cache_settings(warm_cache=False):
+    """让页面缓存使用基准测试自己的缓存别名的设置
+
+    不预热时使用 DummyCache，每次请求都重新计算页面；预热时使用进程内的 LocMemCache，测量命中缓存的耗时。
+    """
+    backend = 'locmem.LocMemCache' if warm_cache else 'dummy.DummyCache'
+    caches = dict(settings.CACHES)
+    caches[BENCHMARK_CACHE_ALIAS] = {'BACKEND': f'django.core.cache.backends.{backend}', 'LOCATION': BENCHMARK_CACHE_ALIAS}
+    return {'CACHES': caches, 'VIEW_CACHE_ALIAS': BENCHMARK_CACHE_ALIAS}
+
+
+def percentile(values, q):
+    """最近秩法计算百分位数"""
+    values = sorted(values)
+    return values[max(math.ceil(q * len(values)) - 1, 0)]
+
+
+def _csv_upload(name, headers, rows):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(headers)
+    writer.writerows(rows)
+    return SimpleUploadedFile(name, output.getvalue().encode('utf-8-sig'), content_type='text/csv')
+
+
+def import_files(rows=1000, seed=1, notes='基准测试'):
+    """根据现有数据生成四种导入文件（CSV），返回 {导入类型: 生成上传文件的函数}
+
+    notes 为库存变动的备注，可用来找出导入的记录。
+    """
+    rng = random.Random(seed)
+    skus = list(Product.objects.order_by('?').values_list('sku', flat=True)[:rows]) or ['BM-NONE']
+    today = timezone.now().date().isoformat()
+    suffix = int(time.time() * 1000)
+
+    def products():
+        return _csv_upload('products.csv', ['店铺SKU', 'FNSKU', '产品SKU', '系列', '季节', '重量(lb)', '长度(inch)',
+                                            '宽度(inch)', '高度(inch)', '亚特兰大仓库存', '加州仓库存'], [
+            [f'BMI-{suffix}-{i}', '', f'导入-{i}', rng.choice(SERIES), rng.choice(SEASONS), 1.5, 10, 8, 4, 5, 0]
+            for i in range(rows)
+        ])
+
+    def stock_movements():
+        return _csv_upload('movements.csv', ['日期(YYYY-MM-DD)', '仓库代码', '店铺SKU', '数量', '类型(IN/OUT)', '备注(可选)'], [
+            [today, rng.choice(['GA', 'CA']), rng.choice(skus), rng.randint(1, 20), 'IN', notes]
+            for _ in range(rows)
+        ])
+
+    def incoming_stock():
+        return _csv_upload('incoming.csv', ['店铺SKU', '仓库代码', '数量', '预计入仓时间(YYYY-MM-DD)', '备注(可选)'], [
+            [rng.choice(skus), rng.choice(['GA', 'CA']), rng.randint(1, 50), today, '']
+            for _ in range(rows)
+        ])
+
+    def production_orders():
+        return _csv_upload('orders.csv', ['店铺SKU', '订单号', '数量'], [
+            [rng.choice(skus), f'BMI-{suffix}-PO{i}', rng.randint(10, 100)]
+            for i in range(rows)
+        ])
+
+    return {'products': products, 'stock_movements': stock_movements,
+            'incoming_stock': incoming_stock, 'production_orders': production_orders}
+
+
+class BenchmarkRunner:
+    """用Django测试客户端逐个请求视图，统计延迟、查询次数和内存峰值
+
+    会修改数据的请求（导入、批量操作）在事务中执行并回滚，不影响数据集。
+    页面缓存使用独立的缓存（见 benchmark_cache_settings）：默认测量计算页面的耗时，
+    warm_cache=True 时测量重复访问（命中缓存）的耗时。
+    """
+
+    def __init__(self, repeat=5, import_rows=1000, only=None, log=None, warm_cache=False):
+        self.repeat = repeat
+        self.warm_cache = warm_cache
+        self.import_rows = import_rows
+        self.only = only
+        self.log = log or (lambda message: None)
+        self.client = Client()
+        user, _ = get_user_model().objects.get_or_create(username='benchmark', defaults={'is_staff': True})
+        self.client.force_login(user)
+        self.user = user
+
+    def _request(self, method, url, data=None):
+        """发送一次请求并读取完整响应，返回 (状态码, 查询次数, 响应字节数)"""
+        counter = QueryCounter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            if method == 'import':
+                return self._import(url, data, counter)
+            response = getattr(self.client, method)(url, data or {})
+            if response.streaming:
+                size = sum(len(chunk) for chunk in response.streaming_content)
+            else:
+                size = len(response.content)
+        return response.status_code, counter.count, size
+
+    def _import(self, url, data, counter):
+        """上传文件并在当前进程中执行导入任务，即请求加上后台进程的完整工作量"""
+        response = self.client.post(url, data)
+        job = ImportJob.objects.filter(created_by=self.user).latest('pk')
+        job = run_import_job(job)
+        status = response.status_code if job.status == ImportJob.STATUS_DONE else 500
+        return status, counter.count, job.success_count
+
+    def measure(self, name, method, url, data=None, rollback=False):
+        """预热一次，计时 repeat 次，再在 tracemalloc 下运行一次得到内存峰值
+
+        data 可以是返回请求数据的函数（上传文件每次都要重新生成）。
+        """
+        def once():
+            payload = data() if callable(data) else data
+            if not rollback:
+                return self._request(method, url, payload)
+            with transaction.atomic():
+                result = self._request(method, url, payload)
+                transaction.set_rollback(True)
+            return result
+
+        once()
+        timings = []
+        queries = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            status, query_count, size = once()
+            timings.append((time.perf_counter() - start) * 1000)
+            queries.append(query_count)
+
+        tracemalloc.start()
+        try:
+            once()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        result = {
+            'name': name, 'method': method.upper(), 'url': url, 'status': status,
+            'p50_ms': round(percentile(timings, 0.5), 2), 'p95_ms': round(percentile(timings, 0.95), 2),
+            'min_ms': round(min(timings), 2), 'max_ms': round(max(timings), 2),
+            'queries': max(queries), 'response_bytes': size, 'peak_memory_kb': round(peak / 1024),
+        }
+        self.log(f"{name}: p50 {result['p50_ms']}ms p95 {result['p95_ms']}ms, "
+                 f"{result['queries']} 次查询, 峰值内存 {result['peak_memory_kb']}KB")
+        return result
+
+    def cases(self):
+        """返回 [(名称, 方法, URL, 数据, 是否回滚), ...]"""
+        product = Product.objects.order_by('pk').first()
+        warehouse = Warehouse.objects.order_by('pk').first()
+        movement = StockMovement.objects.order_by('-pk').first()
+        incoming = IncomingStock.objects.order_by('-pk').first()
+        order = ProductionOrder.objects.order_by('-pk').first()
+        last_day = timezone.now().date().isoformat()
+        # 产品列表的分页不识别 page=last（会回到第1页），按产品数计算最后一页的页码
+        last_page = Paginator(range(Product.objects.count()), PRODUCTS_PER_PAGE).num_pages
+        files = import_files(self.import_rows)
+
+        cases = [
+            ('dashboard', 'get', reverse('inventory:dashboard'), None, False),
+            ('product_list', 'get', reverse('inventory:product_list'), None, False),
+            ('product_list_sorted_by_stock', 'get', reverse('inventory:product_list'), {'sort': '-total_stock'}, False),
+            ('product_list_search', 'get', reverse('inventory:product_list'), {'search': 'BM'}, False),
+            ('product_list_last_page', 'get', reverse('inventory:product_list'), {'page': last_page}, False),
+            ('search_products', 'get', reverse('inventory:search_products'), {'term': 'BM'}, False),
+            ('stock_positions', 'get', reverse('inventory:stock_positions'), None, False),
+            ('warehouse_list', 'get', reverse('inventory:warehouse_list'), None, False),
+            ('stock_movement_list', 'get', reverse('inventory:stock_movement_list'), None, False),
+            ('historical_stock', 'get', reverse('inventory:historical_stock'), {'date': last_day}, False),
+            ('incoming_stock_list', 'get', reverse('inventory:incoming_stock_list'), None, False),
+            ('production_order_list', 'get', reverse('inventory:production_order_list'), None, False),
+            ('product_create_form', 'get', reverse('inventory:product_create'), None, False),
+            ('warehouse_create_form', 'get', reverse('inventory:warehouse_create'), None, False),
+            ('stock_movement_create_form', 'get', reverse('inventory:stock_movement_create'), None, False),
+            ('incoming_stock_create_form', 'get', reverse('inventory:incoming_stock_create'), None, False),
+            ('production_order_create_form', 'get', reverse('inventory:production_order_create'), None, False),
+        ]
+        if product:
+            cases.append(('product_edit_form', 'get', reverse('inventory:product_edit', args=[product.pk]), None, False))
+        if warehouse:
+            cases.append(('warehouse_edit_form', 'get', reverse('inventory:warehouse_edit', args=[warehouse.pk]), None, False))
+        if incoming:
+            cases.append(('incoming_stock_edit_form', 'get', reverse('inventory:incoming_stock_edit', args=[incoming.pk]), None, False))
+            cases.append(('incoming_stock_delete_confirm', 'get', reverse('inventory:incoming_stock_delete', args=[incoming.pk]), None, False))
+        if order:
+            cases.append(('production_order_edit_form', 'get', reverse('inventory:production_order_edit', args=[order.pk]), None, False))
+            cases.append(('production_order_delete_confirm', 'get', reverse('inventory:production_order_delete', args=[order.pk]), None, False))
+
+        for name in ['export_products', 'export_stock_movements', 'export_historical_stock',
+                     'export_incoming_stock', 'export_production_orders']:
+            for export_format in ['xlsx', 'csv']:
+                cases.append((f'{name}_{export_format}', 'get', reverse(f'inventory:{name}'), {'format': export_format}, False))
+
+        for name in ['download_product_template', 'download_stock_movement_template',
+                     'download_incoming_stock_template', 'download_production_order_template']:
+            cases.append((name, 'get', reverse(f'inventory:{name}'), None, False))
+
+        import_urls = {
+            'products': 'inventory:import_products', 'stock_movements': 'inventory:stock_movement_import',
+            'incoming_stock': 'inventory:import_incoming_stock', 'production_orders': 'inventory:import_production_orders',
+        }
+        for kind, url_name in import_urls.items():
+            url = reverse(url_name)
+            cases.append((f'import_{kind}_form', 'get', url, None, False))
+            cases.append((f'import_{kind}_dry_run', 'post', url,
+                          lambda make=files[kind]: {'file': make(), 'dry_run': '1', 'report_format': 'csv'}, False))
+            # 导入：上传并执行导入任务，size 为成功导入的行数
+            cases.append((f'import_{kind}', 'import', url, lambda make=files[kind]: {'file': make()}, True))
+
+        selected = list(IncomingStock.objects.filter(status='待入库').order_by('-pk').values_list('pk', flat=True)[:100])
+        if selected:
+            cases.append(('incoming_stock_batch_approve_100', 'post', reverse('inventory:incoming_stock_batch_approve'),
+                          {'selected_items': selected}, True))
+            cases.append(('incoming_stock_batch_delete_100', 'post', reverse('inventory:incoming_stock_batch_delete'),
+                          {'selected_items': selected}, True))
+        movements = list(StockMovement.objects.order_by('-pk').values_list('pk', flat=True)[:1000])
+        if movements:
+            cases.append(('stock_movement_batch_delete_1000', 'post', reverse('inventory:stock_movement_batch_delete'),
+                          {'selected_movements': movements}, True))
+        if movement:
+            cases.append(('stock_movement_delete', 'post', reverse('inventory:stock_movement_delete', args=[movement.pk]), None, True))
+        return cases
+
+    def run(self):
+        results = []
+        with override_settings(**benchmark_cache_settings(self.warm_cache)):
+            for name, method, url, data, rollback in self.cases():
+                if self.only and not any(pattern in name for pattern in self.only):
+                    continue
+                results.append(self.measure(name, method, url, data, rollback=rollback))
+        return results
+
+
+def _database_info():
+    from django.db import connection
+
+    if connection.vendor != 'sqlite':
+        return {'vendor': connection.vendor, 'version': None}
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode')
+        journal_mode = cursor.fetchone()[0]
+    return {'vendor': connection.vendor, 'version': '.'.join(map(str, connection.Database.sqlite_version_info)),
+            'journal_mode': journal_mode, 'transaction_mode': connection.transaction_mode}
+
+
+def run_benchmark(repeat=5, import_rows=1000, only=None, log=None, media_root=None, warm_cache=False):
+    """运行全部基准测试，返回可序列化为JSON的报告"""
+    import django
+
+    settings_override = {'ALLOWED_HOSTS': ['*'], 'REQUEST_METRICS_ENABLED': False}
+    if media_root:
+        settings_override['MEDIA_ROOT'] = media_root
+    with override_settings(**settings_override):
+        runner = BenchmarkRunner(repeat=repeat, import_rows=import_rows, only=only, log=log, warm_cache=warm_cache)
+        started = timezone.now()
+        results = runner.run()
+
+    return {
+        'started_at': started.isoformat(),
+        'django': django.get_version(),
+        'database': _database_info(),
+        'repeat': repeat,
+        'import_rows': import_rows,
+        'warm_cache': warm_cache,
+        'dataset': {
+            'products': Product.objects.count(), 'warehouses': Warehouse.objects.count(),
+            'stock_movements': StockMovement.objects.count(), 'incoming_stock': IncomingStock.objects.count(),
+            'production_orders': ProductionOrder.objects.count(),
+        },
+        'results': results,
+    }
+
+
+def _latency_summary(timings, errors, seconds):
+    return {
+        'requests': len(timings), 'errors': errors,
+        'requests_per_second': round(len(timings) / seconds, 1) if seconds else None,
+        'p50_ms': round(percentile(timings, 0.5), 2) if timings else None,
+        'p95_ms': round(percentile(timings, 0.95), 2) if timings else None,
+        'max_ms': round(max(timings), 2) if timings else None,
+    }
+
+
+class ContentionBenchmark:
+    """后台导入写入期间多个线程持续读取页面，与空闲时的读取延迟对比
+
+    导入由 run_import_worker 子进程处理（与生产环境相同，每批各自提交事务），读取线程各自使用独立的数据库连接；
+    需要数据库文件，不能用内存数据库。导入的库存变动带有本次测试专用的备注，测试结束后按备注删除。
+    """
+
+    def __init__(self, readers=4, import_rows=CONTENTION_IMPORT_ROWS, idle_seconds=5, log=None, warm_cache=False):
+        self.import_rows = import_rows
+        self.idle_seconds = idle_seconds
+        self.warm_cache = warm_cache
+        self.log = log or (lambda message: None)
+        self.user, _ = get_user_model().objects.get_or_create(username='benchmark', defaults={'is_staff': True})
+        self.urls = [reverse(name) for name in CONTENTION_READ_URLS]
+        # 在主线程中登录，读取线程只读不写
+        self.clients = []
+        for _ in range(readers):
+            client = Client()
+            client.force_login(self.user)
+            self.clients.append(client)
+
+    def _read_loop(self, client, stop, timings, errors):
+        try:
+            while not stop.is_set():
+                for url in self.urls:
+                    start = time.perf_counter()
+                    try:
+                        ok = client.get(url).status_code == 200
+                    except OperationalError:
+                        # 等待锁超过 busy_timeout（database is locked）
+                        ok = False
+                    if ok:
+                        timings.append((time.perf_counter() - start) * 1000)
+                    else:
+                        errors.append(url)
+        finally:
+            connections.close_all()
+
+    def _phase(self, name, work):
+        """读取线程运行期间在主线程执行 work()，返回这段时间的读取统计"""
+        stop = threading.Event()
+        timings, errors = [], []
+        threads = [threading.Thread(target=self._read_loop, args=(client, stop, timings, errors))
+                   for client in self.clients]
+        for thread in threads:
+            thread.start()
+        start = time.perf_counter()
+        try:
+            extra = work() or {}
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        seconds = time.perf_counter() - start
+        result = {'phase': name, 'seconds': round(seconds, 2), **_latency_summary(timings, len(errors), seconds), **extra}
+        self.log(f"{name}: {result['requests']} 次读取 ({result['requests_per_second']}/s), "
+                 f"p50 {result['p50_ms']}ms p95 {result['p95_ms']}ms, 失败 {result['errors']} 次")
+        return result
+
+    def _import(self, job):
+        worker = subprocess.run([sys.executable, str(settings.BASE_DIR / 'manage.py'), 'run_import_worker', '--once'],
+                                capture_output=True, text=True)
+        if worker.returncode:
+            raise RuntimeError(f'导入进程异常退出：{worker.stderr}')
+        # 已有其他导入进程在运行时，任务可能由它领取
+        job.refresh_from_db()
+        while not job.is_finished:
+            time.sleep(0.5)
+            job.refresh_from_db()
+        return {'import_status': job.status, 'imported_rows': job.success_count}
+
+    def run(self):
+        if ImportJob.objects.filter(status=ImportJob.STATUS_PENDING).exists():
+            raise RuntimeError('有待处理的导入任务，导入进程会先处理这些任务，请处理完后再运行锁竞争测试')
+
+        with override_settings(**benchmark_cache_settings(self.warm_cache)):
+            return self._run()
+
+    def _run(self):
+        results = [self._phase('idle', lambda: time.sleep(self.idle_seconds))]
+
+        last_pk = StockMovement.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        marker = f'锁竞争测试-{uuid.uuid4().hex}'
+        job = ImportJob.objects.create(kind='stock_movements', created_by=self.user,
+                                       file=import_files(self.import_rows, notes=marker)['stock_movements']())
+        try:
+            results.append(self._phase('during_import', lambda: self._import(job)))
+        finally:
+            # 只删除本次导入的记录，测试期间其他进程写入的库存变动保留
+            StockMovement.objects.filter(pk__gt=last_pk, notes=marker).delete()
+            job.file.delete(save=False)
+            job.delete()
+        return results
+
+
+def run_contention_benchmark(readers=4, import_rows=CONTENTION_IMPORT_ROWS, idle_seconds=5, log=None, warm_cache=False):
+    """运行锁竞争测试，返回可序列化为JSON的报告（导入文件保存在 MEDIA_ROOT，导入进程需要读取）"""
+    import django
+
+    with override_settings(ALLOWED_HOSTS=['*'], REQUEST_METRICS_ENABLED=False):
+        benchmark = ContentionBenchmark(readers=readers, import_rows=import_rows, idle_seconds=idle_seconds,
+                                        log=log, warm_cache=warm_cache)
+        started = timezone.now()
+        phases = benchmark.run()
+
+    return {
+        'started_at': started.isoformat(),
+        'django': django.get_version(),
+        'database': _database_info(),
+        'readers': readers,
+        'import_rows': import_rows,
+        'warm_cache': warm_cache,
+        'read_urls': list(CONTENTION_READ_URLS),
+        'phases': phases,
+    }
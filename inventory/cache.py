@@ -0,0 +1,106 @@
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import caches
+from django.middleware.csrf import get_token
+from django.utils import timezone
+
+from .models import DataVersion
+
+# 缓存条目过期时间（秒）；数据写入后版本号变化，旧条目不会再被读取，过期时间只用于回收空间
+VIEW_CACHE_TIMEOUT = 3600
+
+
+def get_view_cache():
+    return caches[getattr(settings, 'VIEW_CACHE_ALIAS', 'default')]
+
+
+def data_versions(models, request=None):
+    """相关表的数据版本 [(label, (version, updated_at) 或 None), ...]
+
+    传入request时结果保存在请求上，条件请求的校验和页面缓存共用一次查询。
+    """
+    memo = getattr(request, '_data_versions', {})
+    if models not in memo:
+        versions = DataVersion.objects.current_versions(*models)
+        memo[models] = [(model._meta.label_lower, versions.get(model._meta.label_lower)) for model in models]
+        if request is not None:
+            request._data_versions = memo
+    return memo[models]
+
+
+def _digest(parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def _sorted_params(params):
+    # QueryDict的同一参数可能有多个值
+    return sorted(params.lists() if hasattr(params, 'lists') else params.items())
+
+
+def view_cache_key(view_name, params, models, request=None):
+    """按 (视图, 参数, 相关表的数据版本) 生成缓存键
+
+    版本号必须在读取数据之前获取：读取期间有写入提交时，新数据存在旧版本号下，不会读到过期数据。
+    """
+    return f'inventory:{view_name}:{_digest([_sorted_params(params), data_versions(models, request)])}'
+
+
+def cached_context(view_name, params, models, compute, request=None):
+    """返回缓存的视图数据，没有时调用 compute() 计算并缓存（结果必须可以pickle）"""
+    cache = get_view_cache()
+    key = view_cache_key(view_name, params, models, request)
+    context = cache.get(key)
+    if context is None:
+        context = compute()
+        cache.set(key, context, getattr(settings, 'VIEW_CACHE_TIMEOUT', VIEW_CACHE_TIMEOUT))
+    return context
+
+
+def fragment_cache_context(view_name, params, models, request=None):
+    """模板片段缓存 {% cache view_cache_timeout 片段名 view_cache_key using=view_cache_alias %} 所需的变量
+
+    片段内不能包含CSRF令牌等与用户相关的内容；片段用到的数据应延迟计算，命中缓存时不查询数据库。
+    """
+    return {
+        'view_cache_key': view_cache_key(view_name, params, models, request),
+        'view_cache_alias': getattr(settings, 'VIEW_CACHE_ALIAS', 'default'),
+        'view_cache_timeout': getattr(settings, 'VIEW_CACHE_TIMEOUT', VIEW_CACHE_TIMEOUT),
+    }
+
+
+def data_etag(view_name, models, per_user=False):
+    """返回 condition(etag_func=...) 使用的函数：ETag由视图、参数、相关表的数据版本和当天日期计算
+
+    页面（per_user=True）包含用户名和CSRF令牌，ETag还包括用户和CSRF cookie；
+    有待显示的提示消息时不返回ETag，保证消息随完整页面显示。
+    """
+    def etag(request, *args, **kwargs):
+        parts = [view_name, args, sorted(kwargs.items()), _sorted_params(request.GET),
+                 data_versions(models, request), timezone.now().date()]
+        if per_user:
+            if len(messages.get_messages(request)):
+                return None
+            # 第一次访问时还没有CSRF cookie，先生成，使这次响应的ETag与之后的请求一致
+            get_token(request)
+            parts += [request.user.pk, request.META.get('CSRF_COOKIE')]
+        return _digest(parts)
+    return etag
+
+
+def data_last_modified(models):
+    """返回 condition(last_modified_func=...) 使用的函数：相关表中最近一次写入的时间
+
+    HTTP日期只精确到秒，最近一秒内有写入时不返回，以免同一秒内的后续写入被 If-Modified-Since 判断为未修改。
+    默认日期为今天的导出在日期变化后也要重新生成，因此不早于当天零点。
+    """
+    def last_modified(request, *args, **kwargs):
+        written = [version[1] for _, version in data_versions(models, request) if version]
+        now = timezone.now()
+        if not written or now - max(written) < timedelta(seconds=1):
+            return None
+        return max(max(written), now.replace(hour=0, minute=0, second=0, microsecond=0))
+    return last_modified
+
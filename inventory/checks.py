@@ -0,0 +1,18 @@
+from django.core.checks import Tags, Warning, register
+
+from .search import missing_search_triggers
+
+
+@register(Tags.database)
+def check_search_triggers(app_configs, databases=None, **kwargs):
+    """全文索引的同步触发器缺失时（迁移重建了业务表）提示重建，否则搜索结果不再更新"""
+    warnings = []
+    for alias in databases or []:
+        missing = missing_search_triggers(alias)
+        if missing:
+            warnings.append(Warning(
+                f'数据库 {alias} 缺少全文索引的同步触发器：{", ".join(missing)}，搜索结果不会随数据更新',
+                hint='运行 python manage.py rebuild_search_index 重新创建触发器并重建索引',
+                id='inventory.W001',
+            ))
+    return warnings
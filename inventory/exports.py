@@ -0,0 +1,138 @@
+import csv
+import tempfile
+
+import openpyxl
+from django.http import FileResponse, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill
+from openpyxl.utils import get_column_letter
+
+# Parquet导出依赖pyarrow，未安装时只提供Excel和CSV格式
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+EXPORT_FORMATS = ('xlsx', 'csv', 'parquet')
+
+# 每次从数据库读取的行数
+EXPORT_CHUNK_SIZE = 2000
+
+
+def iter_rows(queryset, *fields):
+    """分批读取查询结果的指定字段，不缓存整个结果集"""
+    return queryset.values_list(*fields).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def stream_xlsx(filename, sheet_title, headers, rows, column_width=20, header_color='CCCCCC'):
+    """以只写模式生成Excel并流式返回
+
+    只写模式逐行写入临时文件，不在内存中保留单元格对象；
+    生成的文件从磁盘分块发送，内存占用与导出行数无关。
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_title)
+
+    # 只写模式下列宽必须在写入数据之前设置
+    for col in range(1, len(headers) + 1):
+        ws.column_dimensions[get_column_letter(col)].width = column_width
+
+    header_font = Font(bold=True)
+    header_fill = PatternFill(start_color=header_color, end_color=header_color, fill_type='solid')
+    header_cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = header_font
+        cell.fill = header_fill
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    for row in rows:
+        ws.append(row)
+
+    output = tempfile.TemporaryFile()
+    wb.save(output)
+    output.seek(0)
+
+    # FileResponse 是 StreamingHttpResponse 的子类，发送完毕后自动关闭临时文件
+    return FileResponse(output, as_attachment=True, filename=filename, content_type=XLSX_CONTENT_TYPE)
+
+
+class Echo:
+    """只实现write方法的伪文件对象，csv.writer写入一行时直接返回该行文本"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(filename, headers, rows):
+    """逐行生成CSV并流式返回，带BOM以便Excel正确识别中文"""
+    writer = csv.writer(Echo())
+
+    def content():
+        yield '\ufeff' + writer.writerow(headers)
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(content(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stream_parquet(filename, headers, rows, column_types=None):
+    """按批把行转成列写入Parquet临时文件，再流式返回
+
+    column_types 为每列的pyarrow类型名（如 'string'、'int64'、'float64'），表结构在写入前确定，
+    不依赖某一批数据推断；未指定时全部按字符串写出。
+    """
+    if column_types is None:
+        column_types = ['string'] * len(headers)
+        rows = ([None if value is None else str(value) for value in row] for row in rows)
+    schema = pyarrow.schema([pyarrow.field(header, getattr(pyarrow, column_type)())
+                             for header, column_type in zip(headers, column_types)])
+
+    output = tempfile.TemporaryFile()
+    # 没有数据时写出只有表头的空文件
+    with pyarrow.parquet.ParquetWriter(output, schema) as writer:
+        for batch in _batches(rows, EXPORT_CHUNK_SIZE):
+            arrays = [pyarrow.array(column, type=field.type) for column, field in zip(zip(*batch), schema)]
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+    output.seek(0)
+
+    return FileResponse(output, as_attachment=True, filename=filename, content_type='application/vnd.apache.parquet')
+
+
+def file_response(export_format, filename, sheet_title, headers, rows, column_types=None, **xlsx_options):
+    """按指定格式（xlsx/csv/parquet）生成文件响应，filename不含扩展名，column_types 见 stream_parquet"""
+    if export_format == 'csv':
+        return stream_csv(f'{filename}.csv', headers, rows)
+    if export_format == 'parquet':
+        if pyarrow is None:
+            return HttpResponse('服务器未安装pyarrow，暂不支持Parquet格式导出，请使用xlsx或csv格式',
+                                status=501, content_type='text/plain; charset=utf-8')
+        return stream_parquet(f'{filename}.parquet', headers, rows, column_types)
+    return stream_xlsx(f'{filename}.xlsx', sheet_title, headers, rows, **xlsx_options)
+
+
+def export_response(request, filename, sheet_title, headers, rows, column_types=None, **xlsx_options):
+    """根据请求参数format（xlsx/csv/parquet，默认xlsx）选择导出格式
+
+    filename不含扩展名；各格式的列和数据完全相同。
+    """
+    export_format = request.GET.get('format', 'xlsx').lower()
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest(f'不支持的导出格式：{export_format}，可选 {"/".join(EXPORT_FORMATS)}')
+    return file_response(export_format, filename, sheet_title, headers, rows, column_types, **xlsx_options)
@@ -0,0 +1,376 @@
+import io
+
+import pandas as pd
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Product, Warehouse, StockMovement, IncomingStock, ProductionOrder
+from .services import allocate_incoming_stock
+
+# 每批写入的记录数（SQLite单条语句的参数个数有限制）
+IMPORT_BATCH_SIZE = 500
+
+
+# 各导入函数接收一个DataFrame（行索引与Excel行对应），返回字典：
+# {'success_count': 成功行数, 'errors': [(行号, 错误信息), ...], 'warnings': [(行号, 警告信息), ...], ...}
+# dry_run=True 时只做完整校验，不写入数据库，success_count为校验通过的行数。
+
+
+class ImportFileError(Exception):
+    """导入文件整体不可用（如缺少必要的列），不逐行报告"""
+
+
+def read_import_file(upload, text_columns=()):
+    """读取导入文件（Excel或CSV），text_columns中的列按文本读取，避免SKU等被识别为数字
+
+    大文件建议使用CSV，解析速度比Excel快得多。CSV依次尝试UTF-8和GBK编码。
+    """
+    dtype = {column: str for column in text_columns}
+    if upload.name.lower().endswith('.csv'):
+        content = upload.read()
+        try:
+            text = content.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            text = content.decode('gbk')
+        return pd.read_csv(io.StringIO(text), dtype=dtype)
+    return pd.read_excel(upload, dtype=dtype)
+
+
+def check_required_columns(df, required_columns):
+    for col in required_columns:
+        if col not in df.columns:
+            raise ImportFileError(f'缺少必要的列: {col}')
+
+
+def text_column(df, column):
+    """取文本列，去除首尾空格，空单元格为空字符串"""
+    if column not in df.columns:
+        return pd.Series('', index=df.index)
+    return df[column].fillna('').astype(str).str.strip()
+
+
+def row_errors(df, checks):
+    """按顺序执行各项检查，每行只报告第一个错误
+
+    checks为[(有效行掩码, 错误信息或生成错误信息的函数), ...]，
+    返回 (全部检查通过的行掩码, [(行号, 错误信息), ...])，行号与Excel中一致（表头为第1行）。
+    """
+    valid = pd.Series(True, index=df.index)
+    errors = {}
+    for mask, message in checks:
+        failed = valid & ~mask
+        for index in failed[failed].index:
+            errors[index] = message(index) if callable(message) else message
+        valid &= mask
+    return valid, [(index + 2, errors[index]) for index in sorted(errors)]
+
+
+STOCK_MOVEMENT_TEXT_COLUMNS = ['仓库代码', '店铺SKU', '类型(IN/OUT)', '备注(可选)']
+STOCK_MOVEMENT_REQUIRED_COLUMNS = ['日期(YYYY-MM-DD)', '仓库代码', '店铺SKU', '数量', '类型(IN/OUT)']
+
+
+def validate_stock_movements(df):
+    """向量化校验库存变动导入数据
+
+    仓库代码和店铺SKU各用一次查询解析。
+    返回 (有效行组成的DataFrame, [(行号, 错误信息), ...])，
+    有效行包含 product_id, warehouse_id, date, quantity, movement_type, notes 列。
+    """
+    check_required_columns(df, STOCK_MOVEMENT_REQUIRED_COLUMNS)
+
+    warehouse_codes = text_column(df, '仓库代码')
+    skus = text_column(df, '店铺SKU')
+    warehouses = Warehouse.objects.in_bulk(list(warehouse_codes.unique()), field_name='code')
+    products = Product.objects.in_bulk(list(skus.unique()), field_name='sku')
+
+    dates = pd.to_datetime(df['日期(YYYY-MM-DD)'], errors='coerce', format='mixed')
+    quantities = pd.to_numeric(df['数量'], errors='coerce')
+    movement_types = text_column(df, '类型(IN/OUT)').str.upper()
+
+    valid, errors = row_errors(df, [
+        (warehouse_codes.isin(warehouses), lambda index: f'仓库代码 {warehouse_codes[index]} 不存在'),
+        (skus.isin(products), lambda index: f'店铺SKU {skus[index]} 不存在'),
+        (dates.notna(), '日期格式错误'),
+        (quantities.notna() & (quantities > 0) & (quantities % 1 == 0), '数量必须为正整数'),
+        (movement_types.isin(['IN', 'OUT']), '类型必须为 IN 或 OUT'),
+    ])
+
+    rows = pd.DataFrame({
+        'product_id': skus[valid].map(lambda sku: products[sku].id),
+        'warehouse_id': warehouse_codes[valid].map(lambda code: warehouses[code].id),
+        'date': dates[valid].dt.date,
+        'quantity': quantities[valid].astype(int),
+        'movement_type': movement_types[valid],
+        'notes': text_column(df, '备注(可选)')[valid],
+    })
+    return rows, errors
+
+
+def import_stock_movements(df, dry_run=False):
+    """导入库存变动：校验后在一个事务中分批写入全部有效行"""
+    rows, errors = validate_stock_movements(df)
+    if dry_run:
+        return {'success_count': len(rows), 'errors': errors, 'warnings': []}
+    movements = [
+        StockMovement(
+            product_id=product_id,
+            warehouse_id=warehouse_id,
+            date=date,
+            quantity=quantity,
+            movement_type=movement_type,
+            notes=notes
+        )
+        for product_id, warehouse_id, date, quantity, movement_type, notes in zip(
+            rows['product_id'].tolist(), rows['warehouse_id'].tolist(), rows['date'].tolist(),
+            rows['quantity'].tolist(), rows['movement_type'].tolist(), rows['notes'].tolist()
+        )
+    ]
+    with transaction.atomic():
+        StockMovement.objects.bulk_create(movements, batch_size=IMPORT_BATCH_SIZE)
+    return {'success_count': len(movements), 'errors': errors, 'warnings': []}
+
+
+PRODUCT_TEXT_COLUMNS = ['店铺SKU', 'FNSKU', '产品SKU', '系列', '季节']
+PRODUCT_REQUIRED_COLUMNS = ['店铺SKU', '重量(lb)', '长度(inch)', '宽度(inch)', '高度(inch)']
+PRODUCT_DIMENSION_COLUMNS = ['重量(lb)', '长度(inch)', '宽度(inch)', '高度(inch)']
+# 导入产品时更新的字段（店铺SKU已存在时）
+PRODUCT_UPDATE_FIELDS = ['fnsku', 'name', 'series', 'season', 'weight', 'length', 'width', 'height', 'updated_at']
+# 初始库存列与仓库代码
+INITIAL_STOCK_COLUMNS = [('亚特兰大仓库存', 'GA'), ('加州仓库存', 'CA')]
+
+
+def initial_stock_column(df, column, warnings):
+    """读取初始库存列，非整数或负数的单元格按0处理并记录警告"""
+    if column not in df.columns:
+        return pd.Series(0, index=df.index)
+    present = df[column].notna()
+    values = pd.to_numeric(df[column], errors='coerce')
+    for index in df.index[present & values.isna()]:
+        warnings.append((index + 2, f'{column}必须为整数'))
+    for index in df.index[values < 0]:
+        warnings.append((index + 2, f'{column}不能为负数'))
+    return values.where(values > 0, 0).fillna(0).astype(int)
+
+
+def import_products(df, dry_run=False):
+    """批量导入产品：店铺SKU已存在则更新，否则新增，并为初始库存批量生成入库记录
+
+    除通用结果外另返回 created（新增数）、updated（更新数）、stock_movements（库存记录数）
+    """
+    check_required_columns(df, PRODUCT_REQUIRED_COLUMNS)
+    warehouses = {code: Warehouse.objects.get(code=code) for _, code in INITIAL_STOCK_COLUMNS}
+
+    skus = text_column(df, '店铺SKU')
+    dimensions = {column: pd.to_numeric(df[column], errors='coerce') for column in PRODUCT_DIMENSION_COLUMNS}
+    all_numeric = pd.Series(True, index=df.index)
+    all_positive = pd.Series(True, index=df.index)
+    for values in dimensions.values():
+        all_numeric &= values.notna()
+        all_positive &= values > 0
+
+    valid, errors = row_errors(df, [
+        (skus != '', '店铺SKU不能为空'),
+        (all_numeric, '重量和尺寸必须为数字'),
+        (all_positive, '重量和尺寸必须为正数'),
+    ])
+
+    warnings = []
+    stocks = {code: initial_stock_column(df, column, warnings)[valid] for column, code in INITIAL_STOCK_COLUMNS}
+    warnings = [warning for warning in warnings if valid[warning[0] - 2]]
+    warnings.sort()
+
+    # 产品SKU为空时使用店铺SKU作为产品名称
+    names = text_column(df, '产品SKU')
+    names = names.where(names != '', skus)
+    product_rows = pd.DataFrame({
+        'sku': skus,
+        'fnsku': text_column(df, 'FNSKU'),
+        'name': names,
+        'series': text_column(df, '系列'),
+        'season': text_column(df, '季节'),
+        'weight': dimensions['重量(lb)'],
+        'length': dimensions['长度(inch)'],
+        'width': dimensions['宽度(inch)'],
+        'height': dimensions['高度(inch)'],
+    })[valid]
+    # 同一店铺SKU出现多次时以最后一行为准
+    product_rows = product_rows.drop_duplicates('sku', keep='last')
+
+    unique_skus = product_rows['sku'].tolist()
+    existing_skus = set()
+    for i in range(0, len(unique_skus), IMPORT_BATCH_SIZE):
+        existing_skus.update(Product.objects.filter(sku__in=unique_skus[i:i + IMPORT_BATCH_SIZE]).values_list('sku', flat=True))
+
+    if dry_run:
+        return {
+            'success_count': len(unique_skus),
+            'created': len(unique_skus) - len(existing_skus),
+            'updated': len(existing_skus),
+            'stock_movements': sum(int((quantities > 0).sum()) for quantities in stocks.values()),
+            'errors': errors,
+            'warnings': warnings,
+        }
+
+    products = [Product(**row) for row in product_rows.to_dict('records')]
+    today = timezone.now().date()
+    with transaction.atomic():
+        Product.objects.bulk_create(
+            products,
+            batch_size=IMPORT_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['sku'],
+            update_fields=PRODUCT_UPDATE_FIELDS
+        )
+        product_ids = {product.sku: product.pk for product in products}
+
+        movements = []
+        for code, quantities in stocks.items():
+            for sku, quantity in zip(skus[valid][quantities > 0].tolist(), quantities[quantities > 0].tolist()):
+                movements.append(StockMovement(
+                    product_id=product_ids[sku],
+                    warehouse=warehouses[code],
+                    movement_type='IN',
+                    quantity=quantity,
+                    date=today,
+                    notes='导入初始库存'
+                ))
+        StockMovement.objects.bulk_create(movements, batch_size=IMPORT_BATCH_SIZE)
+
+    return {
+        'success_count': len(unique_skus),
+        'created': len(unique_skus) - len(existing_skus),
+        'updated': len(existing_skus),
+        'stock_movements': len(movements),
+        'errors': errors,
+        'warnings': warnings,
+    }
+
+
+INCOMING_STOCK_TEXT_COLUMNS = ['店铺SKU', '仓库代码', '备注(可选)']
+INCOMING_STOCK_REQUIRED_COLUMNS = ['店铺SKU', '仓库代码', '数量', '预计入仓时间(YYYY-MM-DD)']
+
+
+def import_incoming_stock(df, dry_run=False):
+    """导入入库途中产品，并按先进先出批量扣减生产订单剩余数量"""
+    check_required_columns(df, INCOMING_STOCK_REQUIRED_COLUMNS)
+
+    skus = text_column(df, '店铺SKU')
+    warehouse_codes = text_column(df, '仓库代码')
+    products = Product.objects.in_bulk(list(skus.unique()), field_name='sku')
+    warehouses = Warehouse.objects.in_bulk(list(warehouse_codes.unique()), field_name='code')
+    quantities = pd.to_numeric(df['数量'], errors='coerce')
+    dates = pd.to_datetime(df['预计入仓时间(YYYY-MM-DD)'], errors='coerce', format='mixed')
+
+    valid, errors = row_errors(df, [
+        (skus.isin(products), lambda index: f'店铺SKU {skus[index]} 不存在'),
+        (warehouse_codes.isin(warehouses), lambda index: f'仓库代码 {warehouse_codes[index]} 不存在'),
+        (quantities.notna() & (quantities % 1 == 0), '数量必须为整数'),
+        (quantities > 0, '数量必须为正整数'),
+        (dates.notna(), '预计入仓时间格式错误'),
+    ])
+
+    incoming_stocks = [
+        IncomingStock(
+            product=products[sku],
+            warehouse=warehouses[code],
+            quantity=quantity,
+            expected_arrival_date=arrival_date,
+            notes=notes
+        )
+        for sku, code, quantity, arrival_date, notes in zip(
+            skus[valid].tolist(), warehouse_codes[valid].tolist(), quantities[valid].astype(int).tolist(),
+            dates[valid].dt.date.tolist(), text_column(df, '备注(可选)')[valid].tolist()
+        )
+    ]
+
+    if dry_run:
+        return {'success_count': len(incoming_stocks), 'errors': errors, 'warnings': []}
+
+    with transaction.atomic():
+        IncomingStock.objects.bulk_create(incoming_stocks, batch_size=IMPORT_BATCH_SIZE)
+        # 按文件中的行顺序一次性扣减所有相关产品的生产订单，并记录分配明细
+        allocate_incoming_stock(incoming_stocks)
+
+    return {'success_count': len(incoming_stocks), 'errors': errors, 'warnings': []}
+
+
+PRODUCTION_ORDER_TEXT_COLUMNS = ['店铺SKU', '订单号']
+PRODUCTION_ORDER_REQUIRED_COLUMNS = ['店铺SKU', '订单号', '数量']
+
+
+def existing_order_numbers(product_ids):
+    """查询指定产品已有的订单号 {(product_id, 订单号)}"""
+    product_ids = list(product_ids)
+    existing = set()
+    for i in range(0, len(product_ids), IMPORT_BATCH_SIZE):
+        existing.update(ProductionOrder.objects.filter(
+            product_id__in=product_ids[i:i + IMPORT_BATCH_SIZE]
+        ).values_list('product_id', 'order_number'))
+    return existing
+
+
+def import_production_orders(df, dry_run=False):
+    """导入生产订单，同一产品的订单号不能与已有订单或文件中前面的行重复"""
+    check_required_columns(df, PRODUCTION_ORDER_REQUIRED_COLUMNS)
+
+    skus = text_column(df, '店铺SKU')
+    order_numbers = text_column(df, '订单号')
+    quantities = pd.to_numeric(df['数量'], errors='coerce')
+    products = Product.objects.in_bulk(list(skus.unique()), field_name='sku')
+    product_ids = skus.map(lambda sku: products[sku].id if sku in products else None)
+
+    valid, errors = row_errors(df, [
+        (skus != '', '店铺SKU不能为空'),
+        (order_numbers != '', '订单号不能为空'),
+        (quantities.notna() & (quantities % 1 == 0), '数量必须为整数'),
+        (quantities > 0, '数量必须为正整数'),
+        (skus.isin(products), lambda index: f'找不到店铺SKU为 {skus[index]} 的产品'),
+    ])
+
+    # 订单号与已有订单重复，或与文件中前面的有效行重复
+    existing = existing_order_numbers(product.id for product in products.values())
+    keys = pd.Series(list(zip(product_ids, order_numbers)), index=df.index)[valid]
+    duplicated = keys.map(lambda key: key in existing) | keys.duplicated()
+    for index in duplicated[duplicated].index:
+        errors.append((index + 2, f'产品 {skus[index]} 已存在订单号为 {order_numbers[index]} 的生产订单'))
+        valid[index] = False
+    errors.sort()
+
+    orders = [
+        ProductionOrder(
+            product_id=product_id,
+            order_number=order_number,
+            quantity=quantity,
+            remaining_quantity=quantity
+        )
+        for product_id, order_number, quantity in zip(
+            product_ids[valid].tolist(), order_numbers[valid].tolist(), quantities[valid].astype(int).tolist()
+        )
+    ]
+    if dry_run:
+        return {'success_count': len(orders), 'errors': errors, 'warnings': []}
+
+    with transaction.atomic():
+        ProductionOrder.objects.bulk_create(orders, batch_size=IMPORT_BATCH_SIZE)
+
+    return {'success_count': len(orders), 'errors': errors, 'warnings': []}
+
+
+# 导入类型：(按文本读取的列, 导入函数)
+IMPORTERS = {
+    'products': (PRODUCT_TEXT_COLUMNS, import_products),
+    'stock_movements': (STOCK_MOVEMENT_TEXT_COLUMNS, import_stock_movements),
+    'incoming_stock': (INCOMING_STOCK_TEXT_COLUMNS, import_incoming_stock),
+    'production_orders': (PRODUCTION_ORDER_TEXT_COLUMNS, import_production_orders),
+}
+
+
+def validation_report_rows(df, result):
+    """生成校验报告的数据行：每个有问题的行输出 行号、类型、问题 以及该行的原始数据"""
+    problems = [(row_number, '错误', message) for row_number, message in result['errors']]
+    problems += [(row_number, '警告', message) for row_number, message in result['warnings']]
+    problems.sort(key=lambda problem: problem[0])
+
+    original = df.astype(object).where(df.notna(), None)
+    for row_number, level, message in problems:
+        yield [row_number, level, message] + original.loc[row_number - 2].tolist()
@@ -0,0 +1,85 @@
+from django.db import transaction
+from django.utils import timezone
+
+from .importers import IMPORTERS, ImportFileError, read_import_file
+from .models import ImportJob
+
+# 每批处理的行数，每批完成后更新一次任务进度
+JOB_CHUNK_ROWS = 5000
+# 任务中最多保存的错误和警告条数（错误总数另行记录）
+MAX_STORED_MESSAGES = 1000
+
+
+def import_summary(job, totals):
+    """根据累计结果生成导入摘要"""
+    if job.kind == 'products':
+        summary = '成功导入 {} 条产品记录（新增 {}，更新 {}），添加 {} 条库存记录'.format(
+            totals.get('success_count', 0), totals.get('created', 0),
+            totals.get('updated', 0), totals.get('stock_movements', 0)
+        )
+    else:
+        summary = f"成功导入 {totals.get('success_count', 0)} 条{job.get_kind_display()}记录"
+    if job.error_count:
+        summary += f'，失败 {job.error_count} 条'
+    return summary
+
+
+class JobClaimLost(Exception):
+    """任务已被其他进程重新领取"""
+
+
+def run_import_job(job):
+    """处理一个已领取的导入任务
+
+    文件按 JOB_CHUNK_ROWS 行分批导入，每批数据和任务进度在同一个事务中写入，
+    页面轮询即可看到已处理行数和错误信息。处理进程中途退出后，任务被重新领取时
+    从已提交的行继续导入，不会重复写入之前的批次。
+    """
+    text_columns, import_rows = IMPORTERS[job.kind]
+    try:
+        with job.file.open('rb') as excel_file:
+            df = read_import_file(excel_file, text_columns)
+        job.total_rows = len(df)
+        job.save(update_fields=['total_rows'])
+
+        # 空文件也执行一次，以便检查必要的列
+        for start in range(job.processed_rows, max(len(df), 1), JOB_CHUNK_ROWS):
+            with transaction.atomic():
+                result = import_rows(df.iloc[start:start + JOB_CHUNK_ROWS])
+                for key, value in result.items():
+                    if key not in ('errors', 'warnings'):
+                        job.totals[key] = job.totals.get(key, 0) + value
+                job.error_count += len(result['errors'])
+                job.errors.extend(result['errors'][:MAX_STORED_MESSAGES - len(job.errors)])
+                job.warnings.extend(result['warnings'][:MAX_STORED_MESSAGES - len(job.warnings)])
+                job.success_count = job.totals.get('success_count', 0)
+                job.heartbeat_at = timezone.now()
+                # 只有进度仍停在本批开始处、且任务仍属于本进程时才提交，否则整批回滚
+                saved = ImportJob.objects.filter(pk=job.pk, worker=job.worker, processed_rows=start).update(
+                    processed_rows=min(start + JOB_CHUNK_ROWS, len(df)),
+                    success_count=job.success_count,
+                    error_count=job.error_count,
+                    errors=job.errors,
+                    warnings=job.warnings,
+                    totals=job.totals,
+                    heartbeat_at=job.heartbeat_at
+                )
+                if not saved:
+                    raise JobClaimLost
+            job.processed_rows = min(start + JOB_CHUNK_ROWS, len(df))
+
+        job.status = ImportJob.STATUS_DONE
+        job.summary = import_summary(job, job.totals)
+    except JobClaimLost:
+        job.refresh_from_db()
+        return job
+    except ImportFileError as e:
+        job.status = ImportJob.STATUS_FAILED
+        job.summary = str(e)
+    except Exception as e:
+        job.status = ImportJob.STATUS_FAILED
+        job.summary = f'文件处理出错: {str(e)}'
+
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'summary', 'finished_at'])
+    return job
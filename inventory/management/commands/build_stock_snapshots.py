@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from inventory.models import StockMovement, StockSnapshot
+
+
+class Command(BaseCommand):
+    help = '生成每日收盘库存快照（默认生成昨天的快照，可每天定时运行）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='快照日期 YYYY-MM-DD，默认为昨天')
+        parser.add_argument('--start', help='批量生成的开始日期 YYYY-MM-DD')
+        parser.add_argument('--end', help='批量生成的结束日期 YYYY-MM-DD，默认为昨天')
+        parser.add_argument('--backfill', action='store_true',
+                            help='从最早的库存变动日期开始补齐到结束日期')
+
+    def parse_date(self, value):
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'日期格式错误: {value}，请使用YYYY-MM-DD格式')
+
+    def handle(self, *args, **options):
+        yesterday = timezone.now().date() - timedelta(days=1)
+
+        if options['date']:
+            start = end = self.parse_date(options['date'])
+        else:
+            end = self.parse_date(options['end']) if options['end'] else yesterday
+            if options['start']:
+                start = self.parse_date(options['start'])
+            elif options['backfill']:
+                earliest_movement = StockMovement.objects.order_by('date').first()
+                if not earliest_movement:
+                    self.stdout.write('没有库存变动记录，无需生成快照')
+                    return
+                start = earliest_movement.date
+            else:
+                start = end
+
+        if start > end:
+            raise CommandError('开始日期不能晚于结束日期')
+
+        count = StockSnapshot.objects.build(start, end)
+        self.stdout.write(self.style.SUCCESS(f'已生成 {start} 至 {end} 的库存快照，共 {count} 条记录'))
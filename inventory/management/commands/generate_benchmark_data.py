@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from inventory.benchmarks import GENERATE_CHUNK_SIZE, generate_dataset
+
+
+class Command(BaseCommand):
+    help = '生成基准测试用的模拟数据（产品、仓库、库存变动、入库途中记录和生产订单）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000, help='产品数量，默认1000')
+        parser.add_argument('--warehouses', type=int, default=4, help='仓库数量（包含GA和CA），默认4')
+        parser.add_argument('--movements', type=int, default=100000, help='库存变动记录数量，默认100000')
+        parser.add_argument('--incoming', type=int, default=2000, help='入库途中记录数量，默认2000')
+        parser.add_argument('--orders', type=int, default=2000, help='生产订单数量，默认2000')
+        parser.add_argument('--days', type=int, default=365, help='库存变动覆盖的天数（截至今天），默认365')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='随机种子，同时作为SKU前缀（BM<seed>-），不同种子的数据可以叠加，默认1')
+        parser.add_argument('--chunk-size', type=int, default=GENERATE_CHUNK_SIZE, help='每批插入的行数')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        counts = generate_dataset(
+            products=options['products'], warehouses=options['warehouses'], movements=options['movements'],
+            incoming=options['incoming'], orders=options['orders'], days=options['days'],
+            seed=options['seed'], chunk_size=options['chunk_size'], log=self.stdout.write,
+        )
+        summary = '，'.join(f'{name} {count}' for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'已生成数据（{summary}），耗时 {time.perf_counter() - start:.1f} 秒'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.search import missing_search_triggers, rebuild_search_index, search_tables_exist
+
+
+class Command(BaseCommand):
+    help = '重新创建缺失的同步触发器，并重新填充产品、库存变动备注和入库途中备注的全文索引'
+
+    def handle(self, *args, **options):
+        if not search_tables_exist():
+            raise CommandError('当前数据库没有全文索引表（需要SQLite 3.34+ 并支持FTS5）')
+        missing = missing_search_triggers()
+        rebuild_search_index()
+        if missing:
+            self.stdout.write(f'已重新创建同步触发器：{", ".join(missing)}')
+        self.stdout.write(self.style.SUCCESS('全文索引已重建'))
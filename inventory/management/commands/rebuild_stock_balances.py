@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from inventory.models import StockBalance
+
+
+class Command(BaseCommand):
+    help = '根据库存变动流水重新计算库存余额表'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, action='append', dest='product_ids',
+                            help='只重新计算指定产品ID（可重复）')
+
+    def handle(self, *args, **options):
+        StockBalance.objects.rebuild(options['product_ids'])
+        self.stdout.write(self.style.SUCCESS(f'库存余额已重建，共 {StockBalance.objects.count()} 条记录'))
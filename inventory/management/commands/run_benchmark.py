@@ -0,0 +1,48 @@
+import json
+import sys
+import tempfile
+
+from django.core.management.base import BaseCommand
+
+from inventory.benchmarks import CONTENTION_IMPORT_ROWS, run_benchmark, run_contention_benchmark
+
+
+class Command(BaseCommand):
+    help = '用测试客户端请求所有页面、导出和导入，以JSON输出p50/p95延迟、查询次数和内存峰值'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='每个请求计时的次数（另有一次预热），默认5')
+        parser.add_argument('--import-rows', type=int,
+                            help=f'导入测试文件的行数，默认1000（--contention 时默认{CONTENTION_IMPORT_ROWS}）')
+        parser.add_argument('--only', nargs='*', help='只运行名称包含这些字符串的测试，如 product_list export')
+        parser.add_argument('--output', help='JSON报告的保存路径，默认输出到标准输出')
+        parser.add_argument('--warm-cache', action='store_true',
+                            help='页面缓存使用进程内的独立缓存，测量重复访问（命中缓存）的耗时；'
+                                 '默认使用不保存任何内容的缓存，每次请求都重新计算页面')
+        parser.add_argument('--contention', action='store_true',
+                            help='锁竞争测试：由导入进程导入库存变动，同时多个线程持续读取页面，与空闲时的读取延迟对比')
+        parser.add_argument('--readers', type=int, default=4, help='锁竞争测试的读取线程数，默认4')
+        parser.add_argument('--idle-seconds', type=float, default=5, help='锁竞争测试中空闲阶段的读取时长（秒），默认5')
+
+    def handle(self, *args, **options):
+        # 进度输出到标准错误，标准输出只包含JSON报告
+        log = (lambda message: sys.stderr.write(message + '\n')) if options['output'] is None else self.stdout.write
+        if options['contention']:
+            report = run_contention_benchmark(readers=options['readers'],
+                                              import_rows=options['import_rows'] or CONTENTION_IMPORT_ROWS,
+                                              idle_seconds=options['idle_seconds'], log=log,
+                                              warm_cache=options['warm_cache'])
+        else:
+            # 导入测试上传的文件保存到临时目录
+            with tempfile.TemporaryDirectory() as media_root:
+                report = run_benchmark(repeat=options['repeat'], import_rows=options['import_rows'] or 1000,
+                                       only=options['only'], log=log, media_root=media_root,
+                                       warm_cache=options['warm_cache'])
+
+        content = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(content)
+            self.stdout.write(self.style.SUCCESS(f'报告已保存到 {options["output"]}'))
+        else:
+            self.stdout.write(content)
@@ -0,0 +1,33 @@
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+
+from inventory.jobs import run_import_job
+from inventory.models import ImportJob
+
+
+class Command(BaseCommand):
+    help = '后台处理Excel导入任务（可同时运行多个进程以提高吞吐量）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='处理完当前所有待处理任务后退出')
+        parser.add_argument('--interval', type=float, default=2, help='没有任务时的轮询间隔（秒），默认2秒')
+
+    def handle(self, *args, **options):
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        self.stdout.write(f'导入进程 {worker} 已启动')
+
+        while True:
+            job = ImportJob.objects.claim_next(worker)
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+                continue
+
+            self.stdout.write(f'开始处理 {job}')
+            job = run_import_job(job)
+            style = self.style.SUCCESS if job.status == ImportJob.STATUS_DONE else self.style.ERROR
+            self.stdout.write(style(f'{job}: {job.summary}'))
@@ -0,0 +1,132 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('inventory.performance')
+
+# settings.REQUEST_BUDGETS 没有 'default' 时的默认预算，各URL的预算在此基础上覆盖
+DEFAULT_REQUEST_BUDGET = {'queries': 50, 'db_ms': 500, 'total_ms': 2000}
+
+
+class QueryCounter:
+    """connection.execute_wrapper 的包装函数，统计SQL查询次数和耗时"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+class RequestMetrics:
+    """单个请求的性能指标，时间单位为毫秒"""
+
+    def __init__(self, view_name):
+        self.view_name = view_name
+        self.counter = QueryCounter()
+        self.started = time.perf_counter()
+        self.total_ms = 0.0
+        self.response_size = 0
+
+    @property
+    def queries(self):
+        return self.counter.count
+
+    @property
+    def db_ms(self):
+        return self.counter.duration * 1000
+
+    @property
+    def python_ms(self):
+        return max(self.total_ms - self.db_ms, 0)
+
+    def stop(self):
+        self.total_ms = (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self):
+        return ', '.join([
+            f'db;dur={self.db_ms:.1f};desc="{self.queries} queries"',
+            f'app;dur={self.python_ms:.1f}',
+            f'total;dur={self.total_ms:.1f}',
+        ])
+
+    def over_budget(self):
+        """返回超出预算的项目 [(名称, 实际值, 预算), ...]"""
+        budget = dict(DEFAULT_REQUEST_BUDGET)
+        budgets = getattr(settings, 'REQUEST_BUDGETS', {})
+        budget.update(budgets.get('default', {}))
+        budget.update(budgets.get(self.view_name, {}))
+        actual = {'queries': self.queries, 'db_ms': self.db_ms, 'total_ms': self.total_ms,
+                  'response_bytes': self.response_size}
+        return [(key, actual[key], limit) for key, limit in budget.items()
+                if key in actual and limit is not None and actual[key] > limit]
+
+
+class RequestMetricsMiddleware:
+    """记录每个请求的SQL查询次数、数据库耗时、Python耗时和响应大小
+
+    超出 settings.REQUEST_BUDGETS 中按URL名称（如 'inventory:product_list'）配置的预算时记录警告日志；
+    工作人员（is_staff）的响应带有 Server-Timing 头，可在浏览器开发者工具中查看。
+    流式响应（导出）在发送过程中才执行查询，指标在发送完毕后记录，响应头中只包含发送前的部分。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'REQUEST_METRICS_ENABLED', True):
+            return self.get_response(request)
+
+        metrics = RequestMetrics(view_name=None)
+        request.metrics = metrics
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics.counter))
+            response = self.get_response(request)
+        metrics.view_name = request.resolver_match.view_name if request.resolver_match else None
+        metrics.stop()
+
+        if self._is_staff(request):
+            response['Server-Timing'] = metrics.server_timing()
+
+        if response.streaming:
+            response.streaming_content = self._measure_stream(response.streaming_content, request, metrics)
+        else:
+            metrics.response_size = len(response.content)
+            self._log(request, metrics)
+        return response
+
+    def _measure_stream(self, content, request, metrics):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics.counter))
+            for chunk in content:
+                metrics.response_size += len(chunk)
+                yield chunk
+        metrics.stop()
+        self._log(request, metrics)
+
+    def _is_staff(self, request):
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_authenticated and user.is_staff
+
+    def _log(self, request, metrics):
+        exceeded = metrics.over_budget()
+        message = (f'{request.method} {request.path} [{metrics.view_name}] '
+                   f'查询 {metrics.queries} 次, 数据库 {metrics.db_ms:.1f}ms, '
+                   f'Python {metrics.python_ms:.1f}ms, 总计 {metrics.total_ms:.1f}ms, '
+                   f'响应 {metrics.response_size} 字节')
+        if exceeded:
+            details = ', '.join(f'{key} {value:.0f} > {limit}' for key, value, limit in exceeded)
+            logger.warning(f'超出性能预算（{details}）: {message}')
+        else:
+            logger.debug(message)
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Case, F, IntegerField, Max, Sum, When
+
+
+def build_stock_balances(apps, schema_editor):
+    # 根据已有的库存变动流水初始化库存余额
+    StockMovement = apps.get_model('inventory', 'StockMovement')
+    StockBalance = apps.get_model('inventory', 'StockBalance')
+    rows = StockMovement.objects.order_by().values('product_id', 'warehouse_id').annotate(
+        on_hand=Sum(Case(
+            When(movement_type='IN', then=F('quantity')),
+            default=-F('quantity'),
+            output_field=IntegerField()
+        )),
+        last_movement_at=Max('created_at')
+    )
+    StockBalance.objects.bulk_create([StockBalance(**row) for row in rows], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0007_product_season_product_series'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('on_hand', models.IntegerField(default=0, verbose_name='当前库存')),
+                ('last_movement_at', models.DateTimeField(blank=True, null=True, verbose_name='最后变动时间')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventory.product', verbose_name='产品')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventory.warehouse', verbose_name='仓库')),
+            ],
+            options={
+                'verbose_name': '库存余额',
+                'verbose_name_plural': '库存余额',
+                'constraints': [models.UniqueConstraint(fields=('product', 'warehouse'), name='unique_stock_balance')],
+            },
+        ),
+        migrations.RunPython(build_stock_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0008_stockbalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='日期')),
+                ('on_hand', models.IntegerField(default=0, verbose_name='收盘库存')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventory.product', verbose_name='产品')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventory.warehouse', verbose_name='仓库')),
+            ],
+            options={
+                'verbose_name': '历史库存快照',
+                'verbose_name_plural': '历史库存快照',
+                'indexes': [models.Index(fields=['date'], name='stock_snapshot_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'warehouse', 'date'), name='unique_stock_snapshot')],
+            },
+        ),
+    ]
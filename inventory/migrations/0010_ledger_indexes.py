@@ -0,0 +1,57 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0009_stocksnapshot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='incomingstock',
+            index=models.Index(condition=models.Q(('status', '待入库')), fields=['product', 'warehouse', 'quantity'], name='incoming_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incomingstock',
+            index=models.Index(fields=['expected_arrival_date', 'created_at'], name='incoming_arrival_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incomingstock',
+            index=models.Index(fields=['status', 'expected_arrival_date'], name='incoming_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name'], name='product_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productionorder',
+            index=models.Index(condition=models.Q(('remaining_quantity__gt', 0)), fields=['product', 'created_at', 'remaining_quantity'], name='order_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productionorder',
+            index=models.Index(fields=['created_at'], name='order_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productionorder',
+            index=models.Index(fields=['remaining_quantity'], name='order_remaining_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['product', 'warehouse', 'movement_type', 'date', 'quantity'], name='movement_ledger_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['date', 'product', 'warehouse', 'movement_type', 'quantity'], name='movement_date_ledger_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['date', 'created_at'], name='movement_date_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['created_at'], name='movement_created_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0011_stock_movement_keyset_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('products', '产品'), ('stock_movements', '库存变动'), ('incoming_stock', '入库途中产品'), ('production_orders', '生产订单')], max_length=30, verbose_name='导入类型')),
+                ('file', models.FileField(upload_to='imports/%Y/%m/', verbose_name='导入文件')),
+                ('status', models.CharField(choices=[('待处理', '待处理'), ('处理中', '处理中'), ('已完成', '已完成'), ('失败', '失败')], default='待处理', max_length=20, verbose_name='状态')),
+                ('total_rows', models.IntegerField(default=0, verbose_name='总行数')),
+                ('processed_rows', models.IntegerField(default=0, verbose_name='已处理行数')),
+                ('success_count', models.IntegerField(default=0, verbose_name='成功行数')),
+                ('error_count', models.IntegerField(default=0, verbose_name='错误行数')),
+                ('errors', models.JSONField(blank=True, default=list, verbose_name='错误信息')),
+                ('warnings', models.JSONField(blank=True, default=list, verbose_name='警告信息')),
+                ('summary', models.TextField(blank=True, verbose_name='结果摘要')),
+                ('worker', models.CharField(blank=True, max_length=100, verbose_name='处理进程')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='开始时间')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='完成时间')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='提交人')),
+            ],
+            options={
+                'verbose_name': '导入任务',
+                'verbose_name_plural': '导入任务',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='import_job_queue_idx')],
+            },
+        ),
+    ]
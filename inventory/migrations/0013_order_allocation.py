@@ -0,0 +1,40 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:37
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0012_importjob'),
+    ]
+
+    operations = [
+        # 已有记录扣减订单时没有留下明细，标记为False；之后新建的记录默认为True
+        migrations.AddField(
+            model_name='incomingstock',
+            name='allocation_tracked',
+            field=models.BooleanField(default=False, editable=False, verbose_name='已记录订单分配'),
+        ),
+        migrations.AlterField(
+            model_name='incomingstock',
+            name='allocation_tracked',
+            field=models.BooleanField(default=True, editable=False, verbose_name='已记录订单分配'),
+        ),
+        migrations.CreateModel(
+            name='OrderAllocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(validators=[django.core.validators.MinValueValidator(1)], verbose_name='数量')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('incoming_stock', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='allocations', to='inventory.incomingstock', verbose_name='入库途中产品')),
+                ('production_order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allocations', to='inventory.productionorder', verbose_name='生产订单')),
+            ],
+            options={
+                'verbose_name': '订单分配明细',
+                'verbose_name_plural': '订单分配明细',
+            },
+        ),
+    ]
@@ -0,0 +1,67 @@
+from django.db import migrations
+
+# 外部内容（external content）FTS5表：只保存索引，原文从业务表读取；由触发器保持同步，
+# 批量导入、QuerySet.update()和级联删除同样会触发
+INDEXES = [
+    ('inventory_product', ('sku', 'fnsku', 'name', 'series'), False),
+    # 库存变动和入库途中记录的备注大多为空，只为有备注的记录建索引
+    ('inventory_stockmovement', ('notes',), True),
+    ('inventory_incomingstock', ('notes',), True),
+]
+
+
+def index_sql(table, columns, skip_blank):
+    fts = f'{table}_fts'
+    cols = ', '.join(columns)
+    new = ', '.join(f'new.{column}' for column in columns)
+    old = ', '.join(f'old.{column}' for column in columns)
+    new_where = ' WHERE ' + ' OR '.join(f"new.{column} <> ''" for column in columns) if skip_blank else ''
+    old_where = ' WHERE ' + ' OR '.join(f"old.{column} <> ''" for column in columns) if skip_blank else ''
+    source_where = ' WHERE ' + ' OR '.join(f"{column} <> ''" for column in columns) if skip_blank else ''
+    insert = f'INSERT INTO {fts}(rowid, {cols}) SELECT new.id, {new}{new_where};'
+    delete = f"INSERT INTO {fts}({fts}, rowid, {cols}) SELECT 'delete', old.id, {old}{old_where};"
+    return [
+        f"CREATE VIRTUAL TABLE {fts} USING fts5({cols}, content='{table}', content_rowid='id', tokenize='trigram')",
+        f'CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN {insert} END',
+        f'CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN {delete} END',
+        f'CREATE TRIGGER {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN {delete} {insert} END',
+        f'INSERT INTO {fts}(rowid, {cols}) SELECT id, {cols} FROM {table}{source_where}',
+    ]
+
+
+def fts5_supported(connection):
+    # trigram分词器需要SQLite 3.34及以上版本
+    if connection.vendor != 'sqlite' or connection.Database.sqlite_version_info < (3, 34):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def create_search_index(apps, schema_editor):
+    # 不支持FTS5的数据库不建索引，搜索退回到icontains
+    if not fts5_supported(schema_editor.connection):
+        return
+    for table, columns, skip_blank in INDEXES:
+        for sql in index_sql(table, columns, skip_blank):
+            schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table, columns, skip_blank in INDEXES:
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {table}_fts_{suffix}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {table}_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0014_data_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
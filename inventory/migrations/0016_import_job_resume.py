@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0015_fulltext_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='最后进度时间'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='totals',
+            field=models.JSONField(blank=True, default=dict, verbose_name='累计结果'),
+        ),
+    ]
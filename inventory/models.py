@@ -1,9 +1,122 @@
-from django.db import models
+from datetime import timedelta
+from django.conf import settings
+from django.db import models, transaction
 from django.core.validators import MinValueValidator
-from django.db.models import Sum
+from django.db.models import Sum, Max, Case, When, F
 from django.utils import timezone
 
-class Warehouse(models.Model):
+class DataVersionManager(models.Manager):
+    def bump(self, *model_classes):
+        """递增各模型的数据版本号，在写入数据的同一事务中调用"""
+        now = timezone.now()
+        keys = {model._meta.label_lower for model in model_classes}
+        if self.filter(key__in=keys).update(version=F('version') + 1, updated_at=now) == len(keys):
+            return
+        # 第一次写入的表还没有版本记录
+        for key in keys - set(self.filter(key__in=keys).values_list('key', flat=True)):
+            _, created = self.get_or_create(key=key, defaults={'version': 1, 'updated_at': now})
+            if not created:
+                self.filter(key=key).update(version=F('version') + 1, updated_at=now)
+
+    def current_versions(self, *model_classes):
+        """一次查询返回多个模型的数据版本 {label: (version, updated_at)}，没有写入过的模型不在结果中"""
+        keys = [model._meta.label_lower for model in model_classes]
+        return {key: (version, updated_at) for key, version, updated_at in
+                self.filter(key__in=keys).values_list('key', 'version', 'updated_at')}
+
+    def current(self, model):
+        """返回模型当前的数据版本，没有写入过时为None
+
+        同时返回更新时间，数据库被替换或回滚后版本号即使相同也能区分。
+        """
+        return self.filter(key=model._meta.label_lower).values_list('version', 'updated_at').first()
+
+class DataVersion(models.Model):
+    """每张表的数据版本号，表中数据有写入时递增，用于使各进程内的缓存失效"""
+    key = models.CharField('数据表', max_length=100, unique=True)
+    version = models.PositiveBigIntegerField('版本号', default=0)
+    updated_at = models.DateTimeField('更新时间', default=timezone.now)
+
+    objects = DataVersionManager()
+
+    def __str__(self):
+        return f"{self.key} v{self.version}"
+
+    class Meta:
+        verbose_name = '数据版本'
+        verbose_name_plural = '数据版本'
+
+def cascade_models(model):
+    """删除model的记录时会被一起删除或修改（CASCADE、SET_NULL等）的带版本号的模型，包括model本身
+
+    Django的级联删除不调用关联模型的delete，这些表的版本号需要随之递增。
+    """
+    models_found = []
+    pending = [model]
+    while pending:
+        current = pending.pop()
+        if current in models_found:
+            continue
+        models_found.append(current)
+        for relation in current._meta.related_objects:
+            if relation.on_delete is not models.DO_NOTHING:
+                pending.append(relation.related_model)
+    return [found for found in models_found if issubclass(found, VersionedModel)]
+
+class VersionedQuerySet(models.QuerySet):
+    """批量写入（bulk_create、bulk_update、update、delete）后递增数据版本号
+
+    这些方法不会调用模型的save/delete，单条记录的保存和删除由 VersionedModel 递增版本号。
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            DataVersion.objects.bump(self.model)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            rows = super().bulk_update(objs, fields, *args, **kwargs)
+            DataVersion.objects.bump(self.model)
+        return rows
+
+    def update(self, **kwargs):
+        with transaction.atomic(using=self.db):
+            rows = super().update(**kwargs)
+            DataVersion.objects.bump(self.model)
+        return rows
+
+    update.alters_data = True
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            result = super().delete()
+            DataVersion.objects.bump(*cascade_models(self.model))
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+class VersionedModel(models.Model):
+    """写入时递增数据版本号的模型基类，页面缓存和自动补全索引按版本号失效"""
+    objects = VersionedQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            DataVersion.objects.bump(type(self))
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            DataVersion.objects.bump(*cascade_models(type(self)))
+        return result
+
+    class Meta:
+        abstract = True
+
+class Warehouse(VersionedModel):
     name = models.CharField('仓库名称', max_length=100)
     code = models.CharField('仓库代码', max_length=50, unique=True)
     address = models.TextField('地址', blank=True)
@@ -15,7 +128,7 @@ class Warehouse(models.Model):
         verbose_name = '仓库'
         verbose_name_plural = '仓库'
 
-class Product(models.Model):
+class Product(VersionedModel):
     sku = models.CharField('SKU', max_length=100, unique=True)
     fnsku = models.CharField('FNSKU', max_length=100, blank=True)
     name = models.CharField('产品名称', max_length=200)
@@ -31,34 +144,19 @@ class Product(models.Model):
 
     def get_stock_by_warehouse(self, warehouse):
         """获取指定仓库的库存数量"""
-        total_in = StockMovement.objects.filter(
+        balance = StockBalance.objects.filter(
             product=self,
-            warehouse=warehouse,
-            movement_type='IN'
-        ).aggregate(total=Sum('quantity'))['total'] or 0
+            warehouse=warehouse
+        ).values_list('on_hand', flat=True).first()
 
-        total_out = StockMovement.objects.filter(
-            product=self,
-            warehouse=warehouse,
-            movement_type='OUT'
-        ).aggregate(total=Sum('quantity'))['total'] or 0
-
-        return total_in - total_out
+        return balance or 0
 
     @property
     def total_stock(self):
         """获取所有仓库的总库存"""
-        total_in = StockMovement.objects.filter(
-            product=self,
-            movement_type='IN'
-        ).aggregate(total=Sum('quantity'))['total'] or 0
-
-        total_out = StockMovement.objects.filter(
-            product=self,
-            movement_type='OUT'
-        ).aggregate(total=Sum('quantity'))['total'] or 0
-
-        return total_in - total_out
+        return StockBalance.objects.filter(
+            product=self
+        ).aggregate(total=Sum('on_hand'))['total'] or 0
 
     def __str__(self):
         return f"{self.name} ({self.sku})"
@@ -66,8 +164,123 @@ class Product(models.Model):
     class Meta:
         verbose_name = '产品'
         verbose_name_plural = '产品'
+        indexes = [
+            # 产品列表按产品SKU（name字段）排序，sort=name 时使用
+            models.Index(fields=['name'], name='product_name_idx'),
+        ]
+
+def signed_quantity(movement_type, quantity):
+    """入库为正数，出库为负数"""
+    return quantity if movement_type == 'IN' else -quantity
+
+def signed_quantity_expression():
+    """SQL中的带符号数量表达式：入库为正数，出库为负数"""
+    return Case(
+        When(movement_type='IN', then=F('quantity')),
+        default=-F('quantity'),
+        output_field=models.IntegerField()
+    )
+
+def collect_ledger_changes(movements, sign=1):
+    """汇总库存变动记录的影响 {(product_id, warehouse_id, date): 数量变化}"""
+    changes = {}
+    for movement in movements:
+        key = (movement.product_id, movement.warehouse_id, movement.date)
+        changes[key] = changes.get(key, 0) + sign * signed_quantity(movement.movement_type, movement.quantity)
+    return changes
+
+def record_ledger_changes(changes):
+    """将库存变动流水的变化同步到库存余额和历史库存快照"""
+    balance_deltas = {}
+    for (product_id, warehouse_id, _), quantity in changes.items():
+        key = (product_id, warehouse_id)
+        balance_deltas[key] = balance_deltas.get(key, 0) + quantity
+    StockBalance.objects.apply_deltas(balance_deltas)
+    StockSnapshot.objects.apply_deltas(changes)
+
+def rebuild_ledger_read_models(product_ids=None):
+    """根据库存变动流水重新计算指定产品的库存余额和历史库存快照"""
+    StockBalance.objects.rebuild(product_ids)
+    StockSnapshot.objects.rebuild(product_ids)
+
+class StockMovementQuerySet(VersionedQuerySet):
+    """库存变动查询集
+
+    bulk_create、update、bulk_update和delete不会调用模型的save/delete，
+    这里在同一事务中同步维护StockBalance余额表和StockSnapshot快照表。
+    """
+    # 影响库存余额和快照的字段
+    LEDGER_FIELDS = {'product', 'product_id', 'warehouse', 'warehouse_id', 'movement_type', 'quantity', 'date'}
+
+    def bulk_create(self, objs, batch_size=None, ignore_conflicts=False, update_conflicts=False, **kwargs):
+        objs = list(objs)
+        kwargs.update(batch_size=batch_size, ignore_conflicts=ignore_conflicts, update_conflicts=update_conflicts)
+        with transaction.atomic(using=self.db):
+            if not (ignore_conflicts or update_conflicts):
+                objs = super().bulk_create(objs, **kwargs)
+                record_ledger_changes(collect_ledger_changes(objs))
+                return objs
+
+            # 冲突的记录被跳过或改为更新，无法得知实际写入了哪些，按流水重新计算涉及的产品（包括被更新记录原来的产品）
+            product_ids = {obj.product_id for obj in objs}
+            pks = [obj.pk for obj in objs if obj.pk is not None]
+            for i in range(0, len(pks), StockBalanceManager.batch_size):
+                product_ids.update(self.model.objects.filter(
+                    pk__in=pks[i:i + StockBalanceManager.batch_size]
+                ).values_list('product_id', flat=True))
+            objs = super().bulk_create(objs, **kwargs)
+            rebuild_ledger_read_models(product_ids)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if not self.LEDGER_FIELDS.intersection(fields):
+            return super().bulk_update(objs, fields, *args, **kwargs)
+
+        objs = list(objs)
+        with transaction.atomic(using=self.db):
+            # 原记录和新记录涉及的产品都需要重新计算
+            product_ids = set(self.model.objects.filter(
+                pk__in=[obj.pk for obj in objs]
+            ).order_by().values_list('product_id', flat=True).distinct())
+            product_ids.update(obj.product_id for obj in objs)
+            rows = super().bulk_update(objs, fields, *args, **kwargs)
+            rebuild_ledger_read_models(product_ids)
+        return rows
+
+    def update(self, **kwargs):
+        if not self.LEDGER_FIELDS.intersection(kwargs):
+            return super().update(**kwargs)
+
+        with transaction.atomic(using=self.db):
+            product_ids = set(self.order_by().values_list('product_id', flat=True).distinct())
+            new_product = kwargs.get('product', kwargs.get('product_id'))
+            if hasattr(new_product, 'resolve_expression'):
+                # 无法预知更新后的产品，重新计算全部余额
+                product_ids = None
+            elif new_product is not None:
+                product_ids.add(getattr(new_product, 'pk', new_product))
+            rows = super().update(**kwargs)
+            rebuild_ledger_read_models(product_ids)
+        return rows
 
-class StockMovement(models.Model):
+    update.alters_data = True
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            changes = {
+                (row['product_id'], row['warehouse_id'], row['date']): -row['quantity']
+                for row in self.order_by().values('product_id', 'warehouse_id', 'date').annotate(
+                    quantity=Sum(signed_quantity_expression())
+                )
+            }
+            result = super().delete()
+            record_ledger_changes(changes)
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+class StockMovement(VersionedModel):
     MOVEMENT_TYPES = [
         ('IN', '入库'),
         ('OUT', '出库'),
@@ -81,15 +294,274 @@ class StockMovement(models.Model):
     notes = models.TextField('备注', blank=True)
     created_at = models.DateTimeField('创建时间', auto_now_add=True)
 
+    objects = StockMovementQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.get_movement_type_display()}: {self.product.name} - {self.quantity}"
 
+    def save(self, *args, **kwargs):
+        # 保存流水的同时在同一事务中更新库存余额和历史库存快照
+        with transaction.atomic():
+            changes = {}
+            if self.pk:
+                original = StockMovement.objects.filter(pk=self.pk).first()
+                if original:
+                    changes = collect_ledger_changes([original], sign=-1)
+            super().save(*args, **kwargs)
+            for key, quantity in collect_ledger_changes([self]).items():
+                changes[key] = changes.get(key, 0) + quantity
+            record_ledger_changes(changes)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            record_ledger_changes(collect_ledger_changes([self], sign=-1))
+        return result
+
     class Meta:
         verbose_name = '库存变动'
         verbose_name_plural = '库存变动'
         ordering = ['-date', '-created_at']
+        indexes = [
+            # 按产品/仓库/类型/日期汇总库存，末尾的数量列使索引可以覆盖查询
+            models.Index(fields=['product', 'warehouse', 'movement_type', 'date', 'quantity'], name='movement_ledger_idx'),
+            # 按日期区间汇总库存（历史库存、库存快照）
+            models.Index(fields=['date', 'product', 'warehouse', 'movement_type', 'quantity'], name='movement_date_ledger_idx'),
+            # 库存变动列表的默认排序（游标分页按 日期, ID 排序，SQLite索引自带rowid）
+            models.Index(fields=['date'], name='movement_date_idx'),
+            models.Index(fields=['created_at'], name='movement_created_idx'),
+        ]
+
+class StockBalanceManager(models.Manager):
+    # SQLite单条语句的参数数量有限，按批次查询
+    batch_size = 500
+
+    def apply_deltas(self, deltas):
+        """按 {(product_id, warehouse_id): 数量变化} 增量更新库存余额"""
+        deltas = {key: quantity for key, quantity in deltas.items() if quantity}
+        if not deltas:
+            return
+
+        now = timezone.now()
+        with transaction.atomic(using=self.db):
+            product_ids = sorted({product_id for product_id, _ in deltas})
+            warehouse_ids = {warehouse_id for _, warehouse_id in deltas}
+            existing = {}
+            for i in range(0, len(product_ids), self.batch_size):
+                for balance in self.select_for_update().filter(
+                    product_id__in=product_ids[i:i + self.batch_size],
+                    warehouse_id__in=warehouse_ids
+                ):
+                    existing[(balance.product_id, balance.warehouse_id)] = balance
+
+            to_update = []
+            to_create = []
+            for (product_id, warehouse_id), quantity in deltas.items():
+                balance = existing.get((product_id, warehouse_id))
+                if balance:
+                    balance.on_hand = F('on_hand') + quantity
+                    balance.last_movement_at = now
+                    to_update.append(balance)
+                else:
+                    to_create.append(self.model(
+                        product_id=product_id,
+                        warehouse_id=warehouse_id,
+                        on_hand=quantity,
+                        last_movement_at=now
+                    ))
+
+            if to_update:
+                self.bulk_update(to_update, ['on_hand', 'last_movement_at'], batch_size=self.batch_size)
+            if to_create:
+                self.bulk_create(to_create, batch_size=self.batch_size)
+
+    def rebuild(self, product_ids=None):
+        """根据库存变动流水重新计算库存余额，product_ids为None时重新计算全部产品"""
+        with transaction.atomic(using=self.db):
+            if product_ids is None:
+                self.all().delete()
+                batches = [StockMovement.objects.all()]
+            else:
+                product_ids = sorted(product_ids)
+                batches = []
+                for i in range(0, len(product_ids), self.batch_size):
+                    batch_ids = product_ids[i:i + self.batch_size]
+                    self.filter(product_id__in=batch_ids).delete()
+                    batches.append(StockMovement.objects.filter(product_id__in=batch_ids))
+
+            for movements in batches:
+                rows = movements.order_by().values('product_id', 'warehouse_id').annotate(
+                    on_hand=Sum(signed_quantity_expression()),
+                    last_movement_at=Max('created_at')
+                )
+                self.bulk_create([self.model(**row) for row in rows], batch_size=self.batch_size)
+
+class StockBalance(models.Model):
+    """产品在各仓库的当前库存余额，随库存变动流水同步维护"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name='产品')
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, verbose_name='仓库')
+    on_hand = models.IntegerField('当前库存', default=0)
+    last_movement_at = models.DateTimeField('最后变动时间', null=True, blank=True)
+
+    objects = StockBalanceManager()
+
+    def __str__(self):
+        return f"{self.product.sku} - {self.warehouse.code}: {self.on_hand}"
+
+    class Meta:
+        verbose_name = '库存余额'
+        verbose_name_plural = '库存余额'
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'warehouse'], name='unique_stock_balance'),
+        ]
+
+class StockSnapshotManager(models.Manager):
+    # SQLite单条语句的参数数量有限，按批次写入
+    batch_size = 500
+
+    def closing_balances(self, as_of):
+        """截至某日的收盘库存 {(product_id, warehouse_id): 库存}
+
+        读取不晚于该日期的最近一次快照，只汇总快照之后到该日期之间的库存变动。
+        """
+        balances = {}
+        movements = StockMovement.objects.filter(date__lte=as_of)
+        snapshot_date = self.filter(date__lte=as_of).aggregate(latest=Max('date'))['latest']
+        if snapshot_date:
+            for product_id, warehouse_id, on_hand in self.filter(date=snapshot_date).values_list(
+                'product_id', 'warehouse_id', 'on_hand'
+            ):
+                balances[(product_id, warehouse_id)] = on_hand
+            movements = movements.filter(date__gt=snapshot_date)
+
+        rows = movements.order_by().values('product_id', 'warehouse_id').annotate(
+            quantity=Sum(signed_quantity_expression())
+        )
+        for row in rows:
+            key = (row['product_id'], row['warehouse_id'])
+            balances[key] = balances.get(key, 0) + row['quantity']
+        return balances
+
+    def build(self, start, end=None):
+        """生成start至end（含）每天的收盘库存快照，返回写入的记录数"""
+        end = end or start
+        balances = self.closing_balances(start - timedelta(days=1))
+
+        # 一次查询取出区间内按日期分组的库存变动
+        daily_changes = {}
+        rows = StockMovement.objects.filter(date__range=(start, end)).order_by().values(
+            'date', 'product_id', 'warehouse_id'
+        ).annotate(quantity=Sum(signed_quantity_expression()))
+        for row in rows:
+            daily_changes.setdefault(row['date'], []).append(row)
+
+        count = 0
+        with transaction.atomic(using=self.db):
+            self.filter(date__range=(start, end)).delete()
+            day = start
+            while day <= end:
+                for row in daily_changes.get(day, []):
+                    key = (row['product_id'], row['warehouse_id'])
+                    balances[key] = balances.get(key, 0) + row['quantity']
+                self.bulk_create([
+                    self.model(product_id=product_id, warehouse_id=warehouse_id, date=day, on_hand=on_hand)
+                    for (product_id, warehouse_id), on_hand in balances.items()
+                ], batch_size=self.batch_size)
+                count += len(balances)
+                day += timedelta(days=1)
+        return count
+
+    def apply_deltas(self, changes):
+        """补录或删除历史日期的库存变动时，增量修正该日期及之后的快照
+
+        changes: {(product_id, warehouse_id, date): 数量变化}
+        """
+        changes = {key: quantity for key, quantity in changes.items() if quantity}
+        if not changes:
+            return
+
+        earliest = min(date for _, _, date in changes)
+        snapshot_dates = set(self.filter(date__gte=earliest).order_by().values_list('date', flat=True).distinct())
+        if not snapshot_dates:
+            return
+
+        if len(changes) > self.batch_size:
+            # 大批量补录时按产品重新计算更快
+            self.rebuild({product_id for product_id, _, _ in changes})
+            return
+
+        with transaction.atomic(using=self.db):
+            for (product_id, warehouse_id, date), quantity in changes.items():
+                dates = {snapshot_date for snapshot_date in snapshot_dates if snapshot_date >= date}
+                if not dates:
+                    continue
+                snapshots = self.filter(product_id=product_id, warehouse_id=warehouse_id, date__gte=date)
+                updated = snapshots.update(on_hand=F('on_hand') + quantity)
+                if updated < len(dates):
+                    # 快照中没有该产品/仓库的记录，说明当日库存为0
+                    missing = dates - set(snapshots.values_list('date', flat=True))
+                    self.bulk_create([
+                        self.model(product_id=product_id, warehouse_id=warehouse_id, date=snapshot_date, on_hand=quantity)
+                        for snapshot_date in missing
+                    ])
+
+    def rebuild(self, product_ids=None):
+        """根据库存变动流水重新计算已有快照日期的快照，product_ids为None时重新计算全部产品"""
+        snapshot_dates = sorted(self.order_by().values_list('date', flat=True).distinct())
+        if not snapshot_dates:
+            return
+
+        with transaction.atomic(using=self.db):
+            if product_ids is None:
+                self.all().delete()
+                batches = [StockMovement.objects.all()]
+            else:
+                product_ids = sorted(product_ids)
+                batches = []
+                for i in range(0, len(product_ids), self.batch_size):
+                    batch_ids = product_ids[i:i + self.batch_size]
+                    self.filter(product_id__in=batch_ids).delete()
+                    batches.append(StockMovement.objects.filter(product_id__in=batch_ids))
+
+            for movements in batches:
+                rows = movements.filter(date__lte=snapshot_dates[-1]).order_by('date').values(
+                    'date', 'product_id', 'warehouse_id'
+                ).annotate(quantity=Sum(signed_quantity_expression())).iterator()
+                balances = {}
+                pending = next(rows, None)
+                for snapshot_date in snapshot_dates:
+                    while pending and pending['date'] <= snapshot_date:
+                        key = (pending['product_id'], pending['warehouse_id'])
+                        balances[key] = balances.get(key, 0) + pending['quantity']
+                        pending = next(rows, None)
+                    self.bulk_create([
+                        self.model(product_id=product_id, warehouse_id=warehouse_id, date=snapshot_date, on_hand=on_hand)
+                        for (product_id, warehouse_id), on_hand in balances.items()
+                    ], batch_size=self.batch_size)
+
+class StockSnapshot(models.Model):
+    """每日收盘库存快照，用于快速查询历史库存"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name='产品')
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, verbose_name='仓库')
+    date = models.DateField('日期')
+    on_hand = models.IntegerField('收盘库存', default=0)
+
+    objects = StockSnapshotManager()
+
+    def __str__(self):
+        return f"{self.date} {self.product.sku} - {self.warehouse.code}: {self.on_hand}"
+
+    class Meta:
+        verbose_name = '历史库存快照'
+        verbose_name_plural = '历史库存快照'
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'warehouse', 'date'], name='unique_stock_snapshot'),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='stock_snapshot_date_idx'),
+        ]
 
-class IncomingStock(models.Model):
+class IncomingStock(VersionedModel):
     """入库途中产品模型"""
     product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name='产品')
     warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, verbose_name='仓库')
@@ -98,6 +570,8 @@ class IncomingStock(models.Model):
     status = models.CharField('状态', max_length=20, default='待入库', 
                              choices=[('待入库', '待入库'), ('已入库', '已入库')])
     notes = models.TextField('备注', blank=True)
+    # 之后创建的记录扣减生产订单时都会写入OrderAllocation明细；迁移前的历史记录为False
+    allocation_tracked = models.BooleanField('已记录订单分配', default=True, editable=False)
     created_at = models.DateTimeField('创建时间', auto_now_add=True)
     updated_at = models.DateTimeField('更新时间', auto_now=True)
     
@@ -108,8 +582,16 @@ class IncomingStock(models.Model):
         verbose_name = '入库途中产品'
         verbose_name_plural = '入库途中产品'
         ordering = ['expected_arrival_date', '-created_at']
+        indexes = [
+            # 只索引待入库记录，用于汇总在途数量
+            models.Index(fields=['product', 'warehouse', 'quantity'], name='incoming_pending_idx',
+                         condition=models.Q(status='待入库')),
+            # 入库途中列表的排序
+            models.Index(fields=['expected_arrival_date', 'created_at'], name='incoming_arrival_idx'),
+            models.Index(fields=['status', 'expected_arrival_date'], name='incoming_status_idx'),
+        ]
 
-class ProductionOrder(models.Model):
+class ProductionOrder(VersionedModel):
     """生产订单模型"""
     product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name='产品')
     order_number = models.CharField('订单号', max_length=100)
@@ -131,3 +613,128 @@ class ProductionOrder(models.Model):
         verbose_name = '生产订单'
         verbose_name_plural = '生产订单'
         ordering = ['-created_at']
+        indexes = [
+            # 只索引未完成的订单，用于按创建时间先后扣减和汇总剩余数量
+            models.Index(fields=['product', 'created_at', 'remaining_quantity'], name='order_open_idx',
+                         condition=models.Q(remaining_quantity__gt=0)),
+            # 生产订单列表的排序
+            models.Index(fields=['created_at'], name='order_created_idx'),
+            models.Index(fields=['remaining_quantity'], name='order_remaining_idx'),
+        ]
+
+
+class OrderAllocation(models.Model):
+    """入库途中记录从生产订单扣减数量的明细
+
+    删除或修改入库途中记录时按明细精确恢复对应订单；
+    已入库的记录被删除后明细保留（入库途中记录置空），订单的扣减仍然有效。
+    """
+    incoming_stock = models.ForeignKey(IncomingStock, on_delete=models.SET_NULL, null=True, blank=True,
+                                       related_name='allocations', verbose_name='入库途中产品')
+    production_order = models.ForeignKey(ProductionOrder, on_delete=models.CASCADE,
+                                         related_name='allocations', verbose_name='生产订单')
+    quantity = models.IntegerField('数量', validators=[MinValueValidator(1)])
+    created_at = models.DateTimeField('创建时间', auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.production_order.order_number} - {self.quantity}"
+
+    class Meta:
+        verbose_name = '订单分配明细'
+        verbose_name_plural = '订单分配明细'
+
+# 处理中的任务超过该时间（秒）没有进度更新，视为处理进程已退出，可被其他进程重新领取
+IMPORT_JOB_STALE_SECONDS = 600
+
+class ImportJobManager(models.Manager):
+    def claim_next(self, worker):
+        """领取最早提交的待处理任务，返回任务或None
+
+        先查出候选任务，再用带状态条件的UPDATE把它改为处理中；
+        只有UPDATE影响了一行的进程才算领取成功，多个进程同时运行时不会重复处理同一任务。
+        处理中但超过 IMPORT_JOB_STALE_SECONDS 没有进度更新的任务同样可以领取，从已处理的行继续导入。
+        """
+        while True:
+            stale = models.Q(status=ImportJob.STATUS_RUNNING,
+                             heartbeat_at__lt=timezone.now() - timedelta(seconds=IMPORT_JOB_STALE_SECONDS))
+            candidate = self.filter(models.Q(status=ImportJob.STATUS_PENDING) | stale).order_by('created_at', 'pk').values_list(
+                'pk', 'status', 'heartbeat_at').first()
+            if candidate is None:
+                return None
+            job_id, status, heartbeat_at = candidate
+            now = timezone.now()
+            claimed = self.filter(pk=job_id, status=status, heartbeat_at=heartbeat_at).update(
+                status=ImportJob.STATUS_RUNNING,
+                worker=worker,
+                started_at=now,
+                heartbeat_at=now
+            )
+            if claimed:
+                return self.get(pk=job_id)
+
+class ImportJob(models.Model):
+    """Excel导入任务，上传后由后台进程（run_import_worker命令）处理"""
+    STATUS_PENDING = '待处理'
+    STATUS_RUNNING = '处理中'
+    STATUS_DONE = '已完成'
+    STATUS_FAILED = '失败'
+
+    KIND_CHOICES = [
+        ('products', '产品'),
+        ('stock_movements', '库存变动'),
+        ('incoming_stock', '入库途中产品'),
+        ('production_orders', '生产订单'),
+    ]
+
+    kind = models.CharField('导入类型', max_length=30, choices=KIND_CHOICES)
+    file = models.FileField('导入文件', upload_to='imports/%Y/%m/')
+    status = models.CharField('状态', max_length=20, default=STATUS_PENDING, choices=[
+        (STATUS_PENDING, STATUS_PENDING), (STATUS_RUNNING, STATUS_RUNNING),
+        (STATUS_DONE, STATUS_DONE), (STATUS_FAILED, STATUS_FAILED),
+    ])
+    total_rows = models.IntegerField('总行数', default=0)
+    processed_rows = models.IntegerField('已处理行数', default=0)
+    success_count = models.IntegerField('成功行数', default=0)
+    error_count = models.IntegerField('错误行数', default=0)
+    errors = models.JSONField('错误信息', default=list, blank=True)
+    warnings = models.JSONField('警告信息', default=list, blank=True)
+    totals = models.JSONField('累计结果', default=dict, blank=True)
+    summary = models.TextField('结果摘要', blank=True)
+    worker = models.CharField('处理进程', max_length=100, blank=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='提交人')
+    created_at = models.DateTimeField('创建时间', auto_now_add=True)
+    started_at = models.DateTimeField('开始时间', null=True, blank=True)
+    finished_at = models.DateTimeField('完成时间', null=True, blank=True)
+    heartbeat_at = models.DateTimeField('最后进度时间', null=True, blank=True)
+
+    objects = ImportJobManager()
+
+    def __str__(self):
+        return f"{self.get_kind_display()}导入 #{self.pk} - {self.status}"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED)
+
+    @property
+    def progress(self):
+        """处理进度百分比"""
+        if not self.total_rows:
+            return 100 if self.is_finished else 0
+        return int(self.processed_rows * 100 / self.total_rows)
+
+    @property
+    def rows_per_second(self):
+        if not self.started_at or not self.processed_rows:
+            return 0
+        elapsed = ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+        return round(self.processed_rows / elapsed, 1) if elapsed > 0 else 0
+
+    class Meta:
+        verbose_name = '导入任务'
+        verbose_name_plural = '导入任务'
+        ordering = ['-created_at']
+        indexes = [
+            # 后台进程按提交顺序领取待处理任务
+            models.Index(fields=['status', 'created_at'], name='import_job_queue_idx'),
+        ]
@@ -0,0 +1,84 @@
+import base64
+import json
+from datetime import date, datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+def encode_cursor(values):
+    """将排序字段值和主键编码为URL安全的游标"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """解析游标，格式错误时返回None"""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, UnicodeError):
+        return None
+    if not isinstance(values, list) or len(values) != 2:
+        return None
+    return values
+
+
+def _field_value(obj, field):
+    value = obj
+    for part in field.split('__'):
+        value = getattr(value, part)
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    return value
+
+
+def keyset_paginate(queryset, sort_by, after=None, before=None, page_size=50):
+    """游标（keyset）分页
+
+    按 sort_by 和主键排序，用上一页最后一行（或下一页第一行）的值作为条件定位，
+    不使用OFFSET，因此翻到第N页和第1页的开销相同。
+    after 用于下一页，before 用于上一页。
+    """
+    field = sort_by.lstrip('-')
+    descending = sort_by.startswith('-')
+    backwards = bool(before) and not after
+    cursor = decode_cursor(before if backwards else after)
+
+    if cursor:
+        value, pk = cursor
+        # 降序向后翻页、升序向前翻页时取更小的值
+        lookup = 'lt' if descending != backwards else 'gt'
+        # 先用范围条件让数据库沿索引顺序读取，再排除与游标同值的已读记录
+        try:
+            queryset = queryset.filter(
+                Q(**{f'{field}__{lookup}e': value}),
+                Q(**{f'{field}__{lookup}': value}) | Q(**{f'pk__{lookup}': pk})
+            )
+        except (ValidationError, ValueError, TypeError):
+            # 游标的值与排序字段的类型不符（被修改过或排序已改变），按没有游标处理
+            cursor = None
+    if not cursor:
+        backwards = False
+
+    if descending != backwards:
+        ordering = ['-' + field, '-pk']
+    else:
+        ordering = [field, 'pk']
+
+    rows = list(queryset.order_by(*ordering)[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+        has_next, has_previous = True, has_more
+    else:
+        has_next, has_previous = has_more, cursor is not None
+
+    return {
+        'object_list': rows,
+        'has_next': has_next and bool(rows),
+        'has_previous': has_previous and bool(rows),
+        'next_cursor': encode_cursor([_field_value(rows[-1], field), rows[-1].pk]) if has_next and rows else '',
+        'previous_cursor': encode_cursor([_field_value(rows[0], field), rows[0].pk]) if has_previous and rows else '',
+    }
@@ -0,0 +1,230 @@
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Product, StockMovement, IncomingStock
+
+# FTS5使用trigram分词器，按子串匹配（与icontains一致，中文无需分词），关键词至少3个字符
+SEARCH_MIN_TERM_LENGTH = 3
+SEARCH_RESULTS_PER_PAGE = 20
+# 全文索引表（迁移0015中创建），bm25权重与列一一对应，店铺SKU和FNSKU的权重最高
+SEARCH_INDEXES = {
+    'product': {'model': Product, 'columns': ('sku', 'fnsku', 'name', 'series'),
+                'weights': (10.0, 10.0, 5.0, 2.0), 'label': '产品'},
+    'movement': {'model': StockMovement, 'columns': ('notes',), 'weights': (1.0,), 'label': '库存变动'},
+    'incoming': {'model': IncomingStock, 'columns': ('notes',), 'weights': (1.0,), 'label': '入库途中'},
+}
+# snippet() 中标记命中位置的字符，转义HTML后替换为<mark>
+_MARK_START, _MARK_END = '\x02', '\x03'
+
+_available = {}
+
+
+def fts_table(kind):
+    return SEARCH_INDEXES[kind]['model']._meta.db_table + '_fts'
+
+
+def _trigger_sql(kind):
+    """全文索引的同步触发器 {名称: CREATE TRIGGER语句}，与迁移0015中创建的相同"""
+    index = SEARCH_INDEXES[kind]
+    table, fts = index['model']._meta.db_table, fts_table(kind)
+    cols = ', '.join(index['columns'])
+    new = ', '.join(f'new.{column}' for column in index['columns'])
+    old = ', '.join(f'old.{column}' for column in index['columns'])
+    # 产品全部进入索引，备注为空的记录不进入索引
+    new_where = old_where = ''
+    if kind != 'product':
+        new_where = ' WHERE ' + ' OR '.join(f"new.{column} <> ''" for column in index['columns'])
+        old_where = ' WHERE ' + ' OR '.join(f"old.{column} <> ''" for column in index['columns'])
+    insert = f'INSERT INTO {fts}(rowid, {cols}) SELECT new.id, {new}{new_where};'
+    delete = f"INSERT INTO {fts}({fts}, rowid, {cols}) SELECT 'delete', old.id, {old}{old_where};"
+    return {
+        f'{fts}_ai': f'CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN {insert} END',
+        f'{fts}_ad': f'CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN {delete} END',
+        f'{fts}_au': f'CREATE TRIGGER {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN {delete} {insert} END',
+    }
+
+
+def search_tables_exist(using='default'):
+    """当前数据库是否有全文索引表（只有SQLite才会创建）"""
+    connection = connections[using]
+    return connection.vendor == 'sqlite' and fts_table('product') in connection.introspection.table_names()
+
+
+def missing_search_triggers(using='default'):
+    """有全文索引表时，缺少的同步触发器名称
+
+    迁移中SQLite重建业务表（如修改字段）时会删除表上的触发器，之后的写入不再同步到全文索引。
+    """
+    if not search_tables_exist(using):
+        return []
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+        existing = {name for name, in cursor.fetchall()}
+    return [name for kind in SEARCH_INDEXES for name in _trigger_sql(kind) if name not in existing]
+
+
+def search_index_available(using='default'):
+    """全文索引是否可用：索引表存在且同步触发器齐全，结果按连接缓存
+
+    触发器缺失时索引可能已经过期，产品列表的搜索退回到icontains。
+    """
+    if using not in _available:
+        _available[using] = search_tables_exist(using) and not missing_search_triggers(using)
+    return _available[using]
+
+
+def rebuild_search_index(using='default'):
+    """重新创建缺失的同步触发器，清空并重新填充全部全文索引表
+
+    触发器失效（迁移重建了业务表）或恢复备份后使用。
+    """
+    missing = set(missing_search_triggers(using))
+    with connections[using].cursor() as cursor:
+        for kind, index in SEARCH_INDEXES.items():
+            for name, sql in _trigger_sql(kind).items():
+                if name in missing:
+                    cursor.execute(sql)
+            table = fts_table(kind)
+            columns = ', '.join(index['columns'])
+            cursor.execute(f"INSERT INTO {table}({table}) VALUES ('delete-all')")
+            # 备注为空的记录不进入索引，与触发器的条件一致
+            where = ' OR '.join(f"{column} <> ''" for column in index['columns'])
+            cursor.execute(f"INSERT INTO {table}(rowid, {columns}) "
+                           f"SELECT id, {columns} FROM {index['model']._meta.db_table} WHERE {where}")
+    _available.pop(using, None)
+
+
+def _phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _like(text):
+    return '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def split_terms(text):
+    """按空白拆分关键词并去重；返回 (可用于MATCH的关键词, 过短的关键词)"""
+    terms = list(dict.fromkeys(text.split()))
+    return ([term for term in terms if len(term) >= SEARCH_MIN_TERM_LENGTH],
+            [term for term in terms if len(term) < SEARCH_MIN_TERM_LENGTH])
+
+
+def filter_products(queryset, text):
+    """产品列表的搜索：店铺SKU或产品SKU包含text，有全文索引时通过索引查找"""
+    if len(text) >= SEARCH_MIN_TERM_LENGTH and search_index_available(queryset.db):
+        table = fts_table('product')
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {table} WHERE {table} MATCH %s', ['{sku name} : ' + _phrase(text)]
+        ))
+    return queryset.filter(Q(sku__icontains=text) | Q(name__icontains=text))
+
+
+def _where(kind, terms, short_terms):
+    """每个关键词都必须命中；过短的关键词在MATCH选出的行上用LIKE过滤"""
+    table = fts_table(kind)
+    sql = [f'{table} MATCH %s']
+    params = [' '.join(_phrase(term) for term in terms)]
+    for term in short_terms:
+        columns = SEARCH_INDEXES[kind]['columns']
+        sql.append('(' + ' OR '.join(f"{column} LIKE %s ESCAPE '\\'" for column in columns) + ')')
+        params.extend([_like(term)] * len(columns))
+    return ' AND '.join(sql), params
+
+
+class SearchResults:
+    """产品、库存变动和入库途中记录的统一搜索结果，按bm25相关度排序
+
+    实现了 count() 和切片，可直接交给 Paginator；命中数由单独的COUNT查询得到，
+    取第N页时每种记录只按相关度取前 N*每页条数 条（ORDER BY ... LIMIT），合并后只加载当前页的记录。
+    """
+
+    def __init__(self, text, kinds=None, using='default'):
+        self.terms, self.short_terms = split_terms(text)
+        self.kinds = [kind for kind in SEARCH_INDEXES if not kinds or kind in kinds]
+        self.using = using
+        self._counts = None
+
+    @property
+    def counts(self):
+        """每种记录的命中数 {kind: count}"""
+        if self._counts is None:
+            self._counts = dict.fromkeys(SEARCH_INDEXES, 0)
+            if self.terms:
+                selects, params = [], []
+                for kind in SEARCH_INDEXES:
+                    where, where_params = _where(kind, self.terms, self.short_terms)
+                    selects.append(f'(SELECT COUNT(*) FROM {fts_table(kind)} WHERE {where})')
+                    params.extend(where_params)
+                with connections[self.using].cursor() as cursor:
+                    cursor.execute('SELECT ' + ', '.join(selects), params)
+                    self._counts.update(zip(SEARCH_INDEXES, cursor.fetchone()))
+        return self._counts
+
+    def count(self):
+        return sum(self.counts[kind] for kind in self.kinds)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start, stop = key.start or 0, key.stop
+        if not self.terms or not self.kinds or stop is not None and stop <= start:
+            return []
+
+        counts = self.counts
+        selects, params = [], []
+        for kind in self.kinds:
+            if not counts[kind]:
+                continue
+            table = fts_table(kind)
+            weights = ', '.join(map(str, SEARCH_INDEXES[kind]['weights']))
+            where, where_params = _where(kind, self.terms, self.short_terms)
+            # 合并后的前stop条中，每种记录最多stop条，各自只需按相关度取前stop条
+            selects.append(f"SELECT * FROM (SELECT '{kind}' AS kind, rowid AS id, bm25({table}, {weights}) AS score "
+                           f"FROM {table} WHERE {where} ORDER BY score, rowid DESC LIMIT %s)")
+            params.extend(where_params + [-1 if stop is None else stop])
+        if not selects:
+            return []
+        # bm25越小越相关，相关度相同时新记录在前
+        sql = ' UNION ALL '.join(selects) + ' ORDER BY score, kind, id DESC LIMIT %s OFFSET %s'
+        params.extend([-1 if stop is None else stop - start, start])
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        return self._load(rows)
+
+    def _snippets(self, kind, ids):
+        """当前页备注的命中片段 {id: html}，命中处用<mark>标出"""
+        table = fts_table(kind)
+        where, params = _where(kind, self.terms, self.short_terms)
+        placeholders = ', '.join(['%s'] * len(ids))
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(f"SELECT rowid, snippet({table}, 0, '{_MARK_START}', '{_MARK_END}', '…', 32) "
+                           f"FROM {table} WHERE {where} AND rowid IN ({placeholders})", params + ids)
+            return {pk: mark_safe(escape(snippet).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>'))
+                    for pk, snippet in cursor.fetchall()}
+
+    def _load(self, rows):
+        """按类型批量加载当前页的记录，保持相关度顺序"""
+        objects, snippets = {}, {}
+        for kind in {row[0] for row in rows}:
+            ids = [row[1] for row in rows if row[0] == kind]
+            queryset = SEARCH_INDEXES[kind]['model'].objects.using(self.using)
+            if kind != 'product':
+                queryset = queryset.select_related('product', 'warehouse')
+                snippets[kind] = self._snippets(kind, ids)
+            objects[kind] = queryset.in_bulk(ids)
+
+        results = []
+        for kind, pk, score in rows:
+            obj = objects[kind].get(pk)
+            if obj is None:
+                continue
+            results.append({'kind': kind, 'label': SEARCH_INDEXES[kind]['label'], 'object': obj,
+                            'score': score, 'snippet': snippets.get(kind, {}).get(pk)})
+        return results
@@ -0,0 +1,366 @@
+from django.db import transaction
+from django.db.models import Sum, Q, Exists, OuterRef, Subquery, IntegerField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Product, Warehouse, StockMovement, StockBalance, StockSnapshot, IncomingStock, ProductionOrder, OrderAllocation
+
+# 产品ID超过该数量时不再使用IN条件（避免超出SQLite参数上限），改为在Python中过滤
+MAX_FILTER_IDS = 500
+
+
+def _filter_products(queryset, product_ids):
+    if product_ids is not None and len(product_ids) <= MAX_FILTER_IDS:
+        return queryset.filter(product_id__in=product_ids)
+    return queryset
+
+
+def get_stock_matrix(product_ids=None, warehouse_ids=None, as_of=None):
+    """获取产品在各仓库的库存矩阵
+
+    返回 {product_id: {warehouse_id: 库存, 'total': 总库存}}。
+    as_of为None时读取库存余额表；否则读取不晚于该日期的最近一次库存快照，
+    再加上快照之后的库存变动。传入product_ids时，没有库存记录的产品也会以0填充。
+    """
+    if warehouse_ids is None:
+        warehouse_ids = list(Warehouse.objects.values_list('id', flat=True))
+
+    if product_ids is not None:
+        product_ids = list(product_ids)
+
+    if as_of is None:
+        rows = _filter_products(
+            StockBalance.objects.values_list('product_id', 'warehouse_id', 'on_hand'),
+            product_ids
+        )
+    else:
+        rows = [
+            (product_id, warehouse_id, quantity)
+            for (product_id, warehouse_id), quantity in StockSnapshot.objects.closing_balances(as_of).items()
+        ]
+
+    def empty_row():
+        row = {warehouse_id: 0 for warehouse_id in warehouse_ids}
+        row['total'] = 0
+        return row
+
+    matrix = {}
+    if product_ids is not None:
+        for product_id in product_ids:
+            matrix[product_id] = empty_row()
+
+    for product_id, warehouse_id, quantity in rows:
+        if product_ids is not None and product_id not in matrix:
+            continue
+        stock = matrix.setdefault(product_id, empty_row())
+        stock[warehouse_id] = quantity or 0
+        stock['total'] += quantity or 0
+
+    return matrix
+
+
+def get_incoming_stock_by_product(product_ids=None):
+    """按仓库汇总待入库数量 {product_id: {'GA': 数量, 'CA': 数量, 'total': 数量}}"""
+    incoming_stocks = IncomingStock.objects.filter(status='待入库')
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        incoming_stocks = _filter_products(incoming_stocks, product_ids)
+
+    result = {}
+    if product_ids is not None:
+        for product_id in product_ids:
+            result[product_id] = {'GA': 0, 'CA': 0, 'total': 0}
+
+    rows = incoming_stocks.order_by().values('product_id', 'warehouse__code').annotate(quantity=Sum('quantity'))
+    for row in rows:
+        if product_ids is not None and row['product_id'] not in result:
+            continue
+        incoming = result.setdefault(row['product_id'], {'GA': 0, 'CA': 0, 'total': 0})
+        if row['warehouse__code'] in ('GA', 'CA'):
+            incoming[row['warehouse__code']] += row['quantity']
+        incoming['total'] += row['quantity']
+
+    return result
+
+
+def get_stock_positions(skus=None, since=None):
+    """按产品汇总的库存位置（列式）：各仓库当前库存、各仓库待入库数量和未完成生产订单剩余数量
+
+    skus 只返回指定店铺SKU的产品；since 只返回此后库存余额、入库途中记录、生产订单或产品本身有更新的产品。
+    since按各表的更新时间判断，检测不到记录的删除，增量同步仍需定期做一次全量同步。
+    返回 {'warehouses': [仓库代码], 'sku': [...], 'on_hand': {仓库代码: [...]}, 'incoming': {仓库代码: [...]},
+    'open_production': [...]}，各列表与 sku 按位置一一对应。
+    """
+    warehouses = dict(Warehouse.objects.order_by('code').values_list('id', 'code'))
+
+    products = Product.objects.order_by('sku')
+    if skus is not None:
+        products = products.filter(sku__in=skus)
+    if since is not None:
+        products = products.filter(
+            Q(updated_at__gte=since)
+            | Exists(StockBalance.objects.filter(product=OuterRef('pk'), last_movement_at__gte=since))
+            | Exists(IncomingStock.objects.filter(product=OuterRef('pk'), updated_at__gte=since))
+            | Exists(ProductionOrder.objects.filter(product=OuterRef('pk'), updated_at__gte=since))
+        )
+    rows = list(products.values_list('id', 'sku'))
+    position = {product_id: i for i, (product_id, _) in enumerate(rows)}
+    product_ids = list(position) if skus is not None or since is not None else None
+
+    on_hand = {code: [0] * len(rows) for code in warehouses.values()}
+    incoming = {code: [0] * len(rows) for code in warehouses.values()}
+    open_production = [0] * len(rows)
+
+    balances = _filter_products(StockBalance.objects.values_list('product_id', 'warehouse_id', 'on_hand'), product_ids)
+    pending = _filter_products(IncomingStock.objects.filter(status='待入库'), product_ids).order_by().values_list(
+        'product_id', 'warehouse_id').annotate(quantity=Sum('quantity'))
+    for column, quantities in ((on_hand, balances), (incoming, pending)):
+        for product_id, warehouse_id, quantity in quantities:
+            if product_id in position:
+                column[warehouses[warehouse_id]][position[product_id]] = quantity or 0
+
+    orders = _filter_products(ProductionOrder.objects.filter(remaining_quantity__gt=0), product_ids).order_by().values_list(
+        'product_id').annotate(quantity=Sum('remaining_quantity'))
+    for product_id, quantity in orders:
+        if product_id in position:
+            open_production[position[product_id]] = quantity
+
+    return {
+        'warehouses': list(warehouses.values()),
+        'sku': [sku for _, sku in rows],
+        'on_hand': on_hand,
+        'incoming': incoming,
+        'open_production': open_production,
+    }
+
+
+def _sum_subquery(queryset, field):
+    """按产品汇总的关联子查询，没有记录时为0"""
+    queryset = queryset.filter(product=OuterRef('pk')).order_by().values('product').annotate(total=Sum(field)).values('total')
+    return Coalesce(Subquery(queryset, output_field=IntegerField()), 0)
+
+
+def annotate_stock_columns(products):
+    """为产品查询集添加库存相关的计算列，使排序和分页可以在数据库中完成
+
+    stock_total: 总库存; ga_stock/ca_stock: GA/CA仓库存;
+    ga_incoming/ca_incoming: GA/CA待入库数量; production_orders: 生产订单剩余数量
+    """
+    pending_incoming = IncomingStock.objects.filter(status='待入库')
+    return products.annotate(
+        stock_total=_sum_subquery(StockBalance.objects.all(), 'on_hand'),
+        ga_stock=_sum_subquery(StockBalance.objects.filter(warehouse__code='GA'), 'on_hand'),
+        ca_stock=_sum_subquery(StockBalance.objects.filter(warehouse__code='CA'), 'on_hand'),
+        ga_incoming=_sum_subquery(pending_incoming.filter(warehouse__code='GA'), 'quantity'),
+        ca_incoming=_sum_subquery(pending_incoming.filter(warehouse__code='CA'), 'quantity'),
+        production_orders=_sum_subquery(ProductionOrder.objects.filter(remaining_quantity__gt=0), 'remaining_quantity'),
+    )
+
+
+# 一次加载未完成订单的产品数量（SQLite单条语句的参数个数有限制）
+ALLOCATION_BATCH_SIZE = 500
+
+
+def allocate_production_orders(demands):
+    """批量按先进先出扣减生产订单剩余数量
+
+    demands 为 [(需求标识, product_id, 数量), ...]，按列表顺序依次分配，
+    同一产品的需求从创建最早的未完成订单开始扣减，订单不足时剩余数量不再扣减。
+    所有相关产品的未完成订单一次查询并加锁，在内存中分配后用一次bulk_update写回。
+
+    返回 [(需求标识, 订单, 扣减数量), ...]
+    """
+    demands = [(demand, product_id, quantity) for demand, product_id, quantity in demands if quantity > 0]
+    if not demands:
+        return []
+
+    product_ids = sorted({product_id for _, product_id, _ in demands})
+    allocations = []
+    with transaction.atomic():
+        open_orders = {}
+        for i in range(0, len(product_ids), ALLOCATION_BATCH_SIZE):
+            orders = ProductionOrder.objects.select_for_update().filter(
+                product_id__in=product_ids[i:i + ALLOCATION_BATCH_SIZE],
+                remaining_quantity__gt=0
+            ).order_by('product_id', 'created_at', 'pk')
+            for order in orders:
+                open_orders.setdefault(order.product_id, []).append(order)
+
+        changed = {}
+        for demand, product_id, quantity in demands:
+            orders = open_orders.get(product_id, [])
+            while quantity > 0 and orders:
+                order = orders[0]
+                allocated = min(quantity, order.remaining_quantity)
+                order.remaining_quantity -= allocated
+                quantity -= allocated
+                changed[order.pk] = order
+                allocations.append((demand, order, allocated))
+                if order.remaining_quantity == 0:
+                    orders.pop(0)
+
+        if changed:
+            now = timezone.now()
+            for order in changed.values():
+                order.updated_at = now
+            ProductionOrder.objects.bulk_update(
+                list(changed.values()), ['remaining_quantity', 'updated_at'], batch_size=ALLOCATION_BATCH_SIZE
+            )
+
+    return allocations
+
+
+def allocate_incoming_stock(incoming_stocks, quantities=None):
+    """为入库途中记录扣减生产订单，并记录每条记录扣减了哪些订单
+
+    quantities 为 {入库途中记录ID: 扣减数量}，默认扣减记录的全部数量（编辑时只扣减增加的差额）。
+    返回更新的订单数量。
+    """
+    quantities = quantities or {}
+    allocations = allocate_production_orders(
+        (incoming_stock, incoming_stock.product_id, quantities.get(incoming_stock.pk, incoming_stock.quantity))
+        for incoming_stock in incoming_stocks
+    )
+    OrderAllocation.objects.bulk_create([
+        OrderAllocation(incoming_stock=incoming_stock, production_order=order, quantity=quantity)
+        for incoming_stock, order, quantity in allocations
+    ], batch_size=ALLOCATION_BATCH_SIZE)
+    return len({order.pk for _, order, _ in allocations})
+
+
+def restore_production_orders_legacy(product_id, quantity):
+    """没有分配明细的历史记录：从最新的订单开始恢复剩余数量（不超过订单总数量）"""
+    orders_updated = 0
+    for order in ProductionOrder.objects.select_for_update().filter(product_id=product_id).order_by('-created_at'):
+        if quantity <= 0:
+            break
+
+        add_to_order = min(quantity, order.quantity - order.remaining_quantity)
+        if add_to_order > 0:
+            order.remaining_quantity += add_to_order
+            order.save(update_fields=['remaining_quantity', 'updated_at'])
+            quantity -= add_to_order
+            orders_updated += 1
+    return orders_updated
+
+
+def release_incoming_stock(incoming_stocks, quantities=None):
+    """恢复入库途中记录扣减的生产订单数量
+
+    quantities 为 {入库途中记录ID: 恢复数量}，默认恢复全部。
+    先按分配明细精确恢复（后扣减的先恢复），并删除或减少相应明细；
+    迁移前创建的记录（allocation_tracked=False）明细不足的部分按原来的方式从最新订单开始恢复。
+    返回更新的订单数量。
+    """
+    quantities = quantities or {}
+    incoming_stocks = list(incoming_stocks)
+    remaining = {
+        incoming_stock.pk: quantities.get(incoming_stock.pk, incoming_stock.quantity)
+        for incoming_stock in incoming_stocks
+    }
+
+    with transaction.atomic():
+        incoming_ids = sorted(remaining)
+        allocations = []
+        for i in range(0, len(incoming_ids), ALLOCATION_BATCH_SIZE):
+            allocations.extend(OrderAllocation.objects.filter(
+                incoming_stock_id__in=incoming_ids[i:i + ALLOCATION_BATCH_SIZE]
+            ).order_by('-pk'))
+        orders = ProductionOrder.objects.select_for_update().in_bulk({allocation.production_order_id for allocation in allocations})
+
+        changed_orders = {}
+        deleted = []
+        reduced = []
+        for allocation in allocations:
+            release = min(remaining[allocation.incoming_stock_id], allocation.quantity)
+            if release <= 0:
+                continue
+            order = orders[allocation.production_order_id]
+            order.remaining_quantity = min(order.quantity, order.remaining_quantity + release)
+            changed_orders[order.pk] = order
+            remaining[allocation.incoming_stock_id] -= release
+            allocation.quantity -= release
+            if allocation.quantity:
+                reduced.append(allocation)
+            else:
+                deleted.append(allocation.pk)
+
+        if changed_orders:
+            now = timezone.now()
+            for order in changed_orders.values():
+                order.updated_at = now
+            ProductionOrder.objects.bulk_update(
+                list(changed_orders.values()), ['remaining_quantity', 'updated_at'], batch_size=ALLOCATION_BATCH_SIZE
+            )
+        for i in range(0, len(deleted), ALLOCATION_BATCH_SIZE):
+            OrderAllocation.objects.filter(pk__in=deleted[i:i + ALLOCATION_BATCH_SIZE]).delete()
+        OrderAllocation.objects.bulk_update(reduced, ['quantity'], batch_size=ALLOCATION_BATCH_SIZE)
+
+        orders_updated = len(changed_orders)
+        for incoming_stock in incoming_stocks:
+            if not incoming_stock.allocation_tracked and remaining[incoming_stock.pk] > 0:
+                orders_updated += restore_production_orders_legacy(incoming_stock.product_id, remaining[incoming_stock.pk])
+
+    return orders_updated
+
+
+def delete_incoming_stock(queryset):
+    """删除入库途中记录，待入库的记录先按分配明细恢复生产订单数量
+
+    返回 (删除的记录数, 更新的订单数量)
+    """
+    with transaction.atomic():
+        pending = list(queryset.filter(status='待入库').only('pk', 'product_id', 'quantity', 'allocation_tracked'))
+        orders_updated = release_incoming_stock(pending) if pending else 0
+        _, deleted = queryset.delete()
+    return deleted.get(IncomingStock._meta.label, 0), orders_updated
+
+
+class ApprovalConflict(Exception):
+    """批量确认入库时记录已被其他请求确认"""
+
+
+def approve_incoming_stock(incoming_ids, notes_prefix='由入库途中记录批量转入：'):
+    """批量确认入库
+
+    在一个事务中锁定选中的待入库记录，一次bulk_create全部入库变动，
+    再用一条 UPDATE ... WHERE status='待入库' 更新状态；
+    更新行数与锁定行数不一致说明有并发确认，整个事务回滚，避免重复入库。
+    返回确认的记录数。
+    """
+    today = timezone.now().date()
+    with transaction.atomic():
+        pending = IncomingStock.objects.select_for_update().filter(pk__in=incoming_ids, status='待入库')
+        rows = list(pending.values_list('pk', 'product_id', 'warehouse_id', 'quantity', 'notes'))
+        if not rows:
+            return 0
+
+        StockMovement.objects.bulk_create([
+            StockMovement(
+                product_id=product_id, warehouse_id=warehouse_id, movement_type='IN',
+                quantity=quantity, date=today, notes=f'{notes_prefix}{notes}'
+            )
+            for _, product_id, warehouse_id, quantity, notes in rows
+        ])
+
+        approved = IncomingStock.objects.filter(
+            pk__in=[row[0] for row in rows], status='待入库'
+        ).update(status='已入库', updated_at=timezone.now())
+        if approved != len(rows):
+            raise ApprovalConflict('部分记录已被其他操作确认入库，请刷新后重试')
+    return approved
+
+
+def find_allocation_mismatches():
+    """检查每个生产订单的剩余数量是否等于 总数量 - 分配明细数量之和
+
+    返回 [(订单, 按明细计算的剩余数量), ...]
+    """
+    orders = ProductionOrder.objects.select_related('product').annotate(
+        allocated=Coalesce(Sum('allocations__quantity'), 0)
+    ).order_by('pk')
+    return [
+        (order, order.quantity - order.allocated)
+        for order in orders.iterator(chunk_size=2000)
+        if order.remaining_quantity != order.quantity - order.allocated
+    ]
@@ -1,5 +1,7 @@
 from django import template
 
+from inventory.exports import pyarrow
+
 register = template.Library()
 
 @register.filter
@@ -8,4 +10,12 @@ def get_item(dictionary, key):
     获取字典中的值
     用法: {{ dictionary|get_item:key }}
     """
-    return dictionary.get(key) 
\ No newline at end of file
+    return dictionary.get(key) 
+
+@register.simple_tag
+def parquet_export_available():
+    """
+    服务器是否安装了pyarrow，未安装时不显示Parquet导出选项
+    用法: {% parquet_export_available as parquet_available %}
+    """
+    return pyarrow is not None
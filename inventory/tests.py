@@ -1,3 +1,1543 @@
-from django.test import TestCase
+import csv
+import os
+import random
+import re
+import tempfile
+from datetime import date, timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import openpyxl
+import pandas as pd
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections
+from django.db.models import Q, Sum
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import (Product, Warehouse, StockMovement, StockBalance, StockSnapshot, IncomingStock, ProductionOrder,
+                     DataVersion, signed_quantity_expression)
+from .services import (annotate_stock_columns, get_stock_matrix, get_incoming_stock_by_product, find_allocation_mismatches,
+                       allocate_incoming_stock)
+from . import search
+from .checks import check_search_triggers
+from .search import (SearchResults, filter_products, search_index_available, missing_search_triggers,
+                     SEARCH_RESULTS_PER_PAGE)
+from .autocomplete import autocomplete_products, get_product_index
+from .cache import get_view_cache
+from . import exports
+from .importers import (import_stock_movements, import_products, import_incoming_stock, read_import_file,
+                        STOCK_MOVEMENT_TEXT_COLUMNS, PRODUCT_TEXT_COLUMNS)
+from . import jobs
+from .models import ImportJob, IMPORT_JOB_STALE_SECONDS
+from . import urls
+from .benchmarks import BenchmarkRunner, ContentionBenchmark, generate_dataset
+from .views import PRODUCTS_PER_PAGE
+from .pagination import encode_cursor, keyset_paginate
+
+
+class StockBalanceTests(TestCase):
+    """库存余额随库存变动的每种写入方式同步更新，结果与按流水重新计算的一致"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ga = Warehouse.objects.create(name='亚特兰大仓库', code='GA')
+        cls.ca = Warehouse.objects.create(name='加州仓库', code='CA')
+        cls.product = Product.objects.create(sku='SKU-1', name='P-1', weight=1, length=1, width=1, height=1)
+        cls.other = Product.objects.create(sku='SKU-2', name='P-2', weight=1, length=1, width=1, height=1)
+
+    def balances(self):
+        return {(balance.product_id, balance.warehouse_id): balance.on_hand
+                for balance in StockBalance.objects.exclude(on_hand=0)}
+
+    def assertMatchesLedger(self):
+        balances = self.balances()
+        StockBalance.objects.rebuild()
+        self.assertEqual(self.balances(), balances)
+
+    def test_save_and_delete(self):
+        movement = StockMovement.objects.create(product=self.product, warehouse=self.ga, movement_type='IN',
+                                                quantity=10, date=date(2025, 1, 1))
+        self.assertEqual(self.product.get_stock_by_warehouse(self.ga), 10)
+
+        movement.quantity = 7
+        movement.save()
+        self.assertEqual(self.product.total_stock, 7)
+
+        movement.warehouse = self.ca
+        movement.save()
+        self.assertEqual(self.product.get_stock_by_warehouse(self.ga), 0)
+        self.assertEqual(self.product.get_stock_by_warehouse(self.ca), 7)
+        self.assertMatchesLedger()
+
+        movement.delete()
+        self.assertEqual(self.product.total_stock, 0)
+
+    def test_bulk_writes(self):
+        StockMovement.objects.bulk_create([
+            StockMovement(product=self.other, warehouse=self.ga, movement_type='IN', quantity=5, date=date(2025, 1, 1)),
+            StockMovement(product=self.other, warehouse=self.ga, movement_type='OUT', quantity=2, date=date(2025, 1, 2)),
+            StockMovement(product=self.product, warehouse=self.ca, movement_type='IN', quantity=4, date=date(2025, 1, 1)),
+        ])
+        self.assertEqual(self.other.get_stock_by_warehouse(self.ga), 3)
+        self.assertEqual(self.product.total_stock, 4)
+
+        StockMovement.objects.filter(product=self.other).update(warehouse=self.ca)
+        self.assertEqual(self.other.get_stock_by_warehouse(self.ga), 0)
+        self.assertEqual(self.other.get_stock_by_warehouse(self.ca), 3)
+        self.assertMatchesLedger()
+
+        StockMovement.objects.filter(movement_type='OUT').delete()
+        self.assertEqual(self.other.get_stock_by_warehouse(self.ca), 5)
+        self.assertMatchesLedger()
+
+        # 删除仓库时级联删除流水，余额也随之删除
+        self.ca.delete()
+        self.assertEqual(self.balances(), {})
+        self.assertMatchesLedger()
+
+    def test_bulk_create_conflicts(self):
+        movement = StockMovement.objects.create(product=self.product, warehouse=self.ga, movement_type='IN',
+                                                quantity=10, date=date(2025, 1, 1))
+        # 已存在的记录被跳过，不计入余额
+        StockMovement.objects.bulk_create([
+            StockMovement(pk=movement.pk, product=self.product, warehouse=self.ga, movement_type='IN',
+                          quantity=99, date=date(2025, 1, 1)),
+            StockMovement(product=self.product, warehouse=self.ga, movement_type='IN', quantity=2, date=date(2025, 1, 1)),
+        ], ignore_conflicts=True)
+        self.assertEqual(self.product.get_stock_by_warehouse(self.ga), 12)
+
+        # 已存在的记录改为更新，原来的数量和产品都要扣除
+        StockMovement.objects.bulk_create([
+            StockMovement(pk=movement.pk, product=self.other, warehouse=self.ga, movement_type='IN',
+                          quantity=5, date=date(2025, 1, 1)),
+        ], update_conflicts=True, unique_fields=['pk'], update_fields=['product', 'quantity'])
+        self.assertEqual(self.product.get_stock_by_warehouse(self.ga), 2)
+        self.assertEqual(self.other.get_stock_by_warehouse(self.ga), 5)
+        self.assertMatchesLedger()
+
+
+class StockMatrixTests(TestCase):
+    """库存矩阵按产品和仓库一次汇总，不随产品数量增加查询"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ga = Warehouse.objects.create(name='亚特兰大仓库', code='GA')
+        cls.ca = Warehouse.objects.create(name='加州仓库', code='CA')
+        cls.product = Product.objects.create(sku='SKU-1', name='P-1', weight=1, length=1, width=1, height=1)
+        cls.empty = Product.objects.create(sku='SKU-2', name='P-2', weight=1, length=1, width=1, height=1)
+        StockMovement.objects.bulk_create([
+            StockMovement(product=cls.product, warehouse=cls.ga, movement_type='IN', quantity=10, date=date(2025, 1, 1)),
+            StockMovement(product=cls.product, warehouse=cls.ca, movement_type='IN', quantity=4, date=date(2025, 1, 1)),
+            StockMovement(product=cls.product, warehouse=cls.ga, movement_type='OUT', quantity=3, date=date(2025, 1, 5)),
+        ])
+        IncomingStock.objects.create(product=cls.product, warehouse=cls.ca, quantity=6,
+                                     expected_arrival_date=date(2025, 2, 1))
+        IncomingStock.objects.create(product=cls.product, warehouse=cls.ca, quantity=5, status='已入库',
+                                     expected_arrival_date=date(2025, 2, 1))
+
+    def test_current_stock(self):
+        # 仓库列表和库存余额
+        with self.assertNumQueries(2):
+            matrix = get_stock_matrix()
+        self.assertEqual(matrix, {self.product.pk: {self.ga.pk: 7, self.ca.pk: 4, 'total': 11}})
+
+        matrix = get_stock_matrix([self.product.pk, self.empty.pk])
+        self.assertEqual(matrix[self.empty.pk], {self.ga.pk: 0, self.ca.pk: 0, 'total': 0})
+
+    def test_stock_as_of(self):
+        matrix = get_stock_matrix([self.product.pk], as_of=date(2025, 1, 4))
+        self.assertEqual(matrix[self.product.pk], {self.ga.pk: 10, self.ca.pk: 4, 'total': 14})
+
+    def test_pending_incoming(self):
+        self.assertEqual(get_incoming_stock_by_product(), {self.product.pk: {'GA': 0, 'CA': 6, 'total': 6}})
+        self.assertEqual(get_incoming_stock_by_product([self.empty.pk]), {self.empty.pk: {'GA': 0, 'CA': 0, 'total': 0}})
+
+
+class ProductListSortTests(TestCase):
+    """产品列表的库存、在途和生产订单列在数据库中计算、排序和分页"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('tester', password='password')
+        cls.ga = Warehouse.objects.create(name='亚特兰大仓库', code='GA')
+        cls.ca = Warehouse.objects.create(name='加州仓库', code='CA')
+        for i in range(5):
+            product = Product.objects.create(sku=f'SKU-{i}', name=f'P-{i}', weight=1, length=1, width=1, height=1)
+            StockMovement.objects.create(product=product, warehouse=cls.ga, movement_type='IN',
+                                         quantity=10 + i, date=date(2025, 1, 1))
+            StockMovement.objects.create(product=product, warehouse=cls.ca, movement_type='OUT',
+                                         quantity=1, date=date(2025, 1, 2))
+            IncomingStock.objects.create(product=product, warehouse=cls.ca, quantity=3,
+                                         expected_arrival_date=date(2025, 2, 1))
+            ProductionOrder.objects.create(product=product, order_number=f'PO-{i}', quantity=20 - i,
+                                           remaining_quantity=20 - i)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        get_view_cache().clear()
+
+    def products(self, **params):
+        return list(self.client.get(reverse('inventory:product_list'), params).context['products'])
+
+    def test_sort_by_computed_columns(self):
+        products = self.products(sort='-ga_stock')
+        self.assertEqual([product.sku for product in products], ['SKU-4', 'SKU-3', 'SKU-2', 'SKU-1', 'SKU-0'])
+        self.assertEqual([product.stock_total for product in products], [13, 12, 11, 10, 9])
+        self.assertEqual([product.ca_incoming for product in products], [3] * 5)
+
+        products = self.products(sort='-production_orders')
+        self.assertEqual([product.production_orders for product in products], [20, 19, 18, 17, 16])
+
+        products = self.products(sort='total_stock', search='SKU')
+        self.assertEqual([product.sku for product in products], ['SKU-0', 'SKU-1', 'SKU-2', 'SKU-3', 'SKU-4'])
+
+    def test_unknown_sort_falls_back_to_sku(self):
+        self.assertEqual([product.sku for product in self.products(sort='pk; drop')],
+                         ['SKU-0', 'SKU-1', 'SKU-2', 'SKU-3', 'SKU-4'])
+
+
+class StockSnapshotTests(TestCase):
+    """任意日期的收盘库存（快照加之后的流水）与直接汇总流水的结果一致，补录、修改和删除流水后同样如此"""
+
+    START = date(2025, 1, 1)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouses = [Warehouse.objects.create(name=code, code=code) for code in ('GA', 'CA')]
+        cls.products = [Product.objects.create(sku=f'SKU-{i}', name=f'P-{i}', weight=1, length=1, width=1, height=1)
+                        for i in range(4)]
+
+    def setUp(self):
+        self.random = random.Random(1)
+
+    def movement(self):
+        return StockMovement(product=self.random.choice(self.products), warehouse=self.random.choice(self.warehouses),
+                             movement_type=self.random.choice(['IN', 'OUT']), quantity=self.random.randint(1, 9),
+                             date=self.START + timedelta(days=self.random.randint(0, 30)))
+
+    def assertMatchesLedger(self):
+        for day in range(0, 35, 3):
+            as_of = self.START + timedelta(days=day)
+            ledger = StockMovement.objects.filter(date__lte=as_of).order_by().values_list(
+                'product_id', 'warehouse_id').annotate(quantity=Sum(signed_quantity_expression()))
+            expected = {(product_id, warehouse_id): quantity for product_id, warehouse_id, quantity in ledger if quantity}
+            closing = {key: quantity for key, quantity in StockSnapshot.objects.closing_balances(as_of).items() if quantity}
+            self.assertEqual(closing, expected, as_of)
+
+    def test_snapshots_follow_ledger_writes(self):
+        StockMovement.objects.bulk_create([self.movement() for _ in range(100)])
+        StockSnapshot.objects.build(date(2025, 1, 5), date(2025, 1, 20))
+        StockSnapshot.objects.build(date(2025, 1, 25))
+        self.assertMatchesLedger()
+
+        self.movement().save()
+        self.assertMatchesLedger()
+
+        movement = StockMovement.objects.order_by('pk').first()
+        movement.date = self.START
+        movement.quantity = 50
+        movement.save()
+        self.assertMatchesLedger()
+
+        StockMovement.objects.filter(pk__in=list(StockMovement.objects.values_list('pk', flat=True)[:10])).delete()
+        self.assertMatchesLedger()
+
+        StockMovement.objects.filter(warehouse=self.warehouses[0]).update(date=self.START + timedelta(days=3))
+        self.assertMatchesLedger()
+
+        StockMovement.objects.order_by('pk').last().delete()
+        self.assertMatchesLedger()
+
+    def test_historical_stock_view(self):
+        user = User.objects.create_user('tester', password='password')
+        self.client.force_login(user)
+        StockMovement.objects.bulk_create([self.movement() for _ in range(50)])
+        StockSnapshot.objects.build(date(2025, 1, 10))
+        as_of = date(2025, 1, 15)
+        response = self.client.get(reverse('inventory:historical_stock'), {'date': as_of.isoformat()})
+        expected = {product.pk: 0 for product in self.products}
+        for product_id, quantity in StockMovement.objects.filter(date__lte=as_of).order_by().values_list(
+                'product_id').annotate(quantity=Sum(signed_quantity_expression())):
+            expected[product_id] = quantity
+        self.assertEqual(response.context['product_total_stock'], expected)
+
+
+class QueryPlanTests(TestCase):
+    """热点查询必须命中索引，SQLite的EXPLAIN QUERY PLAN中不能出现全表扫描"""
+
+    # 形如 "SCAN inventory_stockmovement [USING INDEX ...]" 的行表示遍历整张表或整个索引
+    SCAN = re.compile(r'\bSCAN (?!CONSTANT ROW)\S+(?: AS \S+)?(?: USING (?:COVERING )?INDEX (\S+))?$')
+    # 部分索引只包含待入库/未完成的记录，遍历它们不算全表扫描
+    PARTIAL_INDEXES = {'incoming_pending_idx', 'order_open_idx'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ga = Warehouse.objects.create(name='亚特兰大仓库', code='GA')
+        cls.ca = Warehouse.objects.create(name='加州仓库', code='CA')
+        cls.product = Product.objects.create(sku='SKU-1', name='P-1', weight=1, length=1, width=1, height=1)
+        StockMovement.objects.create(product=cls.product, warehouse=cls.ga, movement_type='IN',
+                                     quantity=10, date=date(2025, 1, 1))
+        IncomingStock.objects.create(product=cls.product, warehouse=cls.ca, quantity=5,
+                                     expected_arrival_date=date(2025, 2, 1))
+        ProductionOrder.objects.create(product=cls.product, order_number='PO-1', quantity=20, remaining_quantity=20)
+        StockSnapshot.objects.build(date(2025, 1, 1))
+
+    def assertNoFullScan(self, queryset):
+        """带LIMIT的查询可以按索引顺序遍历（读到足够的行即停止），其余查询必须通过索引定位"""
+        plan = queryset.explain()
+        limited = queryset.query.high_mark is not None
+        for line in plan.splitlines():
+            detail = line.lstrip(' |`-')
+            match = self.SCAN.search(detail)
+            if not match:
+                continue
+            index = match.group(1)
+            if index in self.PARTIAL_INDEXES or (index and limited):
+                continue
+            self.fail(f'全表扫描: {detail}\n{plan}')
+
+    def test_stock_balance_lookups(self):
+        self.assertNoFullScan(StockBalance.objects.filter(product=self.product, warehouse=self.ga))
+        self.assertNoFullScan(StockBalance.objects.filter(product=self.product).values('product').annotate(total=Sum('on_hand')))
+
+    def test_ledger_aggregate(self):
+        self.assertNoFullScan(StockMovement.objects.filter(
+            product=self.product, warehouse=self.ga, movement_type='IN', date__lte=date(2025, 1, 31)
+        ).values('product').annotate(total=Sum('quantity')))
+
+    def test_ledger_date_range(self):
+        self.assertNoFullScan(StockMovement.objects.filter(
+            date__gt=date(2025, 1, 1), date__lte=date(2025, 1, 31)
+        ).order_by().values('product_id', 'warehouse_id').annotate(total=Sum('quantity')))
+        self.assertNoFullScan(StockMovement.objects.order_by('date')[:1])
+
+    def test_stock_movement_list_sort(self):
+        self.assertNoFullScan(StockMovement.objects.order_by('-date', '-pk')[:50])
+        self.assertNoFullScan(StockMovement.objects.order_by('-created_at', '-pk')[:50])
+
+    def test_stock_movement_keyset_page(self):
+        cursor = encode_cursor(['2025-01-01', 1])
+        for sort_by in ('-date', 'date', '-created_at'):
+            for direction in ('after', 'before'):
+                with CaptureQueriesContext(connection) as queries:
+                    keyset_paginate(StockMovement.objects.all(), sort_by, **{direction: cursor})
+                plan = connection.cursor().execute('EXPLAIN QUERY PLAN ' + queries[0]['sql']).fetchall()
+                detail = '\n'.join(row[-1] for row in plan)
+                self.assertNotIn('TEMP B-TREE', detail)
+                self.assertNotRegex(detail, r'SCAN inventory_stockmovement$')
+
+    def test_snapshot_lookups(self):
+        self.assertNoFullScan(StockSnapshot.objects.filter(date__lte=date(2025, 1, 31)).order_by('-date')[:1])
+        self.assertNoFullScan(StockSnapshot.objects.filter(date=date(2025, 1, 1)))
+
+    def test_product_list_sort(self):
+        self.assertNoFullScan(Product.objects.order_by('name')[:50])
+        self.assertNoFullScan(annotate_stock_columns(Product.objects.order_by('sku'))[:50])
+
+    def test_pending_incoming(self):
+        self.assertNoFullScan(IncomingStock.objects.filter(status='待入库').order_by().values(
+            'product_id', 'warehouse_id'
+        ).annotate(total=Sum('quantity')))
+        self.assertNoFullScan(IncomingStock.objects.order_by('status')[:50])
+        self.assertNoFullScan(IncomingStock.objects.order_by('-expected_arrival_date')[:50])
+
+    def test_open_production_orders(self):
+        self.assertNoFullScan(ProductionOrder.objects.filter(
+            product=self.product, remaining_quantity__gt=0
+        ).order_by('created_at'))
+        self.assertNoFullScan(ProductionOrder.objects.filter(remaining_quantity__gt=0).order_by().values(
+            'product_id'
+        ).annotate(total=Sum('remaining_quantity')))
+        self.assertNoFullScan(ProductionOrder.objects.order_by('-remaining_quantity')[:50])
+        self.assertNoFullScan(ProductionOrder.objects.order_by('-created_at')[:50])
+
+
+class StockMovementPaginationTests(TestCase):
+    """库存变动列表的游标分页：前后翻页覆盖全部记录，排序字段有重复值时不重不漏"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('tester', password='password')
+        cls.ga = Warehouse.objects.create(name='亚特兰大仓库', code='GA')
+        cls.product = Product.objects.create(sku='SKU-1', name='P-1', weight=1, length=1, width=1, height=1)
+        # 只有3个日期和5种数量，每页的边界都落在重复值中间
+        StockMovement.objects.bulk_create([
+            StockMovement(product=cls.product, warehouse=cls.ga, movement_type='IN', quantity=i % 5 + 1,
+                          date=date(2025, 1, i % 3 + 1))
+            for i in range(120)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def get(self, **params):
+        response = self.client.get(reverse('inventory:stock_movement_list'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['page']
+
+    def test_walk_pages(self):
+        for sort_by, field in (('-date', 'date'), ('quantity', 'quantity')):
+            with self.subTest(sort=sort_by):
+                # 按排序字段、主键同方向排序
+                expected = [m.pk for m in sorted(StockMovement.objects.all(), key=lambda m: (getattr(m, field), m.pk),
+                                                 reverse=sort_by.startswith('-'))]
+                pages = [self.get(sort=sort_by)]
+                while pages[-1]['has_next']:
+                    pages.append(self.get(sort=sort_by, after=pages[-1]['next_cursor']))
+                self.assertEqual([m.pk for page in pages for m in page['object_list']], expected)
+                self.assertEqual([len(page['object_list']) for page in pages], [50, 50, 20])
+
+                # 从最后一页向前翻，每页与向后翻时相同
+                page = pages[-1]
+                for previous in reversed(pages[:-1]):
+                    page = self.get(sort=sort_by, before=page['previous_cursor'])
+                    self.assertEqual(page['object_list'], previous['object_list'])
+                self.assertFalse(page['has_previous'])
+
+    def test_invalid_cursor(self):
+        first = [m.pk for m in self.get()['object_list']]
+        for cursor in (encode_cursor(['garbage', 1]), encode_cursor([None, 1]), encode_cursor(['2025-01-02', 'x']),
+                       encode_cursor([{}, []]), 'not-a-cursor'):
+            with self.subTest(cursor=cursor):
+                for direction in ('after', 'before'):
+                    page = self.get(**{direction: cursor})
+                    self.assertEqual([m.pk for m in page['object_list']], first)
+                    self.assertFalse(page['has_previous'])
+
+
+class ExportTests(TestCase):
+    """导出以只写模式生成并流式返回，内容与数据库一致"""
+
+    EXPORTS = ('export_products', 'export_stock_movements', 'export_historical_stock',
+               'export_incoming_stock', 'export_production_orders')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('tester', password='password')
+        cls.ga = Warehouse.objects.create(name='亚特兰大仓库', code='GA')
+        cls.ca = Warehouse.objects.create(name='加州仓库', code='CA')
+        cls.product = Product.objects.create(sku='SKU-1', name='P-1', weight=1.5, length=1, width=2, height=3)
+        StockMovement.objects.bulk_create([
+            StockMovement(product=cls.product, warehouse=cls.ga, movement_type='IN', quantity=i + 1,
+                          date=date(2025, 1, 1), notes='x,"y"' if i == 5 else '')
+            for i in range(300)
+        ])
+        IncomingStock.objects.create(product=cls.product, warehouse=cls.ca, quantity=5,
+                                     expected_arrival_date=date(2025, 2, 1))
+        ProductionOrder.objects.create(product=cls.product, order_number='PO-1', quantity=3, remaining_quantity=3)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def export(self, name, **params):
+        response = self.client.get(reverse(f'inventory:{name}'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_xlsx(self):
+        expected_rows = {'export_products': 1, 'export_stock_movements': 300, 'export_historical_stock': 1,
+                         'export_incoming_stock': 1, 'export_production_orders': 1}
+        for name in self.EXPORTS:
+            with self.subTest(view=name):
+                response, content = self.export(name)
+                self.assertIn('.xlsx', response['Content-Disposition'])
+                sheet = openpyxl.load_workbook(BytesIO(content)).active
+                self.assertEqual(sheet.max_row, expected_rows[name] + 1)
+                self.assertTrue(sheet['A1'].font.bold)
+
+        _, content = self.export('export_products')
+        rows = list(openpyxl.load_workbook(BytesIO(content)).active.values)
+        self.assertEqual(rows[1][0], 'SKU-1')
+        self.assertEqual(rows[1][-3:], (sum(range(1, 301)), 0, sum(range(1, 301))))
+
+    def test_csv(self):
+        for name in self.EXPORTS:
+            with self.subTest(view=name):
+                response, content = self.export(name, format='csv')
+                self.assertIn('.csv', response['Content-Disposition'])
+                self.assertTrue(content.startswith('\ufeff'.encode()))
+        rows = list(csv.reader(StringIO(content.decode('utf-8-sig'))))
+        self.assertEqual(rows[1][:4], ['SKU-1', 'P-1', 'PO-1', '3'])
+
+        _, content = self.export('export_stock_movements', format='csv')
+        rows = list(csv.reader(StringIO(content.decode('utf-8-sig'))))
+        self.assertEqual(len(rows), 301)
+        self.assertIn('x,"y"', [row[6] for row in rows])
+
+        response = self.client.get(reverse('inventory:export_products'), {'format': 'pdf'})
+        self.assertEqual(response.status_code, 400)
+
+    @skipUnless(exports.pyarrow is None, '已安装pyarrow')
+    def test_parquet_unavailable(self):
+        response = self.client.get(reverse('inventory:export_products'), {'format': 'parquet'})
+        self.assertEqual(response.status_code, 501)
+        self.assertNotContains(self.client.get(reverse('inventory:product_list')), 'format=parquet')
+
+    @skipUnless(exports.pyarrow is not None, '未安装pyarrow')
+    def test_parquet(self):
+        import pyarrow.parquet
+
+        self.assertContains(self.client.get(reverse('inventory:product_list')), 'format=parquet')
+        for name in self.EXPORTS:
+            with self.subTest(view=name):
+                _, content = self.export(name, format='parquet')
+                expected_rows = 300 if name == 'export_stock_movements' else 1
+                self.assertEqual(pyarrow.parquet.read_table(BytesIO(content)).num_rows, expected_rows)
+        _, content = self.export('export_stock_movements', format='parquet')
+        table = pyarrow.parquet.read_table(BytesIO(content))
+        self.assertEqual(table.num_rows, 300)
+        self.assertEqual(str(table.schema.field('数量').type), 'int64')
+
+        # 第一批中全部为空的列按声明的类型写出，后续批次有值时不会出错
+        rows = [['a', None]] * 3 + [['b', 1.5]]
+        with mock.patch.object(exports, 'EXPORT_CHUNK_SIZE', 2):
+            response = exports.stream_parquet('t.parquet', ['名称', '重量'], iter(rows), ['string', 'float64'])
+        table = pyarrow.parquet.read_table(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(table.column('重量').to_pylist(), [None, None, None, 1.5])
+
+
+class StockMovementImportTests(TestCase):
+    """库存变动导入：向量化校验，每行报告第一个错误，有效行一次性写入"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ga = Warehouse.objects.create(name='亚特兰大仓库', code='GA')
+        Product.objects.bulk_create([Product(sku=f'SKU-{i}', name=f'P-{i}', weight=1, length=1, width=1, height=1)
+                                     for i in range(10)])
+        cls.numeric = Product.objects.create(sku='00123', name='P-00123', weight=1, length=1, width=1, height=1)
+
+    def frame(self, rows):
+        return pd.DataFrame(rows, columns=['日期(YYYY-MM-DD)', '仓库代码', '店铺SKU', '数量', '类型(IN/OUT)', '备注(可选)'])
+
+    def test_import(self):
+        df = self.frame([['2025-03-07', 'GA', f'SKU-{i % 10}', i % 7 + 1, 'in', None] for i in range(1000)] + [
+            ['x', 'GA', 'SKU-1', 1, 'IN', ''],
+            ['2025-01-01', 'ZZ', 'SKU-1', 1, 'IN', ''],
+            ['2025-01-01', 'GA', 'nope', 1, 'IN', ''],
+            ['2025-01-01', 'GA', 'SKU-1', 0, 'IN', ''],
+            ['2025-01-01', 'GA', 'SKU-1', 2, 'X', ''],
+        ])
+        result = import_stock_movements(df)
+        self.assertEqual(result['success_count'], 1000)
+        self.assertEqual(result['errors'], [
+            (1002, '日期格式错误'), (1003, '仓库代码 ZZ 不存在'), (1004, '店铺SKU nope 不存在'),
+            (1005, '数量必须为正整数'), (1006, '类型必须为 IN 或 OUT'),
+        ])
+        self.assertEqual(StockMovement.objects.count(), 1000)
+        self.assertEqual(StockBalance.objects.aggregate(total=Sum('on_hand'))['total'],
+                         sum(i % 7 + 1 for i in range(1000)))
+
+    def test_dry_run_writes_nothing(self):
+        result = import_stock_movements(self.frame([['2025-03-07', 'GA', 'SKU-1', 1, 'OUT', '']]), dry_run=True)
+        self.assertEqual(result['success_count'], 1)
+        self.assertFalse(StockMovement.objects.exists())
+
+    def test_csv_keeps_sku_as_text(self):
+        upload = SimpleUploadedFile('movements.csv', self.frame([['2025-03-07', 'GA', '00123', 3, 'OUT', '备注']])
+                                    .to_csv(index=False).encode('gbk'))
+        result = import_stock_movements(read_import_file(upload, STOCK_MOVEMENT_TEXT_COLUMNS))
+        self.assertEqual(result['errors'], [])
+        self.assertEqual(self.numeric.total_stock, -3)
+
+
+class ProductImportTests(TestCase):
+    """产品导入：按店铺SKU批量新增或更新，初始库存批量生成入库记录"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ga = Warehouse.objects.create(name='亚特兰大仓库', code='GA')
+        cls.ca = Warehouse.objects.create(name='加州仓库', code='CA')
+        cls.existing = Product.objects.create(sku='S5', name='old', weight=1, length=1, width=1, height=1)
+
+    def test_upsert(self):
+        n = 600
+        df = pd.DataFrame({
+            '店铺SKU': [f'S{i}' for i in range(n)], '产品SKU': [f'P{i}' for i in range(n)],
+            '重量(lb)': [1.25] * n, '长度(inch)': [2] * n, '宽度(inch)': [3] * n, '高度(inch)': [4] * n,
+            '亚特兰大仓库存': [i % 3 for i in range(n)], '加州仓库存': [2] * n,
+        }, dtype=object)
+        df.loc[1, '重量(lb)'] = 'abc'
+        df.loc[2, '长度(inch)'] = -1
+        df.loc[3, '店铺SKU'] = ''
+        df.loc[4, '加州仓库存'] = -5
+        df.loc[6, '亚特兰大仓库存'] = 'x'
+        df.loc[7, '产品SKU'] = ''
+        result = import_products(df)
+        self.assertEqual(result['errors'], [(3, '重量和尺寸必须为数字'), (4, '重量和尺寸必须为正数'), (5, '店铺SKU不能为空')])
+        self.assertEqual(result['warnings'], [(6, '加州仓库存不能为负数'), (8, '亚特兰大仓库存必须为整数')])
+        self.assertEqual((result['created'], result['updated']), (n - 4, 1))
+
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.name, str(self.existing.weight)), ('P5', '1.25'))
+        self.assertEqual(Product.objects.get(sku='S7').name, 'S7')
+        self.assertEqual(Product.objects.count(), n - 3)
+        self.assertEqual((self.existing.get_stock_by_warehouse(self.ga), self.existing.get_stock_by_warehouse(self.ca)), (2, 2))
+        self.assertEqual(Product.objects.get(sku='S4').get_stock_by_warehouse(self.ca), 0)
+        self.assertEqual(Product.objects.get(sku='S6').get_stock_by_warehouse(self.ga), 0)
+
+    def test_xlsx_keeps_sku_as_text(self):
+        output = BytesIO()
+        pd.DataFrame({'店铺SKU': ['00123'], '重量(lb)': [1], '长度(inch)': [1], '宽度(inch)': [1], '高度(inch)': [1]}
+                     ).to_excel(output, index=False)
+        upload = SimpleUploadedFile('products.xlsx', output.getvalue())
+        result = import_products(read_import_file(upload, PRODUCT_TEXT_COLUMNS))
+        self.assertEqual((result['created'], result['errors']), (1, []))
+        self.assertTrue(Product.objects.filter(sku='00123').exists())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ImportJobTests(TestCase):
+    """后台导入任务：分批写入、进度、错误记录以及处理进程退出后的续传"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('tester', password='password')
+        cls.ga = Warehouse.objects.create(name='亚特兰大仓库', code='GA')
+        cls.ca = Warehouse.objects.create(name='加州仓库', code='CA')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.enterContext(mock.patch.object(jobs, 'JOB_CHUNK_ROWS', 7))
+
+    def upload(self, url_name, df):
+        output = BytesIO()
+        df.to_excel(output, index=False)
+        response = self.client.post(reverse(f'inventory:{url_name}'),
+                                     {'file': SimpleUploadedFile('import.xlsx', output.getvalue())})
+        self.assertEqual(response.status_code, 302)
+        return ImportJob.objects.latest('pk')
+
+    def movements(self, n):
+        return pd.DataFrame({'日期(YYYY-MM-DD)': ['2025-03-07'] * n, '仓库代码': ['GA'] * n,
+                             '店铺SKU': ['S1'] * n, '数量': [1] * n, '类型(IN/OUT)': ['IN'] * n})
+
+    def test_worker(self):
+        products = self.upload('import_products', pd.DataFrame({
+            '店铺SKU': [f'S{i}' for i in range(20)], '重量(lb)': [1] * 20,
+            '长度(inch)': 1, '宽度(inch)': 1, '高度(inch)': 1, '亚特兰大仓库存': 5,
+        }))
+        orders = self.upload('import_production_orders', pd.DataFrame(
+            {'店铺SKU': ['S1', 'S1', 'S1', 'X', 'S2'], '订单号': ['A', 'A', 'B', 'C', 'A'], '数量': [10, 10, 0, 3, 4]}))
+        broken = self.upload('stock_movement_import', pd.DataFrame({'x': [1]}))
+        self.assertContains(self.client.get(reverse('inventory:import_job_detail', args=[products.pk])), '排队')
+
+        call_command('run_import_worker', '--once', stdout=StringIO())
+        for job in (products, orders, broken):
+            job.refresh_from_db()
+        self.assertEqual((products.status, products.total_rows, products.processed_rows, products.success_count),
+                         (ImportJob.STATUS_DONE, 20, 20, 20))
+        self.assertEqual(products.summary, '成功导入 20 条产品记录（新增 20，更新 0），添加 20 条库存记录')
+        self.assertEqual(Product.objects.get(sku='S3').total_stock, 5)
+        self.assertEqual((orders.success_count, [error[0] for error in orders.errors]), (2, [3, 4, 5]))
+        self.assertEqual((broken.status, broken.processed_rows), (ImportJob.STATUS_FAILED, 0))
+        self.assertIn('缺少必要的列', broken.summary)
+        self.assertTrue(self.client.get(reverse('inventory:import_job_status', args=[orders.pk])).json()['finished'])
+        self.assertIsNone(ImportJob.objects.claim_next('worker'))
+
+    def test_resume_after_crash(self):
+        Product.objects.create(sku='S1', name='P-1', weight=1, length=1, width=1, height=1)
+        job = self.upload('stock_movement_import', self.movements(20))
+        text_columns, import_rows = jobs.IMPORTERS['stock_movements']
+        calls = []
+
+        def crash_on_second_chunk(df):
+            calls.append(len(df))
+            if len(calls) == 2:
+                raise SystemExit
+            return import_rows(df)
+
+        job = ImportJob.objects.claim_next('worker-1')
+        with mock.patch.dict(jobs.IMPORTERS, {'stock_movements': (text_columns, crash_on_second_chunk)}):
+            with self.assertRaises(SystemExit):
+                jobs.run_import_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed_rows, StockMovement.objects.count()), (ImportJob.STATUS_RUNNING, 7, 7))
+
+        # 进度仍在更新的任务不会被其他进程领取
+        self.assertIsNone(ImportJob.objects.claim_next('worker-2'))
+        ImportJob.objects.filter(pk=job.pk).update(
+            heartbeat_at=timezone.now() - timedelta(seconds=IMPORT_JOB_STALE_SECONDS + 1))
+        job = ImportJob.objects.claim_next('worker-2')
+        self.assertEqual(job.worker, 'worker-2')
+        job = jobs.run_import_job(job)
+        self.assertEqual((job.status, job.processed_rows, job.success_count), (ImportJob.STATUS_DONE, 20, 20))
+        self.assertEqual(StockMovement.objects.count(), 20)
+        self.assertEqual(Product.objects.get(sku='S1').total_stock, 20)
+
+    def test_reclaimed_job_stops_old_worker(self):
+        Product.objects.create(sku='S1', name='P-1', weight=1, length=1, width=1, height=1)
+        self.upload('stock_movement_import', self.movements(20))
+        job = ImportJob.objects.claim_next('worker-1')
+        ImportJob.objects.filter(pk=job.pk).update(worker='worker-2')
+        job = jobs.run_import_job(job)
+        self.assertEqual((job.worker, job.processed_rows), ('worker-2', 0))
+        self.assertFalse(StockMovement.objects.exists())
+
+
+class DryRunImportTests(TestCase):
+    """仅校验导入：不写入数据，有问题时返回标注行号的报告文件"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('tester', password='password')
+        cls.ga = Warehouse.objects.create(name='亚特兰大仓库', code='GA')
+        cls.ca = Warehouse.objects.create(name='加州仓库', code='CA')
+        cls.product = Product.objects.create(sku='007', name='P-1', weight=1, length=1, width=1, height=1)
+        ProductionOrder.objects.create(product=cls.product, order_number='A', quantity=5, remaining_quantity=5)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def post(self, url_name, df, **data):
+        output = BytesIO()
+        df.to_excel(output, index=False)
+        data.update(file=SimpleUploadedFile('import.xlsx', output.getvalue()), dry_run='1')
+        return self.client.post(reverse(f'inventory:{url_name}'), data)
+
+    def test_xlsx_report(self):
+        response = self.post('import_production_orders', pd.DataFrame(
+            {'店铺SKU': ['007', '007', '007', 'Q'], '订单号': ['A', 'B', 'B', 'C'], '数量': [1, 2, 3, 4]}))
+        rows = list(openpyxl.load_workbook(BytesIO(b''.join(response.streaming_content))).active.values)
+        self.assertEqual(rows[0], ('行号', '类型', '问题', '店铺SKU', '订单号', '数量'))
+        self.assertEqual([row[:2] for row in rows[1:]], [(2, '错误'), (4, '错误'), (5, '错误')])
+        self.assertEqual(rows[2][3:], ('007', 'B', 3))
+        self.assertEqual(ProductionOrder.objects.count(), 1)
+        self.assertFalse(ImportJob.objects.exists())
+
+    def test_csv_report(self):
+        response = self.post('import_products', pd.DataFrame({
+            '店铺SKU': ['007', 'S2'], '重量(lb)': [1, 'x'], '长度(inch)': 1, '宽度(inch)': 1, '高度(inch)': 1, '加州仓库存': [-1, 1],
+        }), report_format='csv')
+        rows = list(csv.reader(StringIO(b''.join(response.streaming_content).decode('utf-8-sig'))))
+        self.assertEqual([row[:3] for row in rows[1:]], [['2', '警告', '加州仓库存不能为负数'], ['3', '错误', '重量和尺寸必须为数字']])
+        self.assertEqual(Product.objects.get(sku='007').name, 'P-1')
+
+    def test_clean_file(self):
+        response = self.post('import_incoming_stock', pd.DataFrame(
+            {'店铺SKU': ['007'], '仓库代码': ['GA'], '数量': [1], '预计入仓时间(YYYY-MM-DD)': ['2025-01-01']}))
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(IncomingStock.objects.exists())
+
+    def test_csv_upload(self):
+        n = 1000
+        df = pd.DataFrame({'日期(YYYY-MM-DD)': ['2025-03-07'] * n, '仓库代码': ['GA'] * n,
+                           '店铺SKU': ['007' if i % 10 else 'BAD' for i in range(n)], '数量': [1] * n, '类型(IN/OUT)': ['IN'] * n})
+        for encoding in ('utf-8-sig', 'gbk'):
+            response = self.client.post(reverse('inventory:stock_movement_import'), {
+                'file': SimpleUploadedFile('movements.csv', df.to_csv(index=False).encode(encoding)),
+                'dry_run': '1', 'report_format': 'csv',
+            })
+            lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+            self.assertEqual(len(lines), n // 10 + 1, encoding)
+        self.assertFalse(StockMovement.objects.exists())
+
+
+class OrderAllocationTests(TestCase):
+    """导入入库途中产品时按先进先出批量扣减生产订单"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ga = Warehouse.objects.create(name='亚特兰大仓库', code='GA')
+        cls.products = Product.objects.bulk_create([
+            Product(sku=f'SKU-{i}', name=f'P-{i}', weight=1, length=1, width=1, height=1) for i in range(100)
+        ])
+        ProductionOrder.objects.bulk_create([
+            ProductionOrder(product=product, order_number=f'O{k}', quantity=10, remaining_quantity=10)
+            for product in cls.products for k in range(3)
+        ])
+
+    def test_fifo(self):
+        n = 600
+        skus = [f'SKU-{i % 50}' for i in range(n // 2)] + [f'SKU-{i % 100}' for i in range(n // 2, n)]
+        df = pd.DataFrame({'店铺SKU': skus, '仓库代码': 'GA', '数量': [1 + i % 5 for i in range(n)],
+                           '预计入仓时间(YYYY-MM-DD)': '2025-01-01'})
+        with CaptureQueriesContext(connection) as queries:
+            result = import_incoming_stock(df)
+        self.assertEqual(result['success_count'], n)
+        # 所有订单一次查询，与行数和产品数无关
+        self.assertEqual(sum('FROM "inventory_productionorder"' in query['sql'] for query in queries.captured_queries), 1)
+
+        demand = {}
+        for sku, quantity in zip(df['店铺SKU'], df['数量']):
+            demand[sku] = demand.get(sku, 0) + quantity
+        for product in self.products:
+            remaining = list(ProductionOrder.objects.filter(product=product).order_by('created_at', 'pk')
+                             .values_list('remaining_quantity', flat=True))
+            left = max(0, 30 - demand[product.sku])
+            # 先扣减最早的订单
+            self.assertEqual(remaining, [min(10, max(0, left - 10 * (2 - k))) for k in range(3)])
+        self.assertEqual(find_allocation_mismatches(), [])
+
+
+class IncomingStockAllocationTests(TestCase):
+    """新增、编辑、删除入库途中记录时按分配明细扣减和恢复生产订单"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('tester', password='password')
+        cls.ga = Warehouse.objects.create(name='亚特兰大仓库', code='GA')
+        cls.product = Product.objects.create(sku='SKU-1', name='P-1', weight=1, length=1, width=1, height=1)
+        cls.other = Product.objects.create(sku='SKU-2', name='P-2', weight=1, length=1, width=1, height=1)
+        cls.first = ProductionOrder.objects.create(product=cls.product, order_number='O1', quantity=10, remaining_quantity=10)
+        ProductionOrder.objects.create(product=cls.product, order_number='O2', quantity=10, remaining_quantity=10)
+        ProductionOrder.objects.create(product=cls.other, order_number='O3', quantity=10, remaining_quantity=10)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def remaining(self):
+        return list(ProductionOrder.objects.order_by('pk').values_list('remaining_quantity', flat=True))
+
+    def post(self, url, **data):
+        data = dict({'product': self.product.pk, 'warehouse': self.ga.pk, 'quantity': 6,
+                     'expected_arrival_date': '2025-01-01', 'status': '待入库'}, **data)
+        return self.client.post(url, data)
+
+    def check(self, *args):
+        output = StringIO()
+        call_command('check_order_allocations', *args, stdout=output)
+        return output.getvalue()
+
+    def test_interleaved(self):
+        self.post(reverse('inventory:incoming_stock_create'), quantity=6)
+        self.post(reverse('inventory:incoming_stock_create'), quantity=8)
+        self.assertEqual(self.remaining(), [0, 6, 10])
+        first, second = IncomingStock.objects.order_by('pk')
+        # 删除先创建的记录恢复它扣减的订单，而不是最新的订单
+        self.client.post(reverse('inventory:incoming_stock_delete', args=[first.pk]))
+        self.assertEqual(self.remaining(), [6, 6, 10])
+        edit_url = reverse('inventory:incoming_stock_edit', args=[second.pk])
+        self.post(edit_url, quantity=12)
+        self.assertEqual(self.remaining(), [2, 6, 10])
+        self.post(edit_url, quantity=3)
+        self.assertEqual(self.remaining(), [7, 10, 10])
+        self.post(edit_url, quantity=3, product=self.other.pk)
+        self.assertEqual(self.remaining(), [10, 10, 7])
+        self.post(edit_url, quantity=3, product=self.other.pk, status='已入库')
+        self.assertEqual(self.remaining(), [10, 10, 10])
+        self.assertEqual(find_allocation_mismatches(), [])
+        self.assertIn('一致', self.check())
+
+    def test_check_skips_legacy_products(self):
+        # 迁移前已入库的记录扣减了4件但没有分配明细
+        IncomingStock.objects.create(product=self.product, warehouse=self.ga, quantity=4, status='已入库',
+                                     expected_arrival_date=date(2025, 1, 1), allocation_tracked=False)
+        ProductionOrder.objects.filter(pk=self.first.pk).update(remaining_quantity=6)
+        ProductionOrder.objects.filter(order_number='O3').update(remaining_quantity=3)
+        self.assertIn('跳过', self.check('--fix'))
+        self.assertEqual(self.remaining(), [6, 10, 10])
+        self.assertGreater(ProductionOrder.objects.get(order_number='O3').updated_at,
+                           ProductionOrder.objects.get(order_number='O2').updated_at)
+
+    def test_legacy_pending_row(self):
+        legacy = IncomingStock.objects.create(product=self.product, warehouse=self.ga, quantity=4,
+                                              expected_arrival_date=date(2025, 1, 1), allocation_tracked=False)
+        ProductionOrder.objects.filter(pk=self.first.pk).update(remaining_quantity=6)
+        self.post(reverse('inventory:incoming_stock_edit', args=[legacy.pk]), quantity=6)
+        self.assertEqual(self.remaining(), [4, 10, 10])
+        self.client.post(reverse('inventory:incoming_stock_delete', args=[legacy.pk]))
+        self.assertEqual(self.remaining(), [10, 10, 10])
+
+    def test_order_edit(self):
+        self.post(reverse('inventory:incoming_stock_create'), quantity=6)
+        url = reverse('inventory:production_order_edit', args=[self.first.pk])
+        data = {'product': self.product.pk, 'order_number': 'O1'}
+        self.assertEqual(self.client.post(url, dict(data, quantity=20)).status_code, 302)
+        self.assertEqual(self.remaining()[0], 14)
+        response = self.client.post(url, dict(data, quantity=5))
+        self.assertFormError(response.context['form'], 'quantity', '该订单已有 6 件分配给入库途中记录，数量不能少于 6')
+        self.first.refresh_from_db()
+        self.assertEqual((self.first.quantity, self.first.remaining_quantity), (20, 14))
+        self.client.post(url, dict(data, quantity=6))
+        self.assertEqual(self.remaining()[0], 0)
+        self.assertEqual(find_allocation_mismatches(), [])
+
+
+class BatchDeleteTests(TestCase):
+    """批量删除：集合操作完成，无效或重复的ID不影响结果，关联数据同步维护"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('tester', password='password')
+        cls.ga = Warehouse.objects.create(name='亚特兰大仓库', code='GA')
+        cls.ca = Warehouse.objects.create(name='加州仓库', code='CA')
+        cls.product = Product.objects.create(sku='SKU-1', name='P-1', weight=1, length=1, width=1, height=1)
+        cls.other = Product.objects.create(sku='SKU-2', name='P-2', weight=1, length=1, width=1, height=1)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def post(self, url_name, field, ids):
+        response = self.client.post(reverse(f'inventory:{url_name}'), {field: ids})
+        self.assertEqual(response.status_code, 302)
+        return [str(message) for message in get_messages(response.wsgi_request)]
+
+    def test_movements(self):
+        StockMovement.objects.bulk_create([
+            StockMovement(product=self.product, warehouse=self.ga, movement_type='IN', quantity=1, date=date(2025, 1, 1))
+            for _ in range(3010)
+        ])
+        ids = list(StockMovement.objects.values_list('pk', flat=True)[:3000])
+        with CaptureQueriesContext(connection) as queries:
+            result = self.post('stock_movement_batch_delete', 'selected_movements', ids + ['999999', 'x'])
+        self.assertEqual(result, ['成功删除 3000 条库存变动记录。'])
+        self.assertLess(len(queries), 30)
+        self.assertEqual(StockBalance.objects.get(product=self.product, warehouse=self.ga).on_hand, 10)
+
+    def test_products(self):
+        StockMovement.objects.create(product=self.product, warehouse=self.ga, movement_type='IN', quantity=1, date=date(2025, 1, 1))
+        result = self.post('product_batch_delete', 'selected_products', [self.product.pk, self.other.pk, 12345])
+        self.assertEqual(result, ['成功删除 1 个产品。', '1 个产品无法删除，因为它们有关联的库存变动记录。',
+                                  '1 个产品不存在或已被删除。'])
+        self.assertEqual(list(Product.objects.values_list('sku', flat=True)), ['SKU-1'])
+
+    def test_allocations_released(self):
+        StockMovement.objects.create(product=self.product, warehouse=self.ga, movement_type='IN', quantity=1, date=date(2025, 1, 1))
+        order = ProductionOrder.objects.create(product=self.product, order_number='O1', quantity=10, remaining_quantity=10)
+        in_ca = IncomingStock.objects.create(product=self.product, warehouse=self.ca, quantity=4, expected_arrival_date=date(2025, 1, 1))
+        in_ga = IncomingStock.objects.create(product=self.product, warehouse=self.ga, quantity=3, expected_arrival_date=date(2025, 1, 1))
+        allocate_incoming_stock([in_ca, in_ga])
+        order.refresh_from_db()
+        self.assertEqual(order.remaining_quantity, 3)
+
+        # 有库存变动的仓库不能删除，另一个仓库删除时恢复其入库途中记录扣减的数量
+        result = self.post('warehouse_batch_delete', 'selected_warehouses', [self.ga.pk, self.ca.pk])
+        self.assertEqual(result, ['成功删除 1 个仓库。', '1 个仓库无法删除，因为它们有关联的库存变动记录。'])
+        self.assertFalse(IncomingStock.objects.filter(pk=in_ca.pk).exists())
+        order.refresh_from_db()
+        self.assertEqual(order.remaining_quantity, 7)
+        self.post('incoming_stock_batch_delete', 'selected_items', [in_ga.pk])
+        order.refresh_from_db()
+        self.assertEqual(order.remaining_quantity, 10)
+        self.assertEqual(find_allocation_mismatches(), [])
+
+        # 未跟随重定向，之前的消息仍在会话中
+        result = self.post('production_order_batch_delete', 'selected_orders', [order.pk, order.pk])
+        self.assertEqual(result[-1], '成功删除 1 条生产订单。')
+
+
+class BatchApproveTests(TestCase):
+    """批量确认入库：一个事务内一次写入全部入库变动，已确认的记录跳过"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('tester', password='password')
+        cls.ga = Warehouse.objects.create(name='亚特兰大仓库', code='GA')
+        cls.product = Product.objects.create(sku='SKU-1', name='P-1', weight=1, length=1, width=1, height=1)
+        IncomingStock.objects.bulk_create([
+            IncomingStock(product=cls.product, warehouse=cls.ga, quantity=2, expected_arrival_date=date(2025, 1, 1), notes=str(i))
+            for i in range(1500)
+        ])
+        cls.ids = list(IncomingStock.objects.order_by('pk').values_list('pk', flat=True))
+        IncomingStock.objects.filter(pk=cls.ids[0]).update(status='已入库')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_approve(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('inventory:incoming_stock_batch_action'),
+                                        {'selected_items': self.ids, 'action': 'approve'})
+        self.assertEqual([str(message) for message in get_messages(response.wsgi_request)],
+                         ['成功确认入库 1499 条入库途中产品记录。', '跳过了 1 条非待入库状态或不存在的记录。'])
+        # 查询按批次而不是按记录执行
+        self.assertLess(len(queries), 100)
+        self.assertEqual(StockMovement.objects.count(), 1499)
+        self.assertEqual(StockBalance.objects.get(product=self.product).on_hand, 2 * 1499)
+        self.assertEqual(StockMovement.objects.get(notes='由入库途中记录批量转入：7').quantity, 2)
+        self.assertFalse(IncomingStock.objects.filter(status='待入库').exists())
+
+        # 再次确认不会重复入库
+        self.client.post(reverse('inventory:incoming_stock_batch_approve'), {'selected_items': self.ids})
+        self.assertEqual(StockMovement.objects.count(), 1499)
+
+
+class RequestMetricsTests(TestCase):
+    """请求性能指标：查询次数、耗时、响应大小、Server-Timing 头和预算警告"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('tester', password='password', is_staff=True)
+        cls.ga = Warehouse.objects.create(name='亚特兰大仓库', code='GA')
+        product = Product.objects.create(sku='SKU-1', name='P-1', weight=1, length=1, width=1, height=1)
+        StockMovement.objects.create(product=product, warehouse=cls.ga, movement_type='IN', quantity=3, date=date(2025, 1, 1))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        get_view_cache().clear()
+
+    def test_every_url_has_budget(self):
+        names = {f'{urls.app_name}:{pattern.name}' for pattern in urls.urlpatterns}
+        self.assertEqual(names - set(settings.REQUEST_BUDGETS), set())
+
+    def test_metrics(self):
+        response = self.client.get(reverse('inventory:warehouse_list'))
+        metrics = response.wsgi_request.metrics
+        self.assertEqual(metrics.view_name, 'inventory:warehouse_list')
+        self.assertGreater(metrics.queries, 0)
+        self.assertEqual(metrics.response_size, len(response.content))
+        self.assertRegex(response['Server-Timing'], rf'db;dur=[\d.]+;desc="{metrics.queries} queries"')
+
+        self.user.is_staff = False
+        self.user.save()
+        self.assertNotIn('Server-Timing', self.client.get(reverse('inventory:warehouse_list')))
+
+    def test_streaming_response(self):
+        response = self.client.get(reverse('inventory:export_stock_movements'), {'format': 'csv'})
+        content = b''.join(response.streaming_content)
+        self.assertEqual(response.wsgi_request.metrics.response_size, len(content))
+
+    def test_over_budget(self):
+        budgets = dict(settings.REQUEST_BUDGETS, **{'inventory:warehouse_list': {'queries': 1}})
+        with override_settings(REQUEST_BUDGETS=budgets), self.assertLogs('inventory.performance', 'WARNING') as logs:
+            self.client.get(reverse('inventory:warehouse_list'))
+        self.assertIn('超出性能预算（queries', logs.output[0])
+
+
+class BenchmarkTests(TestCase):
+    """基准测试：生成的数据集维护余额和数据版本，测量时不影响站点的页面缓存"""
+
+    def test_generate_dataset(self):
+        result = generate_dataset(products=20, warehouses=3, movements=500, incoming=30, orders=30, days=30)
+        self.assertEqual(result['stock_movements'], 500)
+        self.assertIsNotNone(DataVersion.objects.current(StockMovement))
+        ledger = StockMovement.objects.aggregate(total=Sum(signed_quantity_expression()))['total']
+        self.assertEqual(StockBalance.objects.aggregate(total=Sum('on_hand'))['total'], ledger)
+        self.assertEqual(find_allocation_mismatches(), [])
+
+    def test_runner_keeps_shared_cache(self):
+        generate_dataset(products=20, warehouses=2, movements=100, incoming=10, orders=10, days=30)
+        get_view_cache().set('benchmark-sentinel', 1)
+        results = BenchmarkRunner(repeat=1, only=['product_list_sorted_by_stock', 'warehouse_list']).run()
+        self.assertEqual([(result['name'], result['status']) for result in results],
+                         [('product_list_sorted_by_stock', 200), ('warehouse_list', 200)])
+        self.assertEqual(get_view_cache().get('benchmark-sentinel'), 1)
+
+    def test_last_page_case(self):
+        Product.objects.bulk_create([Product(sku=f'SKU-{i}', name=f'P-{i}', weight=1, length=1, width=1, height=1)
+                                     for i in range(PRODUCTS_PER_PAGE * 2 + 1)])
+        cases = {name: data for name, _, _, data, _ in BenchmarkRunner(repeat=1).cases()}
+        self.assertEqual(cases['product_list_last_page'], {'page': 3})
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_contention_cleanup_keeps_other_writes(self):
+        generate_dataset(products=20, warehouses=2, movements=100, incoming=0, orders=0, days=30)
+        before = StockMovement.objects.count()
+        benchmark = ContentionBenchmark(readers=0, import_rows=50, idle_seconds=0)
+
+        def import_in_process(job):
+            # 代替导入子进程；同时有另一个进程写入一条库存变动
+            job = jobs.run_import_job(job)
+            StockMovement.objects.create(product=Product.objects.first(), warehouse=Warehouse.objects.first(),
+                                         movement_type='IN', quantity=1, date=date(2025, 1, 1), notes='其他进程')
+            return {'import_status': job.status, 'imported_rows': job.success_count}
+
+        with mock.patch.object(benchmark, '_import', import_in_process):
+            phases = benchmark.run()
+        self.assertEqual(phases[1]['imported_rows'], 50)
+        self.assertEqual(StockMovement.objects.count(), before + 1)
+        self.assertTrue(StockMovement.objects.filter(notes='其他进程').exists())
+        self.assertFalse(ImportJob.objects.exists())
+
+
+class QueryCountMixin:
+    """页面和导出的查询次数是固定的，不随产品、仓库和记录数量增长
+
+    子类用不同的数据量运行同一组断言；请求本身的会话和用户查询也计入在内。
+    仪表盘、列表页和导出的次数包括一次数据版本查询（页面缓存和ETag校验），列表页为未命中缓存时的次数。
+    """
+    PRODUCTS = 0
+
+    # {(URL名称, 参数): 查询次数}，参数中的 {ga} 替换为亚特兰大仓库的ID
+    EXPECTED_QUERIES = {
+        ('dashboard', ()): 12,
+        ('product_list', ()): 7,
+        ('product_list', (('sort', '-total_stock'), ('search', 'SKU'))): 7,
+        ('historical_stock', (('date', '2025-01-15'),)): 9,
+        ('stock_movement_list', ()): 4,
+        ('stock_movement_list', (('warehouse', '{ga}'), ('movement_type', 'IN'))): 4,
+        ('incoming_stock_list', ()): 3,
+        ('production_order_list', ()): 6,
+        ('search_products', (('term', 'SKU'),)): 3,
+        ('search', (('q', 'SKU-1'),)): 5,
+        ('stock_positions', ()): 8,
+        ('stock_positions', (('sku', 'SKU-1,SKU-2'),)): 8,
+        ('export_products', ()): 8,
+        ('export_products', (('format', 'csv'),)): 8,
+        ('export_stock_movements', ()): 4,
+        ('export_stock_movements', (('format', 'csv'),)): 4,
+        ('export_historical_stock', (('date', '2025-01-15'),)): 8,
+        ('export_historical_stock', (('date', '2025-01-15'), ('format', 'csv'))): 8,
+        ('export_incoming_stock', ()): 4,
+        ('export_incoming_stock', (('format', 'csv'),)): 4,
+        ('export_production_orders', ()): 4,
+        ('export_production_orders', (('format', 'csv'),)): 4,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('tester', password='password')
+        cls.ga = ga = Warehouse.objects.create(name='亚特兰大仓库', code='GA')
+        ca = Warehouse.objects.create(name='加州仓库', code='CA')
+        products = Product.objects.bulk_create([
+            Product(sku=f'SKU-{i}', fnsku=f'FN-{i}', name=f'P-{i // 2}', weight=1, length=1, width=1, height=1)
+            for i in range(cls.PRODUCTS)
+        ])
+        StockMovement.objects.bulk_create([
+            StockMovement(product=product, warehouse=warehouse, movement_type=movement_type,
+                          quantity=quantity, date=date(2025, 1, day))
+            for product in products
+            for warehouse, movement_type, quantity, day in ((ga, 'IN', 10, 1), (ca, 'IN', 8, 2), (ga, 'OUT', 3, 20))
+        ])
+        StockSnapshot.objects.build(date(2025, 1, 1), date(2025, 1, 10))
+        ProductionOrder.objects.bulk_create([
+            ProductionOrder(product=product, order_number=f'PO-{product.pk}', quantity=20, remaining_quantity=20)
+            for product in products
+        ])
+        IncomingStock.objects.bulk_create([
+            IncomingStock(product=product, warehouse=warehouse, quantity=5, expected_arrival_date=date(2025, 2, 1))
+            for product in products for warehouse in (ga, ca)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        get_view_cache().clear()
+
+    def test_query_counts(self):
+        # 自动补全索引在数据版本变化后的第一次搜索时重建，全文索引表是否存在也只检查一次，这里先预热
+        self.client.get(reverse('inventory:search_products'), {'term': 'SKU'})
+        search_index_available()
+        for (name, params), expected in self.EXPECTED_QUERIES.items():
+            with self.subTest(view=name, params=params):
+                with self.assertNumQueries(expected):
+                    response = self.client.get(reverse(f'inventory:{name}'),
+                                               {key: value.format(ga=self.ga.pk) for key, value in params})
+                    # 流式导出在读取响应内容时才查询数据库
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                self.assertEqual(response.status_code, 200)
+
+    def test_filters_applied(self):
+        # 上面计数的请求确实使用了筛选和排序，而不是被忽略后返回默认页面
+        movements = self.client.get(reverse('inventory:stock_movement_list'),
+                                    {'warehouse': self.ga.pk, 'movement_type': 'IN'}).context['movements']
+        self.assertEqual({(movement.warehouse_id, movement.movement_type) for movement in movements}, {(self.ga.pk, 'IN')})
+
+        # 按SKU排在最后的产品库存最多，按总库存倒序时应排在第一位
+        last = Product.objects.order_by('-sku').first()
+        StockMovement.objects.create(product=last, warehouse=self.ga, movement_type='IN',
+                                     quantity=100, date=date(2025, 1, 3))
+        products = list(self.client.get(reverse('inventory:product_list'),
+                                        {'sort': '-total_stock', 'search': 'SKU'}).context['products'])
+        self.assertEqual(products[0], last)
+        self.assertEqual([(product.stock_total, product.sku) for product in products],
+                         sorted(((product.stock_total, product.sku) for product in products),
+                                key=lambda row: (-row[0], row[1])))
+
+
+class SmallDatasetQueryCountTests(QueryCountMixin, TestCase):
+    PRODUCTS = 10
+
+
+class LargeDatasetQueryCountTests(QueryCountMixin, TestCase):
+    PRODUCTS = 1000
+
+
+class AutocompleteTests(TestCase):
+    """产品自动补全：进程内前缀索引，完全匹配优先，产品写入后重建索引"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('tester', password='password')
+        cls.exact = Product.objects.create(sku='ABC', fnsku='X00AAA', name='收纳箱', series='Summer',
+                                           weight=1, length=1, width=1, height=1)
+        cls.prefix = Product.objects.create(sku='ABC-1', fnsku='X00BBB', name='挂钩', series='Winter',
+                                            weight=1, length=1, width=1, height=1)
+        cls.by_name = Product.objects.create(sku='ZZZ-9', fnsku='X00CCC', name='abc', series='Autumn',
+                                             weight=1, length=1, width=1, height=1)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def ids(self, term):
+        return [product_id for product_id, _ in autocomplete_products(term)]
+
+    def test_exact_before_prefix(self):
+        # 完全匹配（店铺SKU、产品SKU）排在前缀匹配之前，同为完全匹配时按字段顺序
+        self.assertEqual(self.ids('abc'), [self.exact.pk, self.by_name.pk, self.prefix.pk])
+        self.assertEqual(autocomplete_products('ABC')[0], (self.exact.pk, 'ABC (收纳箱)'))
+
+    def test_fields(self):
+        for term, product in (('abc-', self.prefix), ('x00ccc', self.by_name), ('挂', self.prefix), ('summ', self.exact)):
+            with self.subTest(term=term):
+                self.assertEqual(self.ids(term), [product.pk])
+
+    def test_index_rebuilt_after_writes(self):
+        index = get_product_index()
+        self.assertIs(get_product_index(), index)
+        self.assertEqual(self.ids('new-1'), [])
+
+        product = Product.objects.create(sku='NEW-1', name='新产品', weight=1, length=1, width=1, height=1)
+        self.assertEqual(self.ids('new-1'), [product.pk])
+        self.assertIsNot(get_product_index(), index)
+
+        Product.objects.filter(pk=product.pk).update(series='Spring')
+        self.assertEqual(self.ids('spring'), [product.pk])
+        Product.objects.filter(pk=product.pk).delete()
+        self.assertEqual(self.ids('new-1'), [])
+
+    def test_contains_fallback(self):
+        # 前缀索引没有结果时按包含匹配查询数据库
+        self.assertEqual(self.ids('bc-1'), [self.prefix.pk])
+        self.assertEqual(self.ids('00bb'), [self.prefix.pk])
+        self.assertEqual(self.ids('nothing'), [])
+
+    def test_view(self):
+        response = self.client.get(reverse('inventory:search_products'), {'term': 'ABC-'})
+        self.assertEqual(response.json(), {'results': [{'id': self.prefix.pk, 'text': 'ABC-1 (挂钩)'}]})
+
+
+class FullTextSearchTests(TestCase):
+    """全文索引由触发器与业务表保持同步，搜索结果按相关度排序"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('tester', password='password')
+        cls.ga = Warehouse.objects.create(name='亚特兰大仓库', code='GA')
+        cls.product = Product.objects.create(sku='ABC-100', fnsku='X00ABC', name='收纳箱', series='Summer',
+                                             weight=1, length=1, width=1, height=1)
+        cls.other = Product.objects.create(sku='ZZZ-1', name='ABC-100 配件', weight=1, length=1, width=1, height=1)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def kinds(self, text):
+        return [(result['kind'], result['object'].pk) for result in SearchResults(text)[0:20]]
+
+    def test_triggers_keep_index_in_sync(self):
+        movement = StockMovement.objects.create(product=self.product, warehouse=self.ga, movement_type='IN',
+                                                quantity=5, date=date(2025, 1, 1), notes='集装箱 MSCU1234567 到港')
+        incoming = IncomingStock.objects.create(product=self.other, warehouse=self.ga, quantity=3,
+                                                expected_arrival_date=date(2025, 2, 1), notes='mscu1234567 第二批')
+        StockMovement.objects.create(product=self.product, warehouse=self.ga, movement_type='OUT',
+                                     quantity=1, date=date(2025, 1, 2))
+        self.assertCountEqual(self.kinds('MSCU1234567'), [('movement', movement.pk), ('incoming', incoming.pk)])
+        self.assertEqual(self.kinds('mscu 到港'), [('movement', movement.pk)])
+
+        StockMovement.objects.filter(pk=movement.pk).update(notes='已改为其他柜号')
+        IncomingStock.objects.filter(pk=incoming.pk).delete()
+        self.assertEqual(self.kinds('MSCU1234567'), [])
+        self.assertEqual(self.kinds('其他柜号'), [('movement', movement.pk)])
+
+        # 删除产品时级联删除的库存变动也从索引中移除
+        self.product.delete()
+        self.assertEqual(self.kinds('其他柜号'), [])
+        self.assertEqual(self.kinds('ABC-100'), [('product', self.other.pk)])
+
+    def test_ranking_and_snippet(self):
+        StockMovement.objects.create(product=self.other, warehouse=self.ga, movement_type='IN', quantity=1,
+                                     date=date(2025, 1, 1), notes='<b>ABC-100</b> 补货')
+        results = SearchResults('abc-100')[0:20]
+        # SKU完全命中的产品排在名称和备注命中之前
+        self.assertEqual((results[0]['kind'], results[0]['object']), ('product', self.product))
+        self.assertEqual([result['kind'] for result in results], ['product', 'product', 'movement'])
+        self.assertEqual(results[2]['snippet'], '&lt;b&gt;<mark>ABC-100</mark>&lt;/b&gt; 补货')
+
+    def test_many_matches(self):
+        # 最早的一条相关度最高，其余命中远多于一页
+        best = StockMovement.objects.create(product=self.product, warehouse=self.ga, movement_type='IN', quantity=1,
+                                            date=date(2025, 1, 1), notes='MSCU7654321')
+        StockMovement.objects.bulk_create([
+            StockMovement(product=self.product, warehouse=self.ga, movement_type='IN', quantity=1, date=date(2025, 1, 2),
+                          notes=f'第{i}批 集装箱 MSCU7654321 已到港，等待卸货后清点入库')
+            for i in range(1100)
+        ])
+        results = SearchResults('mscu7654321')
+        self.assertEqual(results.count(), 1101)
+        self.assertEqual(results[0:20][0]['object'], best)
+        ids = [result['object'].pk for start in range(0, 1101, 100) for result in results[start:start + 100]]
+        self.assertEqual(len(set(ids)), 1101)
+
+        last_page = (1101 - 1) // SEARCH_RESULTS_PER_PAGE + 1
+        response = self.client.get(reverse('inventory:search'), {'q': 'MSCU7654321', 'page': last_page})
+        self.assertEqual(response.context['total_count'], 1101)
+        self.assertEqual(len(response.context['results']), 1101 % SEARCH_RESULTS_PER_PAGE)
+
+    def test_missing_triggers(self):
+        # 迁移重建业务表时会删除表上的触发器
+        self.enterContext(mock.patch.dict(search._available, clear=True))
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER inventory_product_fts_au')
+        Product.objects.filter(pk=self.product.pk).update(name='折叠收纳盒')
+
+        self.assertEqual(missing_search_triggers(), ['inventory_product_fts_au'])
+        self.assertEqual([warning.id for warning in check_search_triggers(None, databases=['default'])], ['inventory.W001'])
+        self.assertFalse(search_index_available())
+        # 产品列表的搜索退回到icontains，结果仍然是最新的
+        self.assertEqual(list(filter_products(Product.objects.all(), '折叠收纳')), [self.product])
+        response = self.client.get(reverse('inventory:search'), {'q': '折叠收纳'})
+        self.assertContains(response, 'rebuild_search_index')
+
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(missing_search_triggers(), [])
+        self.assertEqual(check_search_triggers(None, databases=['default']), [])
+        self.assertTrue(search_index_available())
+        self.assertEqual(self.kinds('折叠收纳'), [('product', self.product.pk)])
+        Product.objects.filter(pk=self.product.pk).update(name='收纳箱')
+        self.assertEqual(self.kinds('折叠收纳'), [])
+
+    def test_product_list_filter_matches_icontains(self):
+        for text in ('abc', 'ABC-100', 'c-1', '收纳箱', 'xyz'):
+            with self.subTest(text=text):
+                expected = Product.objects.filter(Q(sku__icontains=text) | Q(name__icontains=text))
+                self.assertCountEqual(filter_products(Product.objects.all(), text), expected)
+
+    def test_search_view(self):
+        response = self.client.get(reverse('inventory:search'), {'q': 'Summer', 'type': 'product'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['object'] for result in response.context['results']], [self.product])
+
+        response = self.client.get(reverse('inventory:search'), {'q': 'ab'})
+        self.assertEqual(response.context['paginator'].count, 0)
+        self.assertContains(response, '不少于3个字符')
+
+
+class PageCacheTests(TestCase):
+    """仪表盘和列表页按数据版本缓存：重复访问不查询业务表，任何写入后都显示最新数据"""
+
+    PAGES = ('dashboard', 'product_list', 'production_order_list')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('tester', password='password')
+        cls.ga = Warehouse.objects.create(name='亚特兰大仓库', code='GA')
+        cls.product = Product.objects.create(sku='SKU-1', name='P-1', weight=1, length=1, width=1, height=1)
+        StockMovement.objects.create(product=cls.product, warehouse=cls.ga, movement_type='IN',
+                                     quantity=10, date=date(2025, 1, 1))
+        cls.order = ProductionOrder.objects.create(product=cls.product, order_number='PO-1', quantity=20,
+                                                   remaining_quantity=20)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        get_view_cache().clear()
+
+    def get(self, name):
+        return self.client.get(reverse(f'inventory:{name}')).content.decode()
+
+    def versions(self, *models):
+        return {key: version for key, (version, _) in DataVersion.objects.current_versions(*models).items()}
+
+    def test_repeat_views_only_check_versions(self):
+        for name in self.PAGES:
+            with self.subTest(view=name):
+                self.get(name)
+                # 会话、用户和数据版本
+                with self.assertNumQueries(3):
+                    self.get(name)
+
+    def test_writes_invalidate_pages(self):
+        for name in self.PAGES:
+            self.get(name)
+
+        StockMovement.objects.bulk_create([StockMovement(product=self.product, warehouse=self.ga,
+                                                         movement_type='IN', quantity=5, date=date(2025, 1, 2))])
+        self.assertIn('<td>15</td>', self.get('product_list'))
+
+        ProductionOrder.objects.filter(pk=self.order.pk).update(remaining_quantity=7)
+        self.assertIn('<td>7</td>', self.get('production_order_list'))
+
+        Product.objects.filter(pk=self.product.pk).update(name='新名称')
+        self.assertIn('新名称', self.get('production_order_list'))
+
+        Warehouse.objects.create(name='加州仓库', code='CA')
+        self.assertIn('加州仓库', self.get('dashboard'))
+
+    def test_warehouse_changes_invalidate_production_orders(self):
+        # 待入库数量按仓库代码汇总，仓库变更后生产订单片段需重新计算
+        self.get('production_order_list')
+        Warehouse.objects.filter(pk=self.ga.pk).update(code='CA')
+        with CaptureQueriesContext(connection) as queries:
+            self.get('production_order_list')
+        self.assertGreater(len(queries), 3)
+
+    def test_cascade_delete_bumps_related_tables(self):
+        tracked = (Warehouse, StockMovement, IncomingStock, Product, ProductionOrder)
+        before = self.versions(*tracked)
+        self.ga.delete()
+        after = self.versions(*tracked)
+        for model in (Warehouse, StockMovement, IncomingStock):
+            key = model._meta.label_lower
+            self.assertGreater(after[key], before.get(key, 0), key)
+        # 删除仓库不影响产品和生产订单
+        for model in (Product, ProductionOrder):
+            key = model._meta.label_lower
+            self.assertEqual(after[key], before[key], key)
+
+        self.assertEqual(self.client.get(reverse('inventory:dashboard')).context['total_products'], 1)
+        Product.objects.all().delete()
+        self.assertEqual(self.client.get(reverse('inventory:dashboard')).context['total_products'], 0)
+
+
+class ConditionalResponseTests(TestCase):
+    """列表页和导出按数据版本返回ETag/Last-Modified，数据未变化时返回304且不执行视图"""
+
+    EXPORTS = ('export_products', 'export_stock_movements', 'export_historical_stock',
+               'export_incoming_stock', 'export_production_orders')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('tester', password='password')
+        cls.other_user = User.objects.create_user('other', password='password')
+        cls.ga = Warehouse.objects.create(name='亚特兰大仓库', code='GA')
+        Warehouse.objects.create(name='加州仓库', code='CA')
+        cls.product = Product.objects.create(sku='SKU-1', name='P-1', weight=1, length=1, width=1, height=1)
+        StockMovement.objects.create(product=cls.product, warehouse=cls.ga, movement_type='IN',
+                                     quantity=10, date=date(2025, 1, 1))
+        # 最近一秒内有写入时不返回Last-Modified，把写入时间移到过去
+        DataVersion.objects.update(updated_at=timezone.now() - timedelta(minutes=5))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def get(self, name, **headers):
+        response = self.client.get(reverse(f'inventory:{name}'), headers=headers)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def test_exports_not_modified(self):
+        for name in self.EXPORTS:
+            with self.subTest(view=name):
+                response = self.get(name)
+                self.assertEqual(response.status_code, 200)
+                # 会话、用户和数据版本，不生成文件
+                with self.assertNumQueries(3):
+                    self.assertEqual(self.get(name, if_none_match=response['ETag']).status_code, 304)
+                self.assertEqual(self.get(name, if_modified_since=response['Last-Modified']).status_code, 304)
+
+        response = self.get('export_products')
+        StockMovement.objects.create(product=self.product, warehouse=self.ga, movement_type='OUT',
+                                     quantity=1, date=date(2025, 1, 2))
+        self.assertEqual(self.get('export_products', if_none_match=response['ETag']).status_code, 200)
+        # 刚写入的一秒内不返回Last-Modified，If-Modified-Since不会把同一秒内的写入判断为未修改
+        self.assertEqual(self.get('export_products', if_modified_since=response['Last-Modified']).status_code, 200)
+        self.assertFalse(self.get('export_products').has_header('Last-Modified'))
+
+    def test_pages_vary_by_params_and_user(self):
+        for name in ('product_list', 'historical_stock'):
+            with self.subTest(view=name):
+                etag = self.get(name)['ETag']
+                self.assertEqual(self.get(name, if_none_match=etag).status_code, 304)
+                response = self.client.get(reverse(f'inventory:{name}'), {'page': 2}, headers={'if_none_match': etag})
+                self.assertEqual(response.status_code, 200)
+
+                self.client.force_login(self.other_user)
+                self.assertEqual(self.get(name, if_none_match=etag).status_code, 200)
+                self.client.force_login(self.user)
+
+        etag = self.get('product_list')['ETag']
+        Product.objects.filter(pk=self.product.pk).update(name='P-2')
+        self.assertEqual(self.get('product_list', if_none_match=etag).status_code, 200)
+
+
+class StockPositionApiTests(TestCase):
+    """库存位置接口：列式JSON、SKU和since过滤、数据未变化时304"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('tester', password='password')
+        cls.ga = Warehouse.objects.create(name='亚特兰大仓库', code='GA')
+        cls.ca = Warehouse.objects.create(name='加州仓库', code='CA')
+        cls.products = [
+            Product.objects.create(sku=f'SKU-{i}', name=f'P-{i}', weight=1, length=1, width=1, height=1)
+            for i in range(3)
+        ]
+        StockMovement.objects.create(product=cls.products[0], warehouse=cls.ga, movement_type='IN',
+                                     quantity=10, date=date(2025, 1, 1))
+        StockMovement.objects.create(product=cls.products[0], warehouse=cls.ca, movement_type='IN',
+                                     quantity=4, date=date(2025, 1, 1))
+        IncomingStock.objects.create(product=cls.products[1], warehouse=cls.ca, quantity=6,
+                                     expected_arrival_date=date(2025, 2, 1))
+        IncomingStock.objects.create(product=cls.products[1], warehouse=cls.ca, quantity=5, status='已入库',
+                                     expected_arrival_date=date(2025, 2, 1))
+        ProductionOrder.objects.create(product=cls.products[2], order_number='PO-1', quantity=20, remaining_quantity=20)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        get_view_cache().clear()
+
+    def get(self, params=None, **headers):
+        return self.client.get(reverse('inventory:stock_positions'), params or {}, headers=headers)
+
+    def test_columnar_layout(self):
+        data = self.get().json()
+        self.assertEqual(data['warehouses'], ['CA', 'GA'])
+        self.assertEqual(data['sku'], ['SKU-0', 'SKU-1', 'SKU-2'])
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(data['on_hand'], {'CA': [4, 0, 0], 'GA': [10, 0, 0]})
+        self.assertEqual(data['incoming'], {'CA': [0, 6, 0], 'GA': [0, 0, 0]})
+        self.assertEqual(data['open_production'], [0, 0, 20])
+
+    def test_sku_filter(self):
+        data = self.get({'sku': ['SKU-2', 'SKU-0, missing']}).json()
+        self.assertEqual(data['sku'], ['SKU-0', 'SKU-2'])
+        self.assertEqual(data['on_hand']['GA'], [10, 0])
+        self.assertEqual(data['open_production'], [0, 20])
+
+    def test_since_filter(self):
+        since = self.get().json()['generated_at']
+        self.assertEqual(self.get({'since': since}).json()['sku'], [])
+
+        StockMovement.objects.create(product=self.products[2], warehouse=self.ga, movement_type='IN',
+                                     quantity=1, date=date(2025, 1, 2))
+        IncomingStock.objects.filter(product=self.products[1]).update(updated_at=timezone.now())
+        data = self.get({'since': since}).json()
+        self.assertEqual(data['sku'], ['SKU-1', 'SKU-2'])
+        self.assertEqual(data['on_hand']['GA'], [0, 1])
+
+        self.assertEqual(self.get({'since': '2000-01-01'}).json()['count'], 3)
+        self.assertEqual(self.get({'since': 'yesterday'}).status_code, 400)
+
+    def test_not_modified(self):
+        etag = self.get()['ETag']
+        with self.assertNumQueries(3):
+            self.assertEqual(self.get(if_none_match=etag).status_code, 304)
+        ProductionOrder.objects.update(remaining_quantity=0)
+        self.assertEqual(self.get(if_none_match=etag).status_code, 200)
+
+
+@skipUnless(connection.vendor == 'sqlite', '只适用于SQLite')
+class SQLiteConnectionTests(TestCase):
+    """每个新连接都通过 init_command 设置PRAGMA，事务开始时获取写锁"""
+
+    def pragma(self, cursor, name):
+        cursor.execute(f'PRAGMA {name}')
+        return cursor.fetchone()[0]
+
+    def test_connection_pragmas(self):
+        with connection.cursor() as cursor:
+            self.assertEqual(self.pragma(cursor, 'synchronous'), 1)
+            self.assertEqual(self.pragma(cursor, 'temp_store'), 2)
+            self.assertEqual(self.pragma(cursor, 'busy_timeout'), settings.SQLITE_BUSY_TIMEOUT_MS)
+            self.assertEqual(self.pragma(cursor, 'cache_size'), -settings.SQLITE_CACHE_SIZE_KB)
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+    def test_file_database_uses_wal(self):
+        # 测试数据库在内存中，WAL只对数据库文件生效
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = type(connections['default'])({**connection.settings_dict, 'NAME': os.path.join(directory, 'db.sqlite3')},
+                                           alias='wal_test')
+            try:
+                with wrapper.cursor() as cursor:
+                    self.assertEqual(self.pragma(cursor, 'journal_mode'), 'wal')
+                    self.assertEqual(self.pragma(cursor, 'mmap_size'), settings.SQLITE_MMAP_SIZE)
+            finally:
+                wrapper.close()
@@ -14,6 +14,8 @@ urlpatterns = [
     path('products/export/', views.export_products, name='export_products'),
     path('products/template/download/', views.download_product_template, name='download_product_template'),
     path('products/search/', views.search_products, name='search_products'),
+    path('search/', views.search, name='search'),
+    path('api/stock-positions/', views.stock_positions, name='stock_positions'),
     
     path('warehouses/', views.warehouse_list, name='warehouse_list'),
     path('warehouses/create/', views.warehouse_create, name='warehouse_create'),
@@ -58,4 +60,8 @@ urlpatterns = [
     path('production-orders/import/', views.import_production_orders, name='import_production_orders'),
     path('production-orders/export/', views.export_production_orders, name='export_production_orders'),
     path('production-orders/template/', views.download_production_order_template, name='download_production_order_template'),
+    
+    # 导入任务
+    path('import-jobs/<int:pk>/', views.import_job_detail, name='import_job_detail'),
+    path('import-jobs/<int:pk>/status/', views.import_job_status, name='import_job_status'),
 ] 
\ No newline at end of file
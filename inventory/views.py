@@ -1,24 +1,54 @@
 import os
 import openpyxl
-import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime, time, timedelta
 from django.shortcuts import render, redirect, get_object_or_404
+from django.core.paginator import Paginator
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Sum, Q, F
+from django.db import transaction
+from django.db.models import Sum, Exists, OuterRef
 from django.utils import timezone
-from django.http import HttpResponse, JsonResponse
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.functional import SimpleLazyObject
+from django.http import HttpResponse, JsonResponse, QueryDict
+from django.views.decorators.http import condition
 from openpyxl.utils import get_column_letter
 from openpyxl.styles import Font, PatternFill
 from io import BytesIO
-from .models import Product, Warehouse, StockMovement, IncomingStock, ProductionOrder
+from .models import Product, Warehouse, StockMovement, StockBalance, IncomingStock, ProductionOrder, ImportJob
 from .forms import ProductForm, WarehouseForm, StockMovementForm, IncomingStockForm, ProductionOrderForm
+from .services import (get_stock_matrix, get_incoming_stock_by_product, get_stock_positions, annotate_stock_columns,
+                       allocate_incoming_stock, release_incoming_stock, delete_incoming_stock, approve_incoming_stock, ApprovalConflict)
+from .pagination import keyset_paginate
+from .autocomplete import autocomplete_products
+from .cache import cached_context, fragment_cache_context, data_etag, data_last_modified
+from .search import (SEARCH_INDEXES, SEARCH_MIN_TERM_LENGTH, SEARCH_RESULTS_PER_PAGE, SearchResults, filter_products,
+                     search_index_available, split_terms)
+from .exports import iter_rows, export_response, file_response
+from .importers import IMPORTERS, ImportFileError, read_import_file, validation_report_rows
 
 @login_required
 def index(request):
     return redirect('inventory:dashboard')
 
+# 产品列表每页显示数量
+PRODUCTS_PER_PAGE = 50
+
+# 产品列表中计算列的排序参数与查询注解的对应关系
+PRODUCT_COMPUTED_SORT_FIELDS = {
+    'total_stock': 'stock_total',
+    'ga_stock': 'ga_stock',
+    'ca_stock': 'ca_stock',
+    'ga_incoming': 'ga_incoming',
+    'ca_incoming': 'ca_incoming',
+    'production_orders': 'production_orders',
+}
+
+# 产品列表依赖的表（库存余额由库存变动维护）
+PRODUCT_LIST_MODELS = (Product, Warehouse, StockMovement, IncomingStock, ProductionOrder)
+
 @login_required
+@condition(etag_func=data_etag('product_list', PRODUCT_LIST_MODELS, per_user=True))
 def product_list(request):
     # 获取搜索参数
     search_query = request.GET.get('search', '')
@@ -26,122 +56,55 @@ def product_list(request):
     # 获取排序参数
     sort_by = request.GET.get('sort', 'sku')  # 默认按店铺SKU排序
     
-    # 确定是否是数据库字段的排序
-    db_sort_fields = ['sku', '-sku', 'name', '-name', 'weight', '-weight', 
-                     'length', '-length', 'width', '-width', 'height', '-height',
+    # 数据库字段的排序
+    db_sort_fields = ['sku', '-sku', 'name', '-name', 'series', '-series', 'season', '-season',
+                     'weight', '-weight', 'length', '-length', 'width', '-width', 'height', '-height',
                      'low_stock_threshold', '-low_stock_threshold']
     
-    is_db_sort = sort_by in db_sort_fields
-    
-    # 如果是数据库字段排序，直接使用ORDER BY
-    if is_db_sort:
-        products = Product.objects.all().order_by(sort_by)
+    # 库存、在途和生产订单等计算列通过查询注解在数据库中排序
+    products = annotate_stock_columns(Product.objects.all())
+    sort_field = sort_by.lstrip('-')
+    if sort_by in db_sort_fields:
+        products = products.order_by(sort_by, 'pk')
+    elif sort_field in PRODUCT_COMPUTED_SORT_FIELDS:
+        direction = '-' if sort_by.startswith('-') else ''
+        products = products.order_by(direction + PRODUCT_COMPUTED_SORT_FIELDS[sort_field], 'sku', 'pk')
     else:
-        products = Product.objects.all().order_by('sku')  # 默认排序，后面会重新排序
+        products = products.order_by('sku', 'pk')
     
-    # 如果有搜索查询，过滤产品
+    # 如果有搜索查询，按店铺SKU或产品SKU过滤产品（有全文索引时走索引）
     if search_query:
-        products = products.filter(
-            Q(sku__icontains=search_query) |  # 店铺SKU
-            Q(name__icontains=search_query)    # 产品SKU
-        )
+        products = filter_products(products, search_query)
     
-    warehouses = Warehouse.objects.all()
+    # 分页，ORDER BY/LIMIT/OFFSET都在数据库中执行
+    # 表格是按数据版本缓存的模板片段，以下数据都延迟到渲染片段时才查询，命中缓存时不访问数据库
+    paginator = Paginator(products, PRODUCTS_PER_PAGE)
+    page_obj = SimpleLazyObject(lambda: paginator.get_page(request.GET.get('page')))
+    
+    warehouses = SimpleLazyObject(lambda: list(Warehouse.objects.all()))
     
     # 获取亚特兰大和加州仓库
-    ga_warehouse = None
-    ca_warehouse = None
-    for warehouse in warehouses:
-        if warehouse.code == 'GA':
-            ga_warehouse = warehouse
-        elif warehouse.code == 'CA':
-            ca_warehouse = warehouse
-    
-    # 预先计算每个产品在每个仓库的库存
-    product_warehouse_stock = {}
-    # 预先计算每个产品在每个仓库的在途数量
-    product_incoming_stock = {}
-    # 预先计算每个产品的生产订单剩余数量
-    product_production_orders = {}
-    # 存储每个产品的总库存
-    product_total_stock = {}
-    
-    # 获取所有待入库的入库途中产品
-    incoming_stocks = IncomingStock.objects.filter(status='待入库')
-    
-    # 获取所有未完成的生产订单
-    production_orders = ProductionOrder.objects.filter(remaining_quantity__gt=0)
-    
-    # 初始化产品在途数据字典和生产订单数据字典
-    for product in products:
-        product_warehouse_stock[product.id] = {}
-        product_incoming_stock[product.id] = {
-            'GA': 0,
-            'CA': 0,
-            'total': 0
-        }
-        product_production_orders[product.id] = 0
-        
-        # 计算每个仓库的库存
-        for warehouse in warehouses:
-            product_warehouse_stock[product.id][warehouse.id] = product.get_stock_by_warehouse(warehouse)
-        
-        # 存储总库存
-        product_total_stock[product.id] = product.total_stock
-    
-    # 计算每个产品在GA和CA的在途数量
-    for incoming in incoming_stocks:
-        if incoming.product.id in product_incoming_stock:
-            if incoming.warehouse.code == 'GA':
-                product_incoming_stock[incoming.product.id]['GA'] += incoming.quantity
-            elif incoming.warehouse.code == 'CA':
-                product_incoming_stock[incoming.product.id]['CA'] += incoming.quantity
-            product_incoming_stock[incoming.product.id]['total'] += incoming.quantity
-    
-    # 计算每个产品的生产订单剩余数量
-    for order in production_orders:
-        if order.product.id in product_production_orders:
-            product_production_orders[order.product.id] += order.remaining_quantity
-    
-    # 针对非数据库字段的排序
-    if not is_db_sort:
-        # 按总库存排序
-        if sort_by == 'total_stock':
-            products = sorted(products, key=lambda p: product_total_stock.get(p.id, 0))
-        elif sort_by == '-total_stock':
-            products = sorted(products, key=lambda p: product_total_stock.get(p.id, 0), reverse=True)
-        # 按GA仓库库存排序
-        elif sort_by == 'ga_stock' and ga_warehouse:
-            products = sorted(products, key=lambda p: product_warehouse_stock.get(p.id, {}).get(ga_warehouse.id, 0))
-        elif sort_by == '-ga_stock' and ga_warehouse:
-            products = sorted(products, key=lambda p: product_warehouse_stock.get(p.id, {}).get(ga_warehouse.id, 0), reverse=True)
-        # 按CA仓库库存排序
-        elif sort_by == 'ca_stock' and ca_warehouse:
-            products = sorted(products, key=lambda p: product_warehouse_stock.get(p.id, {}).get(ca_warehouse.id, 0))
-        elif sort_by == '-ca_stock' and ca_warehouse:
-            products = sorted(products, key=lambda p: product_warehouse_stock.get(p.id, {}).get(ca_warehouse.id, 0), reverse=True)
-        # 按GA在途排序
-        elif sort_by == 'ga_incoming':
-            products = sorted(products, key=lambda p: product_incoming_stock.get(p.id, {}).get('GA', 0))
-        elif sort_by == '-ga_incoming':
-            products = sorted(products, key=lambda p: product_incoming_stock.get(p.id, {}).get('GA', 0), reverse=True)
-        # 按CA在途排序
-        elif sort_by == 'ca_incoming':
-            products = sorted(products, key=lambda p: product_incoming_stock.get(p.id, {}).get('CA', 0))
-        elif sort_by == '-ca_incoming':
-            products = sorted(products, key=lambda p: product_incoming_stock.get(p.id, {}).get('CA', 0), reverse=True)
-        # 按生产订单数量排序
-        elif sort_by == 'production_orders':
-            products = sorted(products, key=lambda p: product_production_orders.get(p.id, 0))
-        elif sort_by == '-production_orders':
-            products = sorted(products, key=lambda p: product_production_orders.get(p.id, 0), reverse=True)
+    ga_warehouse = SimpleLazyObject(lambda: next((w for w in warehouses if w.code == 'GA'), None))
+    ca_warehouse = SimpleLazyObject(lambda: next((w for w in warehouses if w.code == 'CA'), None))
+    
+    # 一次分组查询获取当前页产品在每个仓库的库存
+    product_warehouse_stock = SimpleLazyObject(lambda: get_stock_matrix(
+        [product.id for product in page_obj],
+        [warehouse.id for warehouse in warehouses]
+    ))
+    
+    # 翻页链接保留搜索和排序参数
+    query_params = request.GET.copy()
+    query_params.pop('page', None)
     
     return render(request, 'inventory/product_list.html', {
-        'products': products,
+        **fragment_cache_context('product_list', request.GET, PRODUCT_LIST_MODELS, request),
+        'products': page_obj,
+        'page_obj': page_obj,
+        'paginator': paginator,
+        'page_query': query_params.urlencode(),
         'warehouses': warehouses,
         'product_warehouse_stock': product_warehouse_stock,
-        'product_incoming_stock': product_incoming_stock,
-        'product_production_orders': product_production_orders,
         'search_query': search_query,  # 传递搜索查询到模板
         'ga_warehouse': ga_warehouse,
         'ca_warehouse': ca_warehouse,
@@ -188,6 +151,10 @@ def product_delete(request, pk):
     
     return redirect('inventory:product_list')
 
+def selected_pks(selected_ids):
+    """把表单提交的选中ID转换为整数主键，忽略无效值"""
+    return {int(pk) for pk in selected_ids if str(pk).isdigit()}
+
 @login_required
 def product_batch_delete(request):
     if request.method == 'POST':
@@ -196,27 +163,20 @@ def product_batch_delete(request):
             messages.error(request, '未选择任何产品。')
             return redirect('inventory:product_list')
         
-        success_count = 0
-        error_count = 0
-        
-        for product_id in selected_ids:
-            try:
-                product = Product.objects.get(pk=product_id)
-                
-                # 检查是否有关联的库存变动记录
-                stock_movements = StockMovement.objects.filter(product=product)
-                if stock_movements.exists():
-                    error_count += 1
-                else:
-                    product.delete()
-                    success_count += 1
-            except Product.DoesNotExist:
-                error_count += 1
+        # 一次条件删除：有关联库存变动记录的产品由Exists子查询排除
+        products = Product.objects.filter(pk__in=selected_pks(selected_ids))
+        with transaction.atomic():
+            blocked_count = products.filter(Exists(StockMovement.objects.filter(product=OuterRef('pk')))).count()
+            _, deleted = products.exclude(Exists(StockMovement.objects.filter(product=OuterRef('pk')))).delete()
+        success_count = deleted.get(Product._meta.label, 0)
+        missing_count = len(selected_pks(selected_ids)) - success_count - blocked_count
         
         if success_count > 0:
             messages.success(request, f'成功删除 {success_count} 个产品。')
-        if error_count > 0:
-            messages.error(request, f'{error_count} 个产品无法删除，因为它们有关联的库存变动记录。')
+        if blocked_count > 0:
+            messages.error(request, f'{blocked_count} 个产品无法删除，因为它们有关联的库存变动记录。')
+        if missing_count > 0:
+            messages.warning(request, f'{missing_count} 个产品不存在或已被删除。')
     
     return redirect('inventory:product_list')
 
@@ -273,30 +233,29 @@ def warehouse_batch_delete(request):
             messages.error(request, '未选择任何仓库。')
             return redirect('inventory:warehouse_list')
         
-        success_count = 0
-        error_count = 0
-        
-        for warehouse_id in selected_ids:
-            try:
-                warehouse = Warehouse.objects.get(pk=warehouse_id)
-                
-                # 检查是否有关联的库存变动记录
-                stock_movements = StockMovement.objects.filter(warehouse=warehouse)
-                if stock_movements.exists():
-                    error_count += 1
-                else:
-                    warehouse.delete()
-                    success_count += 1
-            except Warehouse.DoesNotExist:
-                error_count += 1
+        # 一次条件删除：有关联库存变动记录的仓库由Exists子查询排除
+        warehouses = Warehouse.objects.filter(pk__in=selected_pks(selected_ids))
+        with transaction.atomic():
+            blocked_count = warehouses.filter(Exists(StockMovement.objects.filter(warehouse=OuterRef('pk')))).count()
+            warehouses = warehouses.exclude(Exists(StockMovement.objects.filter(warehouse=OuterRef('pk'))))
+            # 仓库中的入库途中记录会被级联删除，先恢复其扣减的生产订单数量
+            delete_incoming_stock(IncomingStock.objects.filter(warehouse__in=warehouses))
+            _, deleted = warehouses.delete()
+        success_count = deleted.get(Warehouse._meta.label, 0)
+        missing_count = len(selected_pks(selected_ids)) - success_count - blocked_count
         
         if success_count > 0:
             messages.success(request, f'成功删除 {success_count} 个仓库。')
-        if error_count > 0:
-            messages.error(request, f'{error_count} 个仓库无法删除，因为它们有关联的库存变动记录。')
+        if blocked_count > 0:
+            messages.error(request, f'{blocked_count} 个仓库无法删除，因为它们有关联的库存变动记录。')
+        if missing_count > 0:
+            messages.warning(request, f'{missing_count} 个仓库不存在或已被删除。')
     
     return redirect('inventory:warehouse_list')
 
+# 库存变动列表每页显示数量
+MOVEMENTS_PER_PAGE = 50
+
 @login_required
 def stock_movement_list(request):
     # 获取排序参数
@@ -310,8 +269,58 @@ def stock_movement_list(request):
     if sort_by not in valid_sort_fields:
         sort_by = '-date'  # 如果排序字段无效，回退到默认排序
     
-    # 应用排序
-    movements = StockMovement.objects.all().order_by(sort_by)
+    # 产品和仓库随记录一起查询，避免模板中每行再查询两次
+    movements = StockMovement.objects.select_related('product', 'warehouse')
+    
+    # 筛选条件：日期范围、仓库、店铺SKU、类型
+    filters = {
+        'date_from': request.GET.get('date_from', ''),
+        'date_to': request.GET.get('date_to', ''),
+        'warehouse': request.GET.get('warehouse', ''),
+        'sku': request.GET.get('sku', '').strip(),
+        'movement_type': request.GET.get('movement_type', ''),
+    }
+    for key, lookup in (('date_from', 'date__gte'), ('date_to', 'date__lte')):
+        if filters[key]:
+            try:
+                movements = movements.filter(**{lookup: datetime.strptime(filters[key], '%Y-%m-%d').date()})
+            except ValueError:
+                messages.error(request, '日期格式错误，请使用YYYY-MM-DD格式')
+                filters[key] = ''
+    if filters['warehouse'].isdigit():
+        movements = movements.filter(warehouse_id=filters['warehouse'])
+    else:
+        filters['warehouse'] = ''
+    if filters['sku']:
+        movements = movements.filter(product__sku=filters['sku'])
+    if filters['movement_type'] in ('IN', 'OUT'):
+        movements = movements.filter(movement_type=filters['movement_type'])
+    else:
+        filters['movement_type'] = ''
+    
+    # 游标分页，翻到任意一页的开销都与第一页相同
+    page = keyset_paginate(
+        movements, sort_by,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        page_size=MOVEMENTS_PER_PAGE
+    )
+    
+    # 排序和翻页链接保留筛选条件
+    filter_params = QueryDict(mutable=True)
+    for key, value in filters.items():
+        if value:
+            filter_params[key] = value
+    filter_query = filter_params.urlencode()
+    filter_params['sort'] = sort_by
+    next_query = previous_query = ''
+    if page['has_next']:
+        filter_params['after'] = page['next_cursor']
+        next_query = filter_params.urlencode()
+        del filter_params['after']
+    if page['has_previous']:
+        filter_params['before'] = page['previous_cursor']
+        previous_query = filter_params.urlencode()
     
     # 确定每个字段的排序方向
     sort_directions = {
@@ -323,7 +332,13 @@ def stock_movement_list(request):
     }
     
     return render(request, 'inventory/stock_movement_list.html', {
-        'movements': movements,
+        'movements': page['object_list'],
+        'page': page,
+        'next_query': next_query,
+        'previous_query': previous_query,
+        'filters': filters,
+        'filter_query': filter_query,
+        'warehouses': Warehouse.objects.all(),
         'sort_by': sort_by,
         'sort_directions': sort_directions,
     })
@@ -376,15 +391,9 @@ def stock_movement_batch_delete(request):
             messages.error(request, '未选择任何库存变动记录。')
             return redirect('inventory:stock_movement_list')
         
-        deleted_count = 0
-        
-        for movement_id in selected_ids:
-            try:
-                movement = StockMovement.objects.get(pk=movement_id)
-                movement.delete()
-                deleted_count += 1
-            except StockMovement.DoesNotExist:
-                pass
+        # 查询集删除在同一事务中同步维护库存余额和快照
+        _, deleted = StockMovement.objects.filter(pk__in=selected_pks(selected_ids)).delete()
+        deleted_count = deleted.get(StockMovement._meta.label, 0)
         
         if deleted_count > 0:
             messages.success(request, f'成功删除 {deleted_count} 条库存变动记录。')
@@ -393,7 +402,15 @@ def stock_movement_batch_delete(request):
 
 @login_required
 def dashboard(request):
-    """仪表盘视图"""
+    """仪表盘视图，数据按相关表的版本号缓存"""
+    context = cached_context('dashboard', {}, DASHBOARD_MODELS, dashboard_context)
+    return render(request, 'inventory/dashboard.html', context)
+
+# 仪表盘数据依赖的表（库存余额由库存变动维护）
+DASHBOARD_MODELS = (Product, Warehouse, StockMovement, IncomingStock)
+
+def dashboard_context():
+    """计算仪表盘数据"""
     # 获取产品总数
     total_products = Product.objects.count()
     
@@ -403,78 +420,133 @@ def dashboard(request):
     # 获取入库途中产品总数
     total_incoming_stock = IncomingStock.objects.filter(status='待入库').count()
     
-    # 获取所有产品的产品SKU列表（name字段）
-    all_product_skus = Product.objects.values_list('name', flat=True).distinct()
-    
-    # 获取低库存产品
-    low_stock_products = []
+    # 一次查询获取所有产品的总库存
+    stock_matrix = get_stock_matrix()
     
-    for product_sku in all_product_skus:
-        # 获取相同产品SKU的所有产品
-        sku_products = Product.objects.filter(name=product_sku)
-        
-        # 计算这些产品的总库存
-        total_stock = 0
-        for product in sku_products:
-            # 使用产品的total_stock属性计算库存
-            total_stock += product.total_stock
-        
-        # 获取第一个产品的库存阈值作为参考
-        if sku_products.exists():
-            reference_product = sku_products.first()
-            threshold = reference_product.low_stock_threshold
-            
-            # 如果总库存低于阈值，添加到低库存列表
-            if total_stock < threshold and threshold > 0:
-                low_stock_products.append({
-                    'id': reference_product.id,
-                    'sku': product_sku,  # 使用产品SKU（name字段）
-                    'current_stock': total_stock,
-                    'low_stock_threshold': threshold
-                })
+    # 按产品SKU（name字段）汇总相同产品SKU的所有产品库存，使用第一个产品的库存阈值作为参考
+    sku_stock = {}
+    for product in Product.objects.order_by('pk').values('id', 'name', 'low_stock_threshold'):
+        stock = stock_matrix.get(product['id'], {}).get('total', 0)
+        if product['name'] in sku_stock:
+            sku_stock[product['name']]['current_stock'] += stock
+        else:
+            sku_stock[product['name']] = {
+                'id': product['id'],
+                'sku': product['name'],  # 使用产品SKU（name字段）
+                'current_stock': stock,
+                'low_stock_threshold': product['low_stock_threshold']
+            }
+    
+    # 获取低库存产品：总库存低于阈值
+    low_stock_products = [
+        item for item in sku_stock.values()
+        if item['current_stock'] < item['low_stock_threshold'] and item['low_stock_threshold'] > 0
+    ]
     
     # 按库存量排序
     low_stock_products = sorted(low_stock_products, key=lambda x: x['current_stock'])
     
     # 获取各仓库的库存统计
     warehouses = Warehouse.objects.all()
+    warehouse_stock = dict(
+        StockBalance.objects.order_by().values('warehouse_id').annotate(
+            total=Sum('on_hand')
+        ).values_list('warehouse_id', 'total')
+    )
+    warehouse_incoming = dict(
+        IncomingStock.objects.filter(status='待入库').order_by().values('warehouse_id').annotate(
+            total=Sum('quantity')
+        ).values_list('warehouse_id', 'total')
+    )
     warehouse_stats = []
     
     for warehouse in warehouses:
-        # 计算该仓库的总库存数量
-        total_in = StockMovement.objects.filter(
-            warehouse=warehouse,
-            movement_type='IN'
-        ).aggregate(total=Sum('quantity'))['total'] or 0
-        
-        total_out = StockMovement.objects.filter(
-            warehouse=warehouse,
-            movement_type='OUT'
-        ).aggregate(total=Sum('quantity'))['total'] or 0
-        
-        total_stock = total_in - total_out
-        
-        # 计算该仓库的入库途中产品数量
-        incoming_count = IncomingStock.objects.filter(
-            warehouse=warehouse,
-            status='待入库'
-        ).aggregate(total=Sum('quantity'))['total'] or 0
-        
         warehouse_stats.append({
             'warehouse': warehouse,
-            'total_stock': total_stock,
-            'incoming_count': incoming_count
+            'total_stock': warehouse_stock.get(warehouse.id) or 0,
+            'incoming_count': warehouse_incoming.get(warehouse.id) or 0
         })
     
-    context = {
+    return {
         'total_products': total_products,
         'total_warehouses': total_warehouses,
         'total_incoming_stock': total_incoming_stock,
         'low_stock_products': low_stock_products,
         'warehouse_stats': warehouse_stats,
     }
-    
-    return render(request, 'inventory/dashboard.html', context)
+
+# 各导入类型完成后返回的列表页
+IMPORT_RETURN_URLS = {
+    'products': 'inventory:product_list',
+    'stock_movements': 'inventory:stock_movement_list',
+    'incoming_stock': 'inventory:incoming_stock_list',
+    'production_orders': 'inventory:production_order_list',
+}
+
+def enqueue_import(request, kind):
+    """保存上传的文件并创建导入任务，由后台进程处理，请求立即返回
+
+    勾选了“仅校验”时不创建任务，直接校验并返回错误报告。
+    """
+    if request.POST.get('dry_run'):
+        return dry_run_import(request, kind)
+    job = ImportJob.objects.create(kind=kind, file=request.FILES['file'], created_by=request.user)
+    messages.success(request, '文件已上传，导入任务已加入队列')
+    return redirect('inventory:import_job_detail', pk=job.pk)
+
+def dry_run_import(request, kind):
+    """完整校验导入文件但不写入数据，有问题时返回标注了行号和问题的报告文件"""
+    text_columns, import_rows = IMPORTERS[kind]
+    try:
+        df = read_import_file(request.FILES['file'], text_columns)
+        result = import_rows(df, dry_run=True)
+    except ImportFileError as e:
+        messages.error(request, str(e))
+        return redirect(request.path)
+    except Exception as e:
+        messages.error(request, f'文件处理出错: {str(e)}')
+        return redirect(request.path)
+    
+    if not result['errors'] and not result['warnings']:
+        messages.success(request, f'校验通过：共 {len(df)} 行，没有发现问题')
+        return redirect(request.path)
+    
+    report_format = 'csv' if request.POST.get('report_format') == 'csv' else 'xlsx'
+    headers = ['行号', '类型', '问题'] + [str(column) for column in df.columns]
+    return file_response(
+        report_format,
+        f'{kind}_validation_{datetime.now().strftime("%Y%m%d%H%M%S")}',
+        '校验结果', headers, validation_report_rows(df, result)
+    )
+
+@login_required
+def import_job_detail(request, pk):
+    """导入任务进度页面"""
+    job = get_object_or_404(ImportJob, pk=pk)
+    return render(request, 'inventory/import_job_detail.html', {
+        'job': job,
+        'return_url': IMPORT_RETURN_URLS[job.kind],
+    })
+
+@login_required
+def import_job_status(request, pk):
+    """导入任务进度（JSON），供进度页面轮询"""
+    job = get_object_or_404(ImportJob, pk=pk)
+    return JsonResponse({
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'finished': job.is_finished,
+        'total_rows': job.total_rows,
+        'processed_rows': job.processed_rows,
+        'progress': job.progress,
+        'rows_per_second': job.rows_per_second,
+        'success_count': job.success_count,
+        'error_count': job.error_count,
+        'errors': job.errors[:100],
+        'warnings': job.warnings[:100],
+        'summary': job.summary,
+    })
 
 @login_required
 def download_stock_movement_template(request):
@@ -517,96 +589,7 @@ def download_stock_movement_template(request):
 @login_required
 def import_stock_movements(request):
     if request.method == 'POST' and request.FILES.get('file'):
-        try:
-            excel_file = request.FILES['file']
-            df = pd.read_excel(excel_file)
-            
-            # 验证必要的列是否存在
-            required_columns = ['日期(YYYY-MM-DD)', '仓库代码', '店铺SKU', '数量', '类型(IN/OUT)']
-            for col in required_columns:
-                if col not in df.columns:
-                    messages.error(request, f'缺少必要的列: {col}')
-                    return redirect('inventory:stock_movement_list')
-            
-            success_count = 0
-            error_count = 0
-            error_messages = []
-            
-            for index, row in df.iterrows():
-                try:
-                    # 获取仓库
-                    try:
-                        warehouse = Warehouse.objects.get(code=row['仓库代码'])
-                    except Warehouse.DoesNotExist:
-                        error_messages.append(f'第{index+2}行: 仓库代码 {row["仓库代码"]} 不存在')
-                        error_count += 1
-                        continue
-                    
-                    # 获取产品
-                    try:
-                        product = Product.objects.get(sku=row['店铺SKU'])
-                    except Product.DoesNotExist:
-                        error_messages.append(f'第{index+2}行: 店铺SKU {row["店铺SKU"]} 不存在')
-                        error_count += 1
-                        continue
-                    
-                    # 验证并转换日期
-                    try:
-                        date = pd.to_datetime(row['日期(YYYY-MM-DD)']).date()
-                    except:
-                        error_messages.append(f'第{index+2}行: 日期格式错误')
-                        error_count += 1
-                        continue
-                    
-                    # 验证数量
-                    try:
-                        quantity = int(row['数量'])
-                        if quantity <= 0:
-                            raise ValueError
-                    except:
-                        error_messages.append(f'第{index+2}行: 数量必须为正整数')
-                        error_count += 1
-                        continue
-                    
-                    # 验证类型
-                    movement_type = str(row['类型(IN/OUT)']).strip().upper()
-                    if movement_type not in ['IN', 'OUT']:
-                        error_messages.append(f'第{index+2}行: 类型必须为 IN 或 OUT')
-                        error_count += 1
-                        continue
-                    
-                    # 获取备注
-                    notes = str(row.get('备注(可选)', '')) if pd.notna(row.get('备注(可选)', '')) else ''
-                    
-                    # 创建库存变动记录
-                    StockMovement.objects.create(
-                        warehouse=warehouse,
-                        product=product,
-                        date=date,
-                        quantity=quantity,
-                        movement_type=movement_type,
-                        notes=notes
-                    )
-                    success_count += 1
-                    
-                except Exception as e:
-                    error_messages.append(f'第{index+2}行: 处理出错 - {str(e)}')
-                    error_count += 1
-            
-            # 显示导入结果
-            if success_count > 0:
-                messages.success(request, f'成功导入 {success_count} 条记录')
-            if error_count > 0:
-                messages.error(request, f'导入失败 {error_count} 条记录')
-                for msg in error_messages[:5]:  # 只显示前5条错误信息
-                    messages.warning(request, msg)
-                if len(error_messages) > 5:
-                    messages.warning(request, '...')
-            
-        except Exception as e:
-            messages.error(request, f'文件处理出错: {str(e)}')
-        
-        return redirect('inventory:stock_movement_list')
+        return enqueue_import(request, 'stock_movements')
     
     return render(request, 'inventory/stock_movement_import.html')
 
@@ -654,246 +637,51 @@ def download_product_template(request):
 @login_required
 def import_products(request):
     if request.method == 'POST' and request.FILES.get('file'):
-        try:
-            excel_file = request.FILES['file']
-            df = pd.read_excel(excel_file)
-            
-            # 打印列名，用于调试
-            print("Excel文件列名:", df.columns.tolist())
-            
-            # 验证必要的列是否存在
-            required_columns = ['店铺SKU', '重量(lb)', '长度(inch)', '宽度(inch)', '高度(inch)']
-            for col in required_columns:
-                if col not in df.columns:
-                    messages.error(request, f'缺少必要的列: {col}')
-                    return redirect('inventory:product_list')
-            
-            # 获取仓库
-            atlanta_warehouse = Warehouse.objects.get(code='GA')
-            california_warehouse = Warehouse.objects.get(code='CA')
-            
-            success_count = 0
-            error_count = 0
-            error_messages = []
-            stock_added_count = 0
-            
-            for index, row in df.iterrows():
-                try:
-                    # 打印当前行数据，用于调试
-                    print(f"处理第{index+2}行: {dict(row)}")
-                    
-                    # 验证店铺SKU
-                    sku = str(row['店铺SKU']).strip()
-                    if not sku:
-                        error_messages.append(f'第{index+2}行: 店铺SKU不能为空')
-                        error_count += 1
-                        continue
-                    
-                    # 检查店铺SKU是否已存在
-                    existing_product = Product.objects.filter(sku=sku).first()
-                    
-                    # 获取产品SKU（如果存在）
-                    product_sku = str(row.get('产品SKU', '')) if pd.notna(row.get('产品SKU', '')) else sku
-                    
-                    # 获取系列和季节（如果存在）
-                    series = str(row.get('系列', '')) if pd.notna(row.get('系列', '')) else ''
-                    season = str(row.get('季节', '')) if pd.notna(row.get('季节', '')) else ''
-                    
-                    # 验证数值字段
-                    try:
-                        weight = float(row['重量(lb)'])
-                        length = float(row['长度(inch)'])
-                        width = float(row['宽度(inch)'])
-                        height = float(row['高度(inch)'])
-                        
-                        if weight <= 0 or length <= 0 or width <= 0 or height <= 0:
-                            error_messages.append(f'第{index+2}行: 重量和尺寸必须为正数')
-                            error_count += 1
-                            continue
-                    except:
-                        error_messages.append(f'第{index+2}行: 重量和尺寸必须为数字')
-                        error_count += 1
-                        continue
-                    
-                    # 获取FNSKU（可选）
-                    fnsku = str(row.get('FNSKU', '')) if pd.notna(row.get('FNSKU', '')) else ''
-                    
-                    # 获取库存数量（可选）
-                    atlanta_stock = 0
-                    california_stock = 0
-                    
-                    # 检查亚特兰大仓库存列是否存在
-                    if '亚特兰大仓库存' in df.columns:
-                        try:
-                            if pd.notna(row['亚特兰大仓库存']):
-                                atlanta_stock = int(float(row['亚特兰大仓库存']))
-                                print(f"亚特兰大仓库存: {atlanta_stock}")
-                                if atlanta_stock < 0:
-                                    error_messages.append(f'第{index+2}行: 亚特兰大仓库存不能为负数')
-                                    atlanta_stock = 0
-                        except (ValueError, TypeError) as e:
-                            print(f"亚特兰大仓库存转换错误: {e}")
-                            error_messages.append(f'第{index+2}行: 亚特兰大仓库存必须为整数')
-                            atlanta_stock = 0
-                    else:
-                        print("Excel文件中没有'亚特兰大仓库存'列")
-                    
-                    # 检查加州仓库存列是否存在
-                    if '加州仓库存' in df.columns:
-                        try:
-                            if pd.notna(row['加州仓库存']):
-                                california_stock = int(float(row['加州仓库存']))
-                                print(f"加州仓库存: {california_stock}")
-                                if california_stock < 0:
-                                    error_messages.append(f'第{index+2}行: 加州仓库存不能为负数')
-                                    california_stock = 0
-                        except (ValueError, TypeError) as e:
-                            print(f"加州仓库存转换错误: {e}")
-                            error_messages.append(f'第{index+2}行: 加州仓库存必须为整数')
-                            california_stock = 0
-                    else:
-                        print("Excel文件中没有'加州仓库存'列")
-                    
-                    # 创建或更新产品
-                    if existing_product:
-                        existing_product.fnsku = fnsku
-                        existing_product.name = product_sku
-                        existing_product.series = series
-                        existing_product.season = season
-                        existing_product.weight = weight
-                        existing_product.length = length
-                        existing_product.width = width
-                        existing_product.height = height
-                        existing_product.save()
-                        product = existing_product
-                        print(f"更新产品: {product.sku} (ID: {product.id})")
-                    else:
-                        product = Product.objects.create(
-                            sku=sku,
-                            fnsku=fnsku,
-                            name=product_sku,  # 使用产品SKU作为产品名称
-                            series=series,
-                            season=season,
-                            weight=weight,
-                            length=length,
-                            width=width,
-                            height=height
-                        )
-                        print(f"创建产品: {product.sku} (ID: {product.id})")
-                    
-                    # 处理库存数据
-                    today = timezone.now().date()
-                    
-                    # 亚特兰大仓库库存
-                    if atlanta_stock > 0:
-                        stock_movement = StockMovement.objects.create(
-                            product=product,
-                            warehouse=atlanta_warehouse,
-                            movement_type='IN',
-                            quantity=atlanta_stock,
-                            date=today,
-                            notes='导入初始库存'
-                        )
-                        print(f"创建亚特兰大库存变动记录: ID={stock_movement.id}, 产品={product.sku}, 仓库={atlanta_warehouse.name}, 数量={atlanta_stock}")
-                        stock_added_count += 1
-                        messages.info(request, f'产品 {product.sku} 已添加 {atlanta_stock} 件库存到亚特兰大仓库')
-                    
-                    # 加州仓库库存
-                    if california_stock > 0:
-                        stock_movement = StockMovement.objects.create(
-                            product=product,
-                            warehouse=california_warehouse,
-                            movement_type='IN',
-                            quantity=california_stock,
-                            date=today,
-                            notes='导入初始库存'
-                        )
-                        print(f"创建加州库存变动记录: ID={stock_movement.id}, 产品={product.sku}, 仓库={california_warehouse.name}, 数量={california_stock}")
-                        stock_added_count += 1
-                        messages.info(request, f'产品 {product.sku} 已添加 {california_stock} 件库存到加州仓库')
-                    
-                    success_count += 1
-                    
-                except Exception as e:
-                    print(f"处理第{index+2}行时出错: {str(e)}")
-                    error_messages.append(f'第{index+2}行: 处理出错 - {str(e)}')
-                    error_count += 1
-            
-            # 显示导入结果
-            if success_count > 0:
-                messages.success(request, f'成功导入 {success_count} 条产品记录')
-            if stock_added_count > 0:
-                messages.success(request, f'成功添加 {stock_added_count} 条库存记录')
-            if error_count > 0:
-                messages.error(request, f'导入失败 {error_count} 条记录')
-                for msg in error_messages[:5]:  # 只显示前5条错误信息
-                    messages.warning(request, msg)
-                if len(error_messages) > 5:
-                    messages.warning(request, '...')
-            
-        except Exception as e:
-            print(f"文件处理出错: {str(e)}")
-            messages.error(request, f'文件处理出错: {str(e)}')
-        
-        return redirect('inventory:product_list')
+        return enqueue_import(request, 'products')
     
     return render(request, 'inventory/product_import.html')
 
+# 导出依赖的表；数据没有变化时脚本轮询得到304，不重新生成文件
+EXPORT_PRODUCTS_MODELS = (Product, Warehouse, StockMovement)
+
 @login_required
+@condition(etag_func=data_etag('export_products', EXPORT_PRODUCTS_MODELS),
+           last_modified_func=data_last_modified(EXPORT_PRODUCTS_MODELS))
 def export_products(request):
-    # 创建一个新的工作簿
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "产品列表"
-    
     # 获取仓库
     atlanta_warehouse = Warehouse.objects.get(code='GA')
     california_warehouse = Warehouse.objects.get(code='CA')
     
     # 设置表头 - 确保与导入模板一致
     headers = ['店铺SKU', 'FNSKU', '产品SKU', '系列', '季节', '重量(lb)', '长度(inch)', '宽度(inch)', '高度(inch)', '亚特兰大仓库存', '加州仓库存', '总库存(参考)']
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col)
-        cell.value = header
-        cell.font = Font(bold=True)
-        cell.fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
-    
-    # 添加产品数据
-    products = Product.objects.all()
-    for row, product in enumerate(products, 2):
-        # 获取各仓库库存
-        atlanta_stock = product.get_stock_by_warehouse(atlanta_warehouse)
-        california_stock = product.get_stock_by_warehouse(california_warehouse)
-        total_stock = product.total_stock
-        
-        ws.cell(row=row, column=1, value=product.sku)
-        ws.cell(row=row, column=2, value=product.fnsku)
-        ws.cell(row=row, column=3, value=product.name)
-        ws.cell(row=row, column=4, value=product.series)
-        ws.cell(row=row, column=5, value=product.season)
-        ws.cell(row=row, column=6, value=float(product.weight))
-        ws.cell(row=row, column=7, value=float(product.length))
-        ws.cell(row=row, column=8, value=float(product.width))
-        ws.cell(row=row, column=9, value=float(product.height))
-        ws.cell(row=row, column=10, value=atlanta_stock)
-        ws.cell(row=row, column=11, value=california_stock)
-        ws.cell(row=row, column=12, value=total_stock)
     
-    # 设置列宽
-    for col in range(1, len(headers) + 1):
-        ws.column_dimensions[openpyxl.utils.get_column_letter(col)].width = 15
-    
-    # 保存到内存中
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    
-    # 返回文件
-    response = HttpResponse(buffer.read(), content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename=products_{}.xlsx'.format(datetime.now().strftime('%Y%m%d%H%M%S'))
-    return response
+    stock_matrix = get_stock_matrix()
+    empty_stock = {}
+    
+    def rows():
+        products = iter_rows(Product.objects.all(), 'id', 'sku', 'fnsku', 'name', 'series', 'season',
+                             'weight', 'length', 'width', 'height')
+        for product_id, sku, fnsku, name, series, season, weight, length, width, height in products:
+            # 获取各仓库库存
+            stock = stock_matrix.get(product_id, empty_stock)
+            yield [
+                sku, fnsku, name, series, season,
+                float(weight), float(length), float(width), float(height),
+                stock.get(atlanta_warehouse.id, 0),
+                stock.get(california_warehouse.id, 0),
+                stock.get('total', 0),
+            ]
+    
+    return export_response(
+        request, 'products_{}'.format(datetime.now().strftime('%Y%m%d%H%M%S')),
+        "产品列表", headers, rows(), column_types=['string'] * 5 + ['float64'] * 4 + ['int64'] * 3, column_width=15
+    )
+
+# 历史库存依赖的表（快照由库存变动维护）
+HISTORICAL_STOCK_MODELS = (Product, Warehouse, StockMovement)
 
 @login_required
+@condition(etag_func=data_etag('historical_stock', HISTORICAL_STOCK_MODELS, per_user=True))
 def historical_stock(request):
     """历史库存查询视图"""
     products = Product.objects.all()
@@ -909,44 +697,15 @@ def historical_stock(request):
         except ValueError:
             messages.error(request, '日期格式错误，请使用YYYY-MM-DD格式')
     
-    # 计算历史库存
-    product_warehouse_stock = {}
-    for product in products:
-        product_warehouse_stock[product.id] = {}
-        for warehouse in warehouses:
-            # 计算截至所选日期的库存
-            total_in = StockMovement.objects.filter(
-                product=product,
-                warehouse=warehouse,
-                movement_type='IN',
-                date__lte=selected_date
-            ).aggregate(total=Sum('quantity'))['total'] or 0
-
-            total_out = StockMovement.objects.filter(
-                product=product,
-                warehouse=warehouse,
-                movement_type='OUT',
-                date__lte=selected_date
-            ).aggregate(total=Sum('quantity'))['total'] or 0
-
-            product_warehouse_stock[product.id][warehouse.id] = total_in - total_out
-    
-    # 计算每个产品的总库存
-    product_total_stock = {}
-    for product in products:
-        total_in = StockMovement.objects.filter(
-            product=product,
-            movement_type='IN',
-            date__lte=selected_date
-        ).aggregate(total=Sum('quantity'))['total'] or 0
-
-        total_out = StockMovement.objects.filter(
-            product=product,
-            movement_type='OUT',
-            date__lte=selected_date
-        ).aggregate(total=Sum('quantity'))['total'] or 0
-
-        product_total_stock[product.id] = total_in - total_out
+    # 读取最近的库存快照并加上之后的库存变动，计算截至所选日期的历史库存
+    product_warehouse_stock = get_stock_matrix(
+        [product.id for product in products],
+        [warehouse.id for warehouse in warehouses],
+        as_of=selected_date
+    )
+    
+    # 每个产品的总库存
+    product_total_stock = {product_id: stock['total'] for product_id, stock in product_warehouse_stock.items()}
     
     # 生成日期选择器的日期范围
     # 获取最早的库存记录日期
@@ -990,8 +749,8 @@ def incoming_stock_list(request):
     if sort_by not in valid_sort_fields:
         sort_by = '-expected_arrival_date'  # 如果排序字段无效，回退到默认排序
     
-    # 应用排序
-    incoming_stock_list = IncomingStock.objects.all().order_by(sort_by)
+    # 应用排序，一次查询取出产品和仓库
+    incoming_stock_list = IncomingStock.objects.select_related('product', 'warehouse').order_by(sort_by)
     
     return render(request, 'inventory/incoming_stock_list.html', {
         'incoming_stock_list': incoming_stock_list,
@@ -1035,8 +794,8 @@ def incoming_stock_create(request):
             # 自动扣减生产订单数量
             print(f"状态为待入库，准备扣减生产订单数量")
             try:
-                # 使用通用的adjust_production_orders函数扣减生产订单数量
-                orders_updated = adjust_production_orders(incoming_stock.product, incoming_stock.quantity)
+                # 按先进先出扣减生产订单数量，并记录分配明细
+                orders_updated = allocate_incoming_stock([incoming_stock])
                 print(f"扣减生产订单数量完成，更新了{orders_updated}个订单")
                 
                 if orders_updated > 0:
@@ -1056,12 +815,19 @@ def incoming_stock_create(request):
     
     return render(request, 'inventory/incoming_stock_form.html', {'form': form})
 
+def mark_allocation_tracked(incoming_stock):
+    """历史记录重新扣减全部数量后，其分配明细已完整"""
+    if not incoming_stock.allocation_tracked:
+        incoming_stock.allocation_tracked = True
+        incoming_stock.save(update_fields=['allocation_tracked'])
+
 @login_required
 def incoming_stock_edit(request, pk):
     """编辑入库途中产品记录并自动调整生产订单数量"""
     incoming_stock = get_object_or_404(IncomingStock, pk=pk)
     original_quantity = incoming_stock.quantity
     original_status = incoming_stock.status
+    original_product_id = incoming_stock.product_id
     
     if request.method == 'POST':
         form = IncomingStockForm(request.POST, instance=incoming_stock)
@@ -1074,21 +840,44 @@ def incoming_stock_edit(request, pk):
             updated_incoming_stock = form.save()
             
             try:
-                # 处理生产订单数量调整
+                # 处理生产订单数量调整：扣减按先进先出并记录明细，恢复按该记录的分配明细
                 quantity_diff = 0
+                orders_updated = 0
                 
                 # 如果原状态是非待入库，新状态是待入库，需要扣减生产订单
                 if original_status != '待入库' and new_status == '待入库':
                     quantity_diff = new_quantity
+                    orders_updated = allocate_incoming_stock([updated_incoming_stock])
+                    mark_allocation_tracked(updated_incoming_stock)
                 # 如果原状态是待入库，新状态是非待入库，需要增加生产订单
                 elif original_status == '待入库' and new_status != '待入库':
                     quantity_diff = -original_quantity
+                    orders_updated = release_incoming_stock(
+                        [updated_incoming_stock], {updated_incoming_stock.pk: original_quantity}
+                    )
+                # 如果状态都是待入库但产品有变化，先恢复原产品的订单，再扣减新产品的订单
+                elif original_status == '待入库' and new_status == '待入库' and original_product_id != updated_incoming_stock.product_id:
+                    quantity_diff = new_quantity
+                    original_incoming_stock = IncomingStock(
+                        pk=updated_incoming_stock.pk, product_id=original_product_id, quantity=original_quantity,
+                        allocation_tracked=updated_incoming_stock.allocation_tracked
+                    )
+                    release_incoming_stock([original_incoming_stock])
+                    orders_updated = allocate_incoming_stock([updated_incoming_stock])
+                    mark_allocation_tracked(updated_incoming_stock)
                 # 如果状态都是待入库，但数量有变化，需要调整差额
                 elif original_status == '待入库' and new_status == '待入库' and original_quantity != new_quantity:
                     quantity_diff = new_quantity - original_quantity
+                    if quantity_diff > 0:
+                        orders_updated = allocate_incoming_stock(
+                            [updated_incoming_stock], {updated_incoming_stock.pk: quantity_diff}
+                        )
+                    else:
+                        orders_updated = release_incoming_stock(
+                            [updated_incoming_stock], {updated_incoming_stock.pk: -quantity_diff}
+                        )
                 
                 if quantity_diff != 0:
-                    orders_updated = adjust_production_orders(updated_incoming_stock.product, quantity_diff)
                     if orders_updated > 0:
                         if quantity_diff > 0:
                             messages.success(request, f'入库途中产品记录更新成功，并扣减了 {orders_updated} 个生产订单的数量。')
@@ -1107,70 +896,6 @@ def incoming_stock_edit(request, pk):
     
     return render(request, 'inventory/incoming_stock_form.html', {'form': form})
 
-def adjust_production_orders(product, quantity_diff):
-    """调整生产订单数量
-    
-    参数:
-        product: 产品对象
-        quantity_diff: 数量差异，正数表示扣减，负数表示增加
-    
-    返回:
-        更新的订单数量
-    """
-    print(f"调用adjust_production_orders: 产品={product.sku}, 数量差异={quantity_diff}")
-    orders_updated = 0
-    
-    if quantity_diff > 0:
-        # 扣减生产订单数量
-        # 获取该产品的所有生产订单，按创建时间排序（先处理早期订单）
-        production_orders = ProductionOrder.objects.filter(
-            product=product,
-            remaining_quantity__gt=0
-        ).order_by('created_at')
-        
-        print(f"找到{production_orders.count()}个有剩余数量的生产订单")
-        
-        deducted_quantity = quantity_diff
-        for order in production_orders:
-            if deducted_quantity <= 0:
-                break
-            
-            # 计算可以从当前订单扣减的数量
-            deduct_from_order = min(deducted_quantity, order.remaining_quantity)
-            
-            if deduct_from_order > 0:
-                print(f"从订单{order.order_number}扣减{deduct_from_order}，原剩余数量={order.remaining_quantity}")
-                # 更新订单剩余数量
-                order.remaining_quantity -= deduct_from_order
-                order.save()
-                print(f"订单{order.order_number}更新后剩余数量={order.remaining_quantity}")
-                deducted_quantity -= deduct_from_order
-                orders_updated += 1
-    
-    elif quantity_diff < 0:
-        # 增加生产订单数量（恢复）
-        # 获取该产品的所有生产订单，按创建时间倒序排序（先处理最近的订单）
-        production_orders = ProductionOrder.objects.filter(
-            product=product
-        ).order_by('-created_at')
-        
-        add_quantity = -quantity_diff  # 转为正数
-        for order in production_orders:
-            if add_quantity <= 0:
-                break
-            
-            # 计算可以恢复到当前订单的数量（不超过原始订单数量）
-            add_to_order = min(add_quantity, order.quantity - order.remaining_quantity)
-            
-            if add_to_order > 0:
-                # 更新订单剩余数量
-                order.remaining_quantity += add_to_order
-                order.save()
-                add_quantity -= add_to_order
-                orders_updated += 1
-    
-    return orders_updated
-
 @login_required
 def incoming_stock_delete(request, pk):
     """删除入库途中产品记录并恢复生产订单数量"""
@@ -1180,8 +905,8 @@ def incoming_stock_delete(request, pk):
         # 如果是待入库状态，需要恢复生产订单数量
         if incoming_stock.status == '待入库':
             try:
-                # 恢复生产订单数量（传入负数表示增加）
-                orders_updated = adjust_production_orders(incoming_stock.product, -incoming_stock.quantity)
+                # 按分配明细恢复生产订单数量
+                orders_updated = release_incoming_stock([incoming_stock])
                 
                 # 删除入库途中产品记录
                 incoming_stock.delete()
@@ -1213,33 +938,26 @@ def incoming_stock_batch_delete(request):
             messages.error(request, '未选择任何入库途中产品记录。')
             return redirect('inventory:incoming_stock_list')
         
-        deleted_count = 0
-        error_count = 0
-        
-        for item_id in selected_ids:
-            try:
-                item = IncomingStock.objects.get(pk=item_id)
-                item_status = item.status
-                item_sku = item.product.sku if item.product else "未知产品"
-                item_warehouse = item.warehouse.code if item.warehouse else "未知仓库"
-                
-                item.delete()
-                deleted_count += 1
-                print(f"成功删除入库途中产品记录 ID={item_id}, 产品={item_sku}, 仓库={item_warehouse}, 状态={item_status}")
-            except IncomingStock.DoesNotExist:
-                error_count += 1
-                print(f"入库途中产品记录不存在 ID={item_id}")
-            except Exception as e:
-                error_count += 1
-                print(f"删除入库途中产品记录时出错 ID={item_id}, 错误: {str(e)}")
+        try:
+            # 待入库的记录先按分配明细恢复生产订单数量，再一次删除所有选中的记录
+            deleted_count, orders_updated_count = delete_incoming_stock(
+                IncomingStock.objects.filter(pk__in=selected_pks(selected_ids))
+            )
+        except Exception as e:
+            messages.error(request, f'批量删除入库途中产品记录时出错: {str(e)}')
+            return redirect('inventory:incoming_stock_list')
+        missing_count = len(selected_pks(selected_ids)) - deleted_count
         
         if deleted_count > 0:
-            messages.success(request, f'成功删除 {deleted_count} 条入库途中产品记录。')
+            if orders_updated_count > 0:
+                messages.success(request, f'成功删除 {deleted_count} 条入库途中产品记录，并恢复了 {orders_updated_count} 个生产订单的数量。')
+            else:
+                messages.success(request, f'成功删除 {deleted_count} 条入库途中产品记录。')
         else:
             messages.warning(request, '没有删除任何入库途中产品记录。')
             
-        if error_count > 0:
-            messages.warning(request, f'有 {error_count} 条记录删除失败，请查看日志了解详情。')
+        if missing_count > 0:
+            messages.warning(request, f'有 {missing_count} 条记录不存在或已被删除。')
         
         return redirect('inventory:incoming_stock_list')
     
@@ -1281,68 +999,39 @@ def incoming_stock_approve(request, pk):
     
     return render(request, 'inventory/incoming_stock_confirm_approve.html', {'incoming_stock': incoming_stock})
 
+def approve_selected_incoming_stock(request, selected_ids):
+    """在一个事务中确认所有选中的待入库记录，并添加结果消息"""
+    selected = selected_pks(selected_ids)
+    try:
+        approved_count = approve_incoming_stock(selected)
+    except ApprovalConflict as e:
+        messages.error(request, str(e))
+        return
+    except Exception as e:
+        messages.error(request, f'批量确认入库时出错: {str(e)}')
+        return
+    skipped_count = len(selected) - approved_count
+    
+    if approved_count > 0:
+        messages.success(request, f'成功确认入库 {approved_count} 条入库途中产品记录。')
+    else:
+        messages.warning(request, '没有确认入库任何入库途中产品记录。')
+    
+    if skipped_count > 0:
+        messages.info(request, f'跳过了 {skipped_count} 条非待入库状态或不存在的记录。')
+
 @login_required
 def incoming_stock_batch_approve(request):
     """批量确认入库途中产品"""
     if request.method == 'POST':
         selected_ids = request.POST.getlist('selected_items')
-        print(f"接收到批量确认入库请求，选中的ID: {selected_ids}")
+        print(f"接收到批量确认入库请求，选中 {len(selected_ids)} 条记录")
         
         if not selected_ids:
             messages.error(request, '未选择任何入库途中产品记录。')
             return redirect('inventory:incoming_stock_list')
         
-        approved_count = 0
-        skipped_count = 0
-        error_count = 0
-        
-        for item_id in selected_ids:
-            try:
-                incoming_stock = IncomingStock.objects.get(pk=item_id)
-                
-                # 只处理待入库状态的记录
-                if incoming_stock.status != '待入库':
-                    print(f"跳过非待入库状态的记录 ID={item_id}, 产品={incoming_stock.product.sku}, 仓库={incoming_stock.warehouse.code}, 状态={incoming_stock.status}")
-                    skipped_count += 1
-                    continue
-                
-                # 创建库存变动记录
-                movement = StockMovement.objects.create(
-                    product=incoming_stock.product,
-                    warehouse=incoming_stock.warehouse,
-                    movement_type='IN',
-                    quantity=incoming_stock.quantity,
-                    date=timezone.now().date(),
-                    notes=f'由入库途中记录批量转入：{incoming_stock.notes}'
-                )
-                
-                print(f"创建库存变动记录 ID={movement.id}, 产品={incoming_stock.product.sku}, 仓库={incoming_stock.warehouse.code}, 数量={incoming_stock.quantity}")
-                
-                # 更新入库途中记录状态
-                incoming_stock.status = '已入库'
-                incoming_stock.save()
-                
-                # 不再扣减生产订单剩余数量，因为这个扣减已经在创建入库途中产品时完成
-                
-                approved_count += 1
-                print(f"成功确认入库记录 ID={item_id}, 产品={incoming_stock.product.sku}, 仓库={incoming_stock.warehouse.code}")
-            except IncomingStock.DoesNotExist:
-                error_count += 1
-                print(f"入库途中产品记录不存在 ID={item_id}")
-            except Exception as e:
-                error_count += 1
-                print(f"确认入库途中产品记录时出错 ID={item_id}, 错误: {str(e)}")
-        
-        if approved_count > 0:
-            messages.success(request, f'成功确认入库 {approved_count} 条入库途中产品记录。')
-        else:
-            messages.warning(request, '没有确认入库任何入库途中产品记录。')
-        
-        if skipped_count > 0:
-            messages.info(request, f'跳过了 {skipped_count} 条非待入库状态的记录。')
-            
-        if error_count > 0:
-            messages.warning(request, f'有 {error_count} 条记录处理失败，请查看日志了解详情。')
+        approve_selected_incoming_stock(request, selected_ids)
         
         return redirect('inventory:incoming_stock_list')
     
@@ -1391,204 +1080,71 @@ def download_incoming_stock_template(request):
 def import_incoming_stock(request):
     """导入入库途中产品数据"""
     if request.method == 'POST' and request.FILES.get('file'):
-        try:
-            excel_file = request.FILES['file']
-            df = pd.read_excel(excel_file)
-            
-            # 验证必要的列是否存在
-            required_columns = ['店铺SKU', '仓库代码', '数量', '预计入仓时间(YYYY-MM-DD)']
-            for col in required_columns:
-                if col not in df.columns:
-                    messages.error(request, f'缺少必要的列: {col}')
-                    return redirect('inventory:incoming_stock_list')
-            
-            success_count = 0
-            error_count = 0
-            error_messages = []
-            
-            for index, row in df.iterrows():
-                try:
-                    # 获取产品
-                    try:
-                        product = Product.objects.get(sku=row['店铺SKU'])
-                    except Product.DoesNotExist:
-                        error_messages.append(f'第{index+2}行: 店铺SKU {row["店铺SKU"]} 不存在')
-                        error_count += 1
-                        continue
-                    
-                    # 获取仓库
-                    try:
-                        warehouse = Warehouse.objects.get(code=row['仓库代码'])
-                    except Warehouse.DoesNotExist:
-                        error_messages.append(f'第{index+2}行: 仓库代码 {row["仓库代码"]} 不存在')
-                        error_count += 1
-                        continue
-                    
-                    # 验证数量
-                    try:
-                        quantity = int(row['数量'])
-                        if quantity <= 0:
-                            error_messages.append(f'第{index+2}行: 数量必须为正整数')
-                            error_count += 1
-                            continue
-                    except:
-                        error_messages.append(f'第{index+2}行: 数量必须为整数')
-                        error_count += 1
-                        continue
-                    
-                    # 验证并转换日期
-                    try:
-                        expected_arrival_date = pd.to_datetime(row['预计入仓时间(YYYY-MM-DD)']).date()
-                    except:
-                        error_messages.append(f'第{index+2}行: 预计入仓时间格式错误')
-                        error_count += 1
-                        continue
-                    
-                    # 获取备注（可选）
-                    notes = str(row.get('备注(可选)', '')) if pd.notna(row.get('备注(可选)', '')) else ''
-                    
-                    # 创建入库途中记录
-                    incoming_stock = IncomingStock.objects.create(
-                        product=product,
-                        warehouse=warehouse,
-                        quantity=quantity,
-                        expected_arrival_date=expected_arrival_date,
-                        notes=notes
-                    )
-                    
-                    # 检查是否有相应的生产订单并扣减剩余数量
-                    production_orders = ProductionOrder.objects.filter(
-                        product=product,
-                        remaining_quantity__gt=0
-                    )
-                    
-                    if production_orders.exists():
-                        try:
-                            # 使用通用的adjust_production_orders函数扣减生产订单数量
-                            orders_updated = adjust_production_orders(product, quantity)
-                            print(f"导入记录 {index+2}: 扣减生产订单数量完成，更新了{orders_updated}个订单")
-                        except Exception as e:
-                            print(f"导入记录 {index+2}: 扣减生产订单数量时出错: {str(e)}")
-                            error_messages.append(f'第{index+2}行: 扣减生产订单数量时出错 - {str(e)}')
-                    else:
-                        print(f"导入记录 {index+2}: 产品{product.sku}没有可用的生产订单，无法扣减剩余数量")
-                    
-                    success_count += 1
-                    
-                except Exception as e:
-                    error_count += 1
-                    error_messages.append(f'第{index+2}行: 处理时出错 - {str(e)}')
-                    print(f"导入入库途中产品记录时出错: {str(e)}")
-            
-            if success_count > 0:
-                messages.success(request, f'成功导入 {success_count} 条入库途中产品记录。')
-            
-            if error_count > 0:
-                messages.warning(request, f'导入过程中有 {error_count} 条记录出错。')
-                for error in error_messages[:10]:  # 只显示前10条错误信息
-                    messages.warning(request, error)
-                if len(error_messages) > 10:
-                    messages.warning(request, f'... 还有 {len(error_messages) - 10} 条错误信息未显示')
-            
-            return redirect('inventory:incoming_stock_list')
-            
-        except Exception as e:
-            messages.error(request, f'导入文件时出错: {str(e)}')
-            return redirect('inventory:incoming_stock_list')
+        return enqueue_import(request, 'incoming_stock')
     
     return render(request, 'inventory/incoming_stock_import.html')
 
+EXPORT_INCOMING_STOCK_MODELS = (IncomingStock, Product, Warehouse)
+
 @login_required
+@condition(etag_func=data_etag('export_incoming_stock', EXPORT_INCOMING_STOCK_MODELS),
+           last_modified_func=data_last_modified(EXPORT_INCOMING_STOCK_MODELS))
 def export_incoming_stock(request):
     """导出入库途中产品数据"""
-    # 创建一个新的工作簿
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "入库途中产品"
-    
     # 设置表头
     headers = ['店铺SKU', '产品SKU', '仓库', '仓库代码', '数量', '预计入仓时间', '状态', '备注', '创建时间']
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num)
-        cell.value = header
-        cell.font = Font(bold=True)
-        cell.fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
-    
-    # 添加数据
-    incoming_stocks = IncomingStock.objects.all()
-    for row_num, item in enumerate(incoming_stocks, 2):
-        ws.cell(row=row_num, column=1, value=item.product.sku)
-        ws.cell(row=row_num, column=2, value=item.product.name)
-        ws.cell(row=row_num, column=3, value=item.warehouse.name)
-        ws.cell(row=row_num, column=4, value=item.warehouse.code)
-        ws.cell(row=row_num, column=5, value=item.quantity)
-        ws.cell(row=row_num, column=6, value=item.expected_arrival_date.strftime('%Y-%m-%d'))
-        ws.cell(row=row_num, column=7, value=item.status)
-        ws.cell(row=row_num, column=8, value=item.notes)
-        ws.cell(row=row_num, column=9, value=item.created_at.strftime('%Y-%m-%d %H:%M:%S'))
-    
-    # 设置列宽
-    for col_num in range(1, len(headers) + 1):
-        ws.column_dimensions[openpyxl.utils.get_column_letter(col_num)].width = 20
     
-    # 保存到内存中
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    
-    # 返回文件
-    response = HttpResponse(
-        buffer.getvalue(),
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    def rows():
+        incoming_stocks = iter_rows(
+            IncomingStock.objects.all(),
+            'product__sku', 'product__name', 'warehouse__name', 'warehouse__code',
+            'quantity', 'expected_arrival_date', 'status', 'notes', 'created_at'
+        )
+        for sku, name, warehouse_name, warehouse_code, quantity, arrival_date, status, notes, created_at in incoming_stocks:
+            yield [
+                sku, name, warehouse_name, warehouse_code, quantity,
+                arrival_date.strftime('%Y-%m-%d'), status, notes,
+                created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            ]
+    
+    return export_response(
+        request, 'incoming_stock_{}'.format(datetime.now().strftime('%Y%m%d%H%M%S')),
+        "入库途中产品", headers, rows(), column_types=['string'] * 4 + ['int64'] + ['string'] * 4
     )
-    response['Content-Disposition'] = 'attachment; filename=incoming_stock_{}.xlsx'.format(datetime.now().strftime('%Y%m%d%H%M%S'))
-    return response
+
+EXPORT_STOCK_MOVEMENTS_MODELS = (StockMovement, Product, Warehouse)
 
 @login_required
+@condition(etag_func=data_etag('export_stock_movements', EXPORT_STOCK_MOVEMENTS_MODELS),
+           last_modified_func=data_last_modified(EXPORT_STOCK_MOVEMENTS_MODELS))
 def export_stock_movements(request):
     """导出库存变动数据"""
-    # 创建一个新的工作簿
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "库存变动"
-    
     # 设置表头
     headers = ['日期', '产品SKU', '产品名称', '仓库', '类型', '数量', '备注', '创建时间']
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col)
-        cell.value = header
-        cell.font = Font(bold=True)
-        cell.fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
     
-    # 获取所有库存变动记录
-    stock_movements = StockMovement.objects.all().order_by('-date', '-created_at')
-    
-    # 添加数据
-    for row, movement in enumerate(stock_movements, 2):
-        ws.cell(row=row, column=1, value=movement.date.strftime('%Y-%m-%d'))
-        ws.cell(row=row, column=2, value=movement.product.sku)
-        ws.cell(row=row, column=3, value=movement.product.name)
-        ws.cell(row=row, column=4, value=f"{movement.warehouse.name} ({movement.warehouse.code})")
-        ws.cell(row=row, column=5, value='入库' if movement.movement_type == 'IN' else '出库')
-        ws.cell(row=row, column=6, value=movement.quantity)
-        ws.cell(row=row, column=7, value=movement.notes)
-        ws.cell(row=row, column=8, value=movement.created_at.strftime('%Y-%m-%d %H:%M:%S'))
-    
-    # 设置列宽
-    for col in range(1, len(headers) + 1):
-        ws.column_dimensions[openpyxl.utils.get_column_letter(col)].width = 20
-    
-    # 保存到内存中
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    
-    # 返回文件
-    response = HttpResponse(buffer.read(), content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = f'attachment; filename=stock_movements_{datetime.now().strftime("%Y%m%d%H%M%S")}.xlsx'
-    return response
+    def rows():
+        # 分批读取库存变动记录，产品和仓库字段通过JOIN一并取出
+        stock_movements = iter_rows(
+            StockMovement.objects.order_by('-date', '-created_at'),
+            'date', 'product__sku', 'product__name', 'warehouse__name', 'warehouse__code',
+            'movement_type', 'quantity', 'notes', 'created_at'
+        )
+        for movement_date, sku, name, warehouse_name, warehouse_code, movement_type, quantity, notes, created_at in stock_movements:
+            yield [
+                movement_date.strftime('%Y-%m-%d'), sku, name,
+                f"{warehouse_name} ({warehouse_code})",
+                '入库' if movement_type == 'IN' else '出库',
+                quantity, notes, created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            ]
+    
+    return export_response(
+        request, f'stock_movements_{datetime.now().strftime("%Y%m%d%H%M%S")}',
+        "库存变动", headers, rows(), column_types=['string'] * 5 + ['int64'] + ['string'] * 2
+    )
 
 @login_required
+@condition(etag_func=data_etag('export_historical_stock', HISTORICAL_STOCK_MODELS),
+           last_modified_func=data_last_modified(HISTORICAL_STOCK_MODELS))
 def export_historical_stock(request):
     """导出历史库存数据"""
     # 获取日期参数，默认为今天
@@ -1601,13 +1157,8 @@ def export_historical_stock(request):
     except ValueError:
         selected_date = timezone.now().date()
     
-    # 创建一个新的工作簿
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = f"历史库存_{selected_date.strftime('%Y-%m-%d')}"
-    
     # 获取所有仓库
-    warehouses = Warehouse.objects.all()
+    warehouses = list(Warehouse.objects.all())
     
     # 设置表头
     headers = ['产品SKU', '产品名称', '重量(lb)', '尺寸(inch)']
@@ -1615,79 +1166,121 @@ def export_historical_stock(request):
         headers.append(f"{warehouse.name} ({warehouse.code})")
     headers.append('总库存')
     
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col)
-        cell.value = header
-        cell.font = Font(bold=True)
-        cell.fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
-    
-    # 获取所有产品
-    products = Product.objects.all()
-    
-    # 添加数据
-    for row, product in enumerate(products, 2):
-        ws.cell(row=row, column=1, value=product.sku)
-        ws.cell(row=row, column=2, value=product.name)
-        ws.cell(row=row, column=3, value=float(product.weight))
-        ws.cell(row=row, column=4, value=f"{product.length} × {product.width} × {product.height}")
-        
-        # 计算每个仓库的历史库存
-        col_index = 5
-        total_stock = 0
-        for warehouse in warehouses:
-            # 计算截至所选日期的库存
-            stock_in = StockMovement.objects.filter(
-                product=product,
-                warehouse=warehouse,
-                movement_type='IN',
-                date__lte=selected_date
-            ).aggregate(total=Sum('quantity'))['total'] or 0
-            
-            stock_out = StockMovement.objects.filter(
-                product=product,
-                warehouse=warehouse,
-                movement_type='OUT',
-                date__lte=selected_date
-            ).aggregate(total=Sum('quantity'))['total'] or 0
-            
-            warehouse_stock = stock_in - stock_out
-            total_stock += warehouse_stock
-            
-            ws.cell(row=row, column=col_index, value=warehouse_stock)
-            col_index += 1
-        
-        # 添加总库存
-        ws.cell(row=row, column=col_index, value=total_stock)
-    
-    # 设置列宽
-    for col in range(1, len(headers) + 1):
-        ws.column_dimensions[openpyxl.utils.get_column_letter(col)].width = 20
-    
-    # 保存到内存中
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    
-    # 返回文件
-    response = HttpResponse(buffer.read(), content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = f'attachment; filename=historical_stock_{selected_date.strftime("%Y%m%d")}.xlsx'
-    return response
+    # 读取最近的库存快照并加上之后的库存变动，计算截至所选日期的历史库存
+    stock_matrix = get_stock_matrix(warehouse_ids=[warehouse.id for warehouse in warehouses], as_of=selected_date)
+    empty_stock = {}
+    
+    def rows():
+        products = iter_rows(Product.objects.all(), 'id', 'sku', 'name', 'weight', 'length', 'width', 'height')
+        for product_id, sku, name, weight, length, width, height in products:
+            # 每个仓库的历史库存
+            stock = stock_matrix.get(product_id, empty_stock)
+            row = [sku, name, float(weight), f"{length} × {width} × {height}"]
+            row.extend(stock.get(warehouse.id, 0) for warehouse in warehouses)
+            row.append(stock.get('total', 0))
+            yield row
+    
+    return export_response(
+        request, f'historical_stock_{selected_date.strftime("%Y%m%d")}',
+        f"历史库存_{selected_date.strftime('%Y-%m-%d')}", headers, rows(),
+        column_types=['string', 'string', 'float64', 'string'] + ['int64'] * (len(warehouses) + 1)
+    )
 
 @login_required
 def search_products(request):
-    """API视图：根据关键字搜索产品"""
+    """API视图：根据关键字搜索产品（自动补全，按店铺SKU/FNSKU/产品SKU/系列前缀匹配）"""
     search_term = request.GET.get('term', '')
-    products = Product.objects.filter(sku__icontains=search_term)[:20]
     
     results = []
-    for product in products:
+    for product_id, text in autocomplete_products(search_term):
         results.append({
-            'id': product.id,
-            'text': f"{product.sku} ({product.name})"
+            'id': product_id,
+            'text': text
         })
     
     return JsonResponse({'results': results})
 
+# 库存位置接口依赖的表（库存余额由库存变动维护）
+STOCK_POSITION_MODELS = (Product, Warehouse, StockMovement, IncomingStock, ProductionOrder)
+
+def parse_since(value):
+    """解析 since 参数（ISO日期或日期时间），没有时区的按当前时区；格式错误时返回None"""
+    try:
+        since = parse_datetime(value)
+        if since is None:
+            day = parse_date(value)
+            if day is None:
+                return None
+            since = datetime.combine(day, time.min)
+    except ValueError:
+        return None
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+@login_required
+@condition(etag_func=data_etag('stock_positions', STOCK_POSITION_MODELS),
+           last_modified_func=data_last_modified(STOCK_POSITION_MODELS))
+def stock_positions(request):
+    """API视图：各产品的库存位置（JSON，列式）
+
+    sku 参数可重复或用逗号分隔；since 只返回此后有变化的产品，可以传入上次响应的 generated_at 做增量同步。
+    数据按相关表的数据版本缓存，数据未变化时轮询得到304。
+    """
+    skus = [sku.strip() for value in request.GET.getlist('sku') for sku in value.split(',') if sku.strip()]
+    since = None
+    if request.GET.get('since'):
+        since = parse_since(request.GET['since'])
+        if since is None:
+            return JsonResponse({'error': 'since 参数格式错误，应为ISO格式的日期或时间，如 2025-01-31 或 2025-01-31T08:00:00+08:00'},
+                                status=400)
+    
+    def compute():
+        # 在读取数据之前取时间，作为下次增量同步的 since 时不会漏掉读取期间的写入
+        generated_at = timezone.now()
+        positions = get_stock_positions(skus or None, since)
+        return {
+            'generated_at': generated_at.isoformat(),
+            'since': since.isoformat() if since else None,
+            'count': len(positions['sku']),
+            **positions,
+        }
+    
+    data = cached_context('stock_positions', request.GET, STOCK_POSITION_MODELS, compute, request)
+    return JsonResponse(data, json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+
+@login_required
+def search(request):
+    """全文搜索：产品、库存变动备注和入库途中备注，按相关度排序"""
+    query = request.GET.get('q', '').strip()
+    kind = request.GET.get('type', '')
+    if kind not in SEARCH_INDEXES:
+        kind = ''
+    
+    results = SearchResults(query, [kind] if kind else None)
+    if query and not split_terms(query)[0]:
+        messages.warning(request, f'请至少输入一个不少于{SEARCH_MIN_TERM_LENGTH}个字符的关键词。')
+    elif query and not search_index_available():
+        messages.warning(request, '全文索引的同步触发器缺失，搜索结果可能不是最新的，请管理员运行 python manage.py rebuild_search_index。')
+    
+    paginator = Paginator(results, SEARCH_RESULTS_PER_PAGE)
+    page_obj = paginator.get_page(request.GET.get('page'))
+    
+    # 翻页链接保留搜索词和类型
+    query_params = request.GET.copy()
+    query_params.pop('page', None)
+    
+    return render(request, 'inventory/search.html', {
+        'query': query,
+        'kind': kind,
+        'kinds': [(key, index['label'], results.counts[key]) for key, index in SEARCH_INDEXES.items()],
+        'total_count': sum(results.counts.values()),
+        'results': page_obj,
+        'page_obj': page_obj,
+        'paginator': paginator,
+        'page_query': query_params.urlencode(),
+    })
+
 @login_required
 def incoming_stock_batch_action(request):
     """处理入库途中产品的批量操作（删除和确认入库）"""
@@ -1695,43 +1288,22 @@ def incoming_stock_batch_action(request):
         selected_ids = request.POST.getlist('selected_items')
         action = request.POST.get('action', '')
         
-        print(f"接收到批量操作请求，操作类型: {action}, 选中的ID: {selected_ids}")
+        print(f"接收到批量操作请求，操作类型: {action}, 选中 {len(selected_ids)} 条记录")
         
         if not selected_ids:
             messages.error(request, '未选择任何入库途中产品记录。')
             return redirect('inventory:incoming_stock_list')
         
         if action == 'delete':
-            # 批量删除
-            deleted_count = 0
-            error_count = 0
-            orders_updated_count = 0
-            
-            for item_id in selected_ids:
-                try:
-                    item = IncomingStock.objects.get(pk=item_id)
-                    item_status = item.status
-                    item_sku = item.product.sku if item.product else "未知产品"
-                    item_warehouse = item.warehouse.code if item.warehouse else "未知仓库"
-                    
-                    # 如果是待入库状态，需要恢复生产订单数量
-                    if item.status == '待入库':
-                        try:
-                            # 恢复生产订单数量（传入负数表示增加）
-                            orders_updated = adjust_production_orders(item.product, -item.quantity)
-                            orders_updated_count += orders_updated
-                        except Exception as e:
-                            print(f"恢复生产订单数量时出错 ID={item_id}, 错误: {str(e)}")
-                    
-                    item.delete()
-                    deleted_count += 1
-                    print(f"成功删除入库途中产品记录 ID={item_id}, 产品={item_sku}, 仓库={item_warehouse}, 状态={item_status}")
-                except IncomingStock.DoesNotExist:
-                    error_count += 1
-                    print(f"入库途中产品记录不存在 ID={item_id}")
-                except Exception as e:
-                    error_count += 1
-                    print(f"删除入库途中产品记录时出错 ID={item_id}, 错误: {str(e)}")
+            # 批量删除：待入库的记录先按分配明细恢复生产订单数量，再一次删除所有选中的记录
+            try:
+                deleted_count, orders_updated_count = delete_incoming_stock(
+                    IncomingStock.objects.filter(pk__in=selected_pks(selected_ids))
+                )
+            except Exception as e:
+                messages.error(request, f'批量删除入库途中产品记录时出错: {str(e)}')
+                return redirect('inventory:incoming_stock_list')
+            missing_count = len(selected_pks(selected_ids)) - deleted_count
             
             if deleted_count > 0:
                 if orders_updated_count > 0:
@@ -1741,62 +1313,12 @@ def incoming_stock_batch_action(request):
             else:
                 messages.warning(request, '没有删除任何入库途中产品记录。')
                 
-            if error_count > 0:
-                messages.warning(request, f'有 {error_count} 条记录删除失败，请查看日志了解详情。')
+            if missing_count > 0:
+                messages.warning(request, f'有 {missing_count} 条记录不存在或已被删除。')
         
         elif action == 'approve':
             # 批量确认入库
-            approved_count = 0
-            skipped_count = 0
-            error_count = 0
-            
-            for item_id in selected_ids:
-                try:
-                    incoming_stock = IncomingStock.objects.get(pk=item_id)
-                    
-                    # 只处理待入库状态的记录
-                    if incoming_stock.status != '待入库':
-                        print(f"跳过非待入库状态的记录 ID={item_id}, 产品={incoming_stock.product.sku}, 仓库={incoming_stock.warehouse.code}, 状态={incoming_stock.status}")
-                        skipped_count += 1
-                        continue
-                    
-                    # 创建库存变动记录
-                    movement = StockMovement.objects.create(
-                        product=incoming_stock.product,
-                        warehouse=incoming_stock.warehouse,
-                        movement_type='IN',
-                        quantity=incoming_stock.quantity,
-                        date=timezone.now().date(),
-                        notes=f'由入库途中记录批量转入：{incoming_stock.notes}'
-                    )
-                    
-                    print(f"创建库存变动记录 ID={movement.id}, 产品={incoming_stock.product.sku}, 仓库={incoming_stock.warehouse.code}, 数量={incoming_stock.quantity}")
-                    
-                    # 更新入库途中记录状态
-                    incoming_stock.status = '已入库'
-                    incoming_stock.save()
-                    
-                    # 不再扣减生产订单剩余数量，因为这个扣减已经在创建入库途中产品时完成
-                    
-                    approved_count += 1
-                    print(f"成功确认入库记录 ID={item_id}, 产品={incoming_stock.product.sku}, 仓库={incoming_stock.warehouse.code}")
-                except IncomingStock.DoesNotExist:
-                    error_count += 1
-                    print(f"入库途中产品记录不存在 ID={item_id}")
-                except Exception as e:
-                    error_count += 1
-                    print(f"确认入库途中产品记录时出错 ID={item_id}, 错误: {str(e)}")
-            
-            if approved_count > 0:
-                messages.success(request, f'成功确认入库 {approved_count} 条入库途中产品记录。')
-            else:
-                messages.warning(request, '没有确认入库任何入库途中产品记录。')
-            
-            if skipped_count > 0:
-                messages.info(request, f'跳过了 {skipped_count} 条非待入库状态的记录。')
-                
-            if error_count > 0:
-                messages.warning(request, f'有 {error_count} 条记录处理失败，请查看日志了解详情。')
+            approve_selected_incoming_stock(request, selected_ids)
         
         else:
             messages.error(request, '未知的操作类型。')
@@ -1805,6 +1327,9 @@ def incoming_stock_batch_action(request):
     
     return redirect('inventory:incoming_stock_list')
 
+# 生产订单列表依赖的表
+PRODUCTION_ORDER_LIST_MODELS = (Product, Warehouse, ProductionOrder, IncomingStock)
+
 @login_required
 def production_order_list(request):
     """生产订单列表视图"""
@@ -1824,34 +1349,16 @@ def production_order_list(request):
     if sort_by not in valid_sort_fields:
         sort_by = '-created_at'  # 如果排序字段无效，回退到默认排序
     
-    # 应用排序
-    production_orders = ProductionOrder.objects.all().order_by(sort_by)
-    
-    # 计算每个产品的在途数量
-    products = Product.objects.all()
-    product_incoming_stock = {}
+    # 应用排序，一次查询取出产品
+    production_orders = ProductionOrder.objects.select_related('product').order_by(sort_by)
     
-    # 获取所有待入库的入库途中产品
-    incoming_stocks = IncomingStock.objects.filter(status='待入库')
-    
-    # 初始化产品在途数据字典
-    for product in products:
-        product_incoming_stock[product.id] = {
-            'GA': 0,
-            'CA': 0,
-            'total': 0
-        }
-    
-    # 计算每个产品的在途数量
-    for incoming in incoming_stocks:
-        if incoming.product.id in product_incoming_stock:
-            if incoming.warehouse.code == 'GA':
-                product_incoming_stock[incoming.product.id]['GA'] += incoming.quantity
-            elif incoming.warehouse.code == 'CA':
-                product_incoming_stock[incoming.product.id]['CA'] += incoming.quantity
-            product_incoming_stock[incoming.product.id]['total'] += incoming.quantity
+    # 计算每个产品的在途数量；表格按数据版本缓存，命中缓存时不查询
+    product_incoming_stock = SimpleLazyObject(
+        lambda: get_incoming_stock_by_product(Product.objects.values_list('id', flat=True))
+    )
     
     return render(request, 'inventory/production_order_list.html', {
+        **fragment_cache_context('production_order_list', request.GET, PRODUCTION_ORDER_LIST_MODELS),
         'production_orders': production_orders,
         'product_incoming_stock': product_incoming_stock,
         'sort_by': sort_by,
@@ -1875,24 +1382,24 @@ def production_order_create(request):
 def production_order_edit(request, pk):
     """编辑生产订单"""
     production_order = get_object_or_404(ProductionOrder, pk=pk)
+    # 表单绑定会修改实例的字段，必须在绑定前记录原始数量
+    original_quantity = production_order.quantity
     
     if request.method == 'POST':
         form = ProductionOrderForm(request.POST, instance=production_order)
         if form.is_valid():
-            # 保存前记录原始数量
-            original_quantity = production_order.quantity
             new_quantity = form.cleaned_data['quantity']
             
-            # 如果数量发生变化，相应调整剩余数量
-            if new_quantity != original_quantity:
-                # 计算差值比例
-                ratio = new_quantity / original_quantity
-                # 按比例调整剩余数量
-                production_order.remaining_quantity = int(production_order.remaining_quantity * ratio)
-            
-            form.save()
-            messages.success(request, '生产订单更新成功！')
-            return redirect('inventory:production_order_list')
+            # 已分配给入库途中记录的数量保持不变，订单数量不能少于已分配数量
+            allocated = original_quantity - production_order.remaining_quantity
+            if new_quantity < allocated:
+                form.add_error('quantity', f'该订单已有 {allocated} 件分配给入库途中记录，数量不能少于 {allocated}')
+            else:
+                # 剩余数量按差额调整
+                production_order.remaining_quantity += new_quantity - original_quantity
+                form.save()
+                messages.success(request, '生产订单更新成功！')
+                return redirect('inventory:production_order_list')
     else:
         form = ProductionOrderForm(instance=production_order)
     
@@ -1919,25 +1426,16 @@ def production_order_batch_delete(request):
             messages.error(request, '未选择任何生产订单。')
             return redirect('inventory:production_order_list')
         
-        deleted_count = 0
-        error_count = 0
-        
-        for order_id in selected_ids:
-            try:
-                order = ProductionOrder.objects.get(pk=order_id)
-                order.delete()
-                deleted_count += 1
-            except ProductionOrder.DoesNotExist:
-                error_count += 1
-            except Exception as e:
-                error_count += 1
-                print(f"删除生产订单时出错 ID={order_id}, 错误: {str(e)}")
+        # 订单的分配明细随订单级联删除
+        _, deleted = ProductionOrder.objects.filter(pk__in=selected_pks(selected_ids)).delete()
+        deleted_count = deleted.get(ProductionOrder._meta.label, 0)
+        missing_count = len(selected_pks(selected_ids)) - deleted_count
         
         if deleted_count > 0:
             messages.success(request, f'成功删除 {deleted_count} 条生产订单。')
         
-        if error_count > 0:
-            messages.warning(request, f'有 {error_count} 条记录删除失败。')
+        if missing_count > 0:
+            messages.warning(request, f'有 {missing_count} 条记录不存在或已被删除。')
         
         return redirect('inventory:production_order_list')
     
@@ -1986,145 +1484,28 @@ def download_production_order_template(request):
 def import_production_orders(request):
     """导入生产订单"""
     if request.method == 'POST' and request.FILES.get('file'):
-        try:
-            excel_file = request.FILES['file']
-            df = pd.read_excel(excel_file)
-            
-            # 打印列名，用于调试
-            print("Excel文件列名:", df.columns.tolist())
-            
-            # 验证必要的列是否存在
-            required_columns = ['店铺SKU', '订单号', '数量']
-            for col in required_columns:
-                if col not in df.columns:
-                    messages.error(request, f'缺少必要的列: {col}')
-                    return redirect('inventory:production_order_list')
-            
-            success_count = 0
-            error_count = 0
-            error_messages = []
-            
-            for index, row in df.iterrows():
-                try:
-                    # 打印当前行数据，用于调试
-                    print(f"处理第{index+2}行: {dict(row)}")
-                    
-                    # 验证店铺SKU
-                    sku = str(row['店铺SKU']).strip()
-                    if not sku:
-                        error_messages.append(f'第{index+2}行: 店铺SKU不能为空')
-                        error_count += 1
-                        continue
-                    
-                    # 验证订单号
-                    order_number = str(row['订单号']).strip()
-                    if not order_number:
-                        error_messages.append(f'第{index+2}行: 订单号不能为空')
-                        error_count += 1
-                        continue
-                    
-                    # 验证数量
-                    try:
-                        quantity = int(row['数量'])
-                        if quantity <= 0:
-                            error_messages.append(f'第{index+2}行: 数量必须为正整数')
-                            error_count += 1
-                            continue
-                    except:
-                        error_messages.append(f'第{index+2}行: 数量必须为整数')
-                        error_count += 1
-                        continue
-                    
-                    # 查找产品
-                    try:
-                        product = Product.objects.get(sku=sku)
-                    except Product.DoesNotExist:
-                        error_messages.append(f'第{index+2}行: 找不到店铺SKU为 {sku} 的产品')
-                        error_count += 1
-                        continue
-                    
-                    # 检查是否已存在相同订单号的生产订单
-                    existing_order = ProductionOrder.objects.filter(order_number=order_number, product=product).first()
-                    if existing_order:
-                        error_messages.append(f'第{index+2}行: 产品 {sku} 已存在订单号为 {order_number} 的生产订单')
-                        error_count += 1
-                        continue
-                    
-                    # 创建生产订单
-                    ProductionOrder.objects.create(
-                        product=product,
-                        order_number=order_number,
-                        quantity=quantity,
-                        remaining_quantity=quantity
-                    )
-                    
-                    success_count += 1
-                    
-                except Exception as e:
-                    error_count += 1
-                    error_messages.append(f'第{index+2}行: 处理时出错 - {str(e)}')
-                    print(f"导入生产订单时出错: {str(e)}")
-            
-            if success_count > 0:
-                messages.success(request, f'成功导入 {success_count} 条生产订单记录。')
-            
-            if error_count > 0:
-                messages.warning(request, f'导入过程中有 {error_count} 条记录出错。')
-                for error in error_messages[:10]:  # 只显示前10条错误信息
-                    messages.warning(request, error)
-                if len(error_messages) > 10:
-                    messages.warning(request, f'... 还有 {len(error_messages) - 10} 条错误信息未显示')
-            
-            return redirect('inventory:production_order_list')
-            
-        except Exception as e:
-            messages.error(request, f'导入文件时出错: {str(e)}')
-            return redirect('inventory:production_order_list')
+        return enqueue_import(request, 'production_orders')
     
     return render(request, 'inventory/production_order_import.html')
 
+EXPORT_PRODUCTION_ORDERS_MODELS = (ProductionOrder, Product)
+
 @login_required
+@condition(etag_func=data_etag('export_production_orders', EXPORT_PRODUCTION_ORDERS_MODELS),
+           last_modified_func=data_last_modified(EXPORT_PRODUCTION_ORDERS_MODELS))
 def export_production_orders(request):
     """导出生产订单"""
-    # 创建一个新的工作簿
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "生产订单"
-    
     # 设置表头
     headers = ['店铺SKU', '产品SKU', '订单号', '总数量', '剩余数量', '创建时间']
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num)
-        cell.value = header
-        cell.font = Font(bold=True)
-        cell.fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
     
-    # 获取所有生产订单
-    production_orders = ProductionOrder.objects.all().order_by('-created_at')
-    
-    # 添加数据
-    for row_num, order in enumerate(production_orders, 2):
-        ws.cell(row=row_num, column=1, value=order.product.sku)
-        ws.cell(row=row_num, column=2, value=order.product.name)
-        ws.cell(row=row_num, column=3, value=order.order_number)
-        ws.cell(row=row_num, column=4, value=order.quantity)
-        ws.cell(row=row_num, column=5, value=order.remaining_quantity)
-        ws.cell(row=row_num, column=6, value=order.created_at.strftime('%Y-%m-%d %H:%M'))
-    
-    # 设置列宽
-    for col_num in range(1, len(headers) + 1):
-        ws.column_dimensions[get_column_letter(col_num)].width = 15
-    
-    # 保存到内存中
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    
-    # 创建响应
-    response = HttpResponse(
-        buffer.getvalue(),
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
-    response['Content-Disposition'] = 'attachment; filename=production_orders.xlsx'
+    def rows():
+        production_orders = iter_rows(
+            ProductionOrder.objects.order_by('-created_at'),
+            'product__sku', 'product__name', 'order_number', 'quantity', 'remaining_quantity', 'created_at'
+        )
+        for sku, name, order_number, quantity, remaining_quantity, created_at in production_orders:
+            yield [sku, name, order_number, quantity, remaining_quantity, created_at.strftime('%Y-%m-%d %H:%M')]
     
-    return response
+    return export_response(request, 'production_orders', "生产订单", headers, rows(),
+                           column_types=['string'] * 3 + ['int64'] * 2 + ['string'],
+                           column_width=15, header_color='FFFF00')
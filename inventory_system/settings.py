@@ -44,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # 放在最前面，统计包括其他中间件在内的整个请求
+    'inventory.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -82,10 +84,32 @@ WSGI_APPLICATION = 'inventory_system.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# SQLite连接参数，每个新连接通过 init_command 执行一次：
+# WAL日志模式下读写互不阻塞，后台导入期间页面照常读取；WAL下 synchronous=NORMAL 不会损坏数据库，
+# 只在断电时可能丢失最后提交的事务。busy_timeout 为等待写锁的毫秒数，超时后才报 database is locked；
+# cache_size 为每个连接的页缓存（KiB），mmap_size 为内存映射读取的字节数。
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('INVENTORY_SQLITE_BUSY_TIMEOUT', 5000))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get('INVENTORY_SQLITE_CACHE_SIZE', 64 * 1024))
+SQLITE_MMAP_SIZE = int(os.environ.get('INVENTORY_SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': SQLITE_BUSY_TIMEOUT_MS,
+    # 负数表示以KiB为单位
+    'cache_size': -SQLITE_CACHE_SIZE_KB,
+    'mmap_size': SQLITE_MMAP_SIZE,
+    'temp_store': 'MEMORY',
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+            # 事务开始时就获取写锁：默认的DEFERRED事务先读后写时，升级写锁失败会直接报错而不等待busy_timeout
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
@@ -127,6 +151,113 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 
+# 上传文件（导入任务的Excel文件保存在这里，由后台导入进程读取）
+MEDIA_URL = 'media/'
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# 列表页批量操作时每个选中项是一个表单字段，默认上限1000不足以一次删除数千条记录
+DATA_UPLOAD_MAX_NUMBER_FIELDS = 20000
+
+# 页面缓存（inventory.cache），缓存键包含相关表的数据版本号，写入后自动失效
+# INVENTORY_CACHE_BACKEND 选择后端：locmem（默认，每个进程一份）、file（同一台机器的多个进程共享）
+# 或 redis（Redis或兼容协议的本地服务，如Valkey/KeyDB，需要安装redis包）；INVENTORY_CACHE_LOCATION 为目录或URL
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'inventory',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('INVENTORY_CACHE_LOCATION', os.path.join(BASE_DIR, 'cache')),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('INVENTORY_CACHE_LOCATION', 'redis://127.0.0.1:6379/1'),
+    },
+}
+CACHES = {
+    'default': CACHE_BACKENDS[os.environ.get('INVENTORY_CACHE_BACKEND', 'locmem')],
+}
+VIEW_CACHE_ALIAS = 'default'
+# 秒；版本号变化后旧条目不再被读取，过期时间只用于回收空间
+VIEW_CACHE_TIMEOUT = 3600
+
+# 请求性能预算（inventory.middleware.RequestMetricsMiddleware）
+# 按URL名称配置：queries 查询次数、db_ms 数据库耗时、total_ms 总耗时（毫秒）、response_bytes 响应大小；
+# 超出预算的请求记录到 inventory.performance 日志。列表页的查询次数不应随数据量增长。
+# 每个URL的预算在 'default' 的基础上覆盖，值为 None 表示不限制该项；
+# inventory 的每个URL名称都必须在这里列出（测试会检查），其他URL（admin、登录等）只使用 'default'。
+REQUEST_METRICS_ENABLED = True
+REQUEST_BUDGETS = {
+    'default': {'queries': 50, 'db_ms': 500, 'total_ms': 2000},
+    # 列表和统计页面
+    'inventory:dashboard': {'queries': 15, 'total_ms': 1000},
+    'inventory:product_list': {'queries': 10, 'total_ms': 1000},
+    'inventory:warehouse_list': {'queries': 5},
+    'inventory:stock_movement_list': {'queries': 8, 'total_ms': 500},
+    'inventory:historical_stock': {'queries': 10, 'total_ms': 1000},
+    'inventory:incoming_stock_list': {'queries': 15, 'total_ms': 1000},
+    'inventory:production_order_list': {'queries': 12, 'total_ms': 1000},
+    'inventory:import_job_detail': {'queries': 5, 'total_ms': 500},
+    # 搜索和接口
+    'inventory:search_products': {'queries': 5, 'total_ms': 200},
+    'inventory:search': {'queries': 10, 'total_ms': 500},
+    'inventory:import_job_status': {'queries': 5, 'total_ms': 200},
+    'inventory:stock_positions': {'queries': 10, 'total_ms': 1000},
+    # 新增、编辑和单条删除（GET显示表单，POST写入一条记录及其关联数据）
+    'inventory:product_create': {'queries': 20, 'total_ms': 1000},
+    'inventory:product_edit': {'queries': 20, 'total_ms': 1000},
+    'inventory:product_delete': {'queries': 20, 'total_ms': 1000},
+    'inventory:warehouse_create': {'queries': 20, 'total_ms': 1000},
+    'inventory:warehouse_edit': {'queries': 20, 'total_ms': 1000},
+    'inventory:warehouse_delete': {'queries': 20, 'total_ms': 1000},
+    'inventory:stock_movement_create': {'queries': 20, 'total_ms': 1000},
+    'inventory:stock_movement_delete': {'queries': 20, 'total_ms': 1000},
+    'inventory:incoming_stock_create': {'queries': 30, 'total_ms': 1000},
+    'inventory:incoming_stock_edit': {'queries': 30, 'total_ms': 1000},
+    'inventory:incoming_stock_delete': {'queries': 30, 'total_ms': 1000},
+    'inventory:incoming_stock_approve': {'queries': 20, 'total_ms': 1000},
+    'inventory:production_order_create': {'queries': 20, 'total_ms': 1000},
+    'inventory:production_order_edit': {'queries': 20, 'total_ms': 1000},
+    'inventory:production_order_delete': {'queries': 20, 'total_ms': 1000},
+    # 导入模板是固定内容
+    'inventory:download_product_template': {'queries': 5, 'total_ms': 500},
+    'inventory:download_stock_movement_template': {'queries': 5, 'total_ms': 500},
+    'inventory:download_incoming_stock_template': {'queries': 5, 'total_ms': 500},
+    'inventory:download_production_order_template': {'queries': 5, 'total_ms': 500},
+    # 导出的耗时随数据量增长，只限制查询次数
+    'inventory:export_products': {'queries': 10, 'total_ms': None},
+    'inventory:export_stock_movements': {'queries': 5, 'total_ms': None},
+    'inventory:export_historical_stock': {'queries': 10, 'total_ms': None},
+    'inventory:export_incoming_stock': {'queries': 5, 'total_ms': None},
+    'inventory:export_production_orders': {'queries': 5, 'total_ms': None},
+    # 导入和批量操作的语句数与文件行数/选中记录数有关
+    'inventory:import_products': {'queries': None, 'total_ms': None},
+    'inventory:stock_movement_import': {'queries': None, 'total_ms': None},
+    'inventory:import_incoming_stock': {'queries': None, 'total_ms': None},
+    'inventory:import_production_orders': {'queries': None, 'total_ms': None},
+    'inventory:product_batch_delete': {'queries': None, 'total_ms': 5000},
+    'inventory:warehouse_batch_delete': {'queries': None, 'total_ms': 5000},
+    'inventory:stock_movement_batch_delete': {'queries': None, 'total_ms': 5000},
+    'inventory:incoming_stock_batch_delete': {'queries': None, 'total_ms': 5000},
+    'inventory:production_order_batch_delete': {'queries': None, 'total_ms': 5000},
+    'inventory:incoming_stock_batch_action': {'queries': None, 'total_ms': 5000},
+    'inventory:incoming_stock_batch_approve': {'queries': None, 'total_ms': 5000},
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'inventory.performance': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 